@@ -0,0 +1,123 @@
+import os
+import gzip
+import random
+
+# Synthetic pages with the markup the find functions expect, every item
+# is generated from its index so pages are the same across runs/commits.
+PAGES_DIR = os.path.join(os.path.dirname(__file__), "pages")
+SIZES = (100, 1000, 10000)
+
+
+def tweet_article(i:int, handle:str="alice") -> str:
+    """Timeline tweet, i % 6 selects: photo, repost, quote+photo, reply, card, video"""
+    r = random.Random(i)
+    kind = i % 6
+    deep = "<div><div><div><div><div>" + ("<div>r</div>" if kind == 3 else "<span>x</span>") + "</div></div></div></div></div>"
+    social = '<a href="/bob"><span data-testid="socialContext">Bob reposted</span></a>' if kind == 1 else ""
+    avatars = '<div data-testid="Tweet-User-Avatar"></div>' * (2 if kind == 2 else 1)
+    name = f'<span><span>Alice {i}</span><img alt="😀" src="e.svg"><span>x<b>y</b></span></span>'
+    time_link = f'<a role="link" href="/{handle}/status/{i}"><time datetime="2024-01-{i % 28 + 1:02d}T00:00:00.000Z">Jan</time></a>'
+    header = f'<div data-testid="User-Name"><a role="link" href="/{handle}">{name}</a><a role="link" href="/{handle}"><span>@{handle}</span></a>{time_link}</div>'
+    text = ""
+    if kind != 4:
+        text = (f'<div data-testid="tweetText"><span>Hello "world"\n\t{i} {"lorem ipsum " * r.randint(0, 20)}</span>'
+            f'<img alt="🔥"><a href="https://t.co/{i}">link</a><span class="r-18u37iz"><a href="/hashtag/x">#x</a></span>'
+            '<div><span><a href="/bob">@bob</a></span></div><span></span></div>')
+    card = f'<div data-testid="card.wrapper"><a href="https://t.co/c{i}">c</a></div>' if kind == 4 else ""
+    video = '<div data-testid="videoComponent"><video></video></div>' if kind == 5 else ""
+    photo = f'<div data-testid="tweetPhoto"><img src="https://pbs.twimg.com/media/M{i}?format=jpg&amp;name=small"></div>' if kind in (0, 2) else ""
+    quote = f'<div role="link"><a role="link" href="/carol/status/{i + 100000}">q</a></div>' if kind == 2 else ""
+    stats = (f'<div class="css-175oi2r r-1" role="group" aria-label="{r.randint(0, 99)} replies, {r.randint(0, 99)} reposts, '
+        f'{i * 3} likes, 1 bookmarks, {i * 10} views"></div>')
+    return f'<article data-testid="tweet">{deep}{social}{avatars}{header}{text}{card}{video}{photo}{quote}{stats}</article>'
+
+
+def user_cell(i:int) -> str:
+    return (f'<button data-testid="UserCell"><a role="link" href="/u{i}"><span>x</span></a>'
+        f'<a role="link" href="/u{i}"><span><span>User {i}</span><img alt="⭐"></span></a>'
+        f'<a role="link" href="/u{i}"><span>@u{i}</span></a></button>')
+
+
+def media_cell(i:int) -> str:
+    """Media tab cell, every 5th is a multiple image post"""
+    if i % 5 == 0:
+        return f'<a role="link" href="/alice/status/{i}/photo/1"><img src="https://pbs.twimg.com/media/M{i}?format=jpg&amp;name=small"><svg></svg></a>'
+    return f'<a role="link" href="/alice/status/{i}/photo/1"><div><img src="https://pbs.twimg.com/media/M{i}?format=png&amp;name=small"></div></a>'
+
+
+def status_article(i:int, handle:str="alice") -> str:
+    """
+    Article of a status page (a post and its replies), i % 5 selects:
+    4 photos, 2 photos, a reply by someone else with 2 photos, 1 photo, a repost with 2 photos
+    """
+    kind = i % 5
+    handle = handle if kind != 2 else "bob"
+    photos = {0 : 4, 3 : 1}.get(kind, 2)
+    imgs = "".join(f'<div data-testid="tweetPhoto"><img src="https://pbs.twimg.com/media/S{i}x{j}?format=jpg&amp;name=small"></div>'
+        for j in range(photos))
+    social = '<a role="link" href="/bob"><span data-testid="socialContext">Bob reposted</span></a>' if kind == 4 else ""
+    return (f'<article data-testid="tweet">{social}<a role="link" href="/{handle}"><div><img src="https://pbs.twimg.com/profile_images/{i}/a.jpg"></div></a>'
+        f'<div data-testid="User-Name"><a role="link" href="/{handle}"><span>{handle}</span></a>'
+        f'<a role="link" href="/{handle}/status/{i}"><time datetime="2024-01-{i % 28 + 1:02d}T00:00:00.000Z">Jan</time></a></div>'
+        f'<div data-testid="tweetText"><span>Photos {i}</span></div>{imgs}</article>')
+
+
+def bsky_post(i:int, handle:str="bob.bsky.social") -> str:
+    """Feed post, i % 4 selects: image, quote, video, no text. Every 9th is by someone else"""
+    handle = handle if i % 9 else "other.bsky.social"
+    kind = i % 4
+    media = ""
+    if kind == 0:
+        media = f'<div><div><div><img src="https://cdn.bsky.app/img/feed_thumbnail/plain/did/b{i}@jpeg" alt="alt {i}"></div></div></div>'
+    elif kind == 1:
+        media = f'<div><div><div><div role="link" aria-label="Quote of {i}"></div></div></div></div>'
+    elif kind == 2:
+        media = '<div><div><div><video src="v"></video></div></div></div>'
+    text = f'<div data-testid="postText">Post {i} <a>#tag</a><span>more</span></div>' if kind != 3 else ""
+    repost = '<div data-testid="repostCount">3</div>' if kind != 2 else ""
+    return (f'<div data-testid="feedItem-by-{handle}" data-feed-context="ctx{i}"><div><div><div><div>'
+        f'<a aria-label="View profile">\u202aBob {i}\u202c</a></div></div></div>'
+        f'<div data-tooltip="Jan {i % 28 + 1}, 2024 at 1:00 PM"><a href="/profile/{handle}/post/r{i}">1h</a></div></div>'
+        f'<div data-testid="contentHider-post">{text}{media}</div>'
+        f'<button data-testid="replyBtn"><div>{i}</div></button>{repost}'
+        f'<button data-testid="likeBtn" aria-label="Like ({i * 2:,} likes)"></button></div>')
+
+
+def wrap(body:str) -> str:
+    return "<html><body><main>" + body + "</main></body></html>"
+
+
+# Markup of the i-th item of each kind of page
+KINDS = {
+    "twitter_timeline" : tweet_article,
+    "twitter_following" : user_cell,
+    "twitter_media" : media_cell,
+    "twitter_status" : status_article,
+    "bsky_feed" : bsky_post,
+}
+
+
+def items(kind:str, start:int, stop:int) -> list[str]:
+    return [KINDS[kind](i) for i in range(start, stop)]
+
+
+def page(kind:str, size:int) -> str:
+    return wrap("".join(items(kind, 0, size)))
+
+
+def load_page(kind:str, size:int, pages_dir:str=PAGES_DIR) -> str:
+    """Stored page of size items of kind, written the first time it's asked for"""
+    path = os.path.join(pages_dir, f"{kind}_{size}.html.gz")
+    if not os.path.exists(path):
+        os.makedirs(pages_dir, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(page(kind, size))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+if __name__ == "__main__":
+    for kind in KINDS:
+        for size in SIZES:
+            load_page(kind, size)
+            print(f"[INFO] {kind} {size}")
@@ -0,0 +1,51 @@
+# thirdparty
+from selenium.webdriver.common.keys import Keys
+# local imports
+from src.scroll import WATCH_JS, STATUS_JS
+from bench.fixtures import items, wrap
+
+
+class replay_driver:
+    """
+    Stands in for a WebDriver scrolling a feed of total items of kind.
+    Every PAGE_DOWN (sent with ActionChains) loads per_key more items,
+    page_source holds all the loaded items, or only the last window of
+    them for virtualized feeds (twitter timeline).
+    Also answers the adaptive_scroller scripts, ending at the last item.
+    """
+    def __init__(self, kind:str, total:int, *, per_key:int=4, window:int=0):
+        self.items = items(kind, 0, total)
+        self.per_key = per_key
+        self.window = window
+        self.loaded = 0
+        self.reported = 0
+        self.keys = 0
+        self.fetches = 0
+
+    @property
+    def page_source(self) -> str:
+        self.fetches += 1
+        start = max(0, self.loaded - self.window) if self.window > 0 else 0
+        return wrap("".join(self.items[start:self.loaded]))
+
+    def execute(self, command:str, params:dict=None) -> dict:
+        """Commands sent by ActionChains"""
+        for source in (params or {}).get("actions", []):
+            for action in source["actions"]:
+                if action["type"] == "keyDown" and action["value"] == Keys.PAGE_DOWN:
+                    self.keys += 1
+                    self.loaded = min(len(self.items), self.loaded + self.per_key)
+        return {"value" : None}
+
+    def execute_script(self, script:str, *args):
+        if script == WATCH_JS:
+            return None
+        if script == STATUS_JS:
+            added, self.reported = self.loaded - self.reported, self.loaded
+            height = 200 * max(1, self.loaded)
+            return {
+                "added" : added, "items" : self.loaded, "spinner" : False,
+                "y" : height - 900 if self.loaded == len(self.items) else 0,
+                "view" : 900, "height" : height,
+            }
+        raise NotImplementedError(script[:40])
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+import os
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import functools
+import tracemalloc
+import contextlib
+import subprocess
+# local imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.common import continuously_scroll, dedup_index, feed_items
+from src.scroll import adaptive_scroller
+from src.fast_parse import BACKENDS, parse_memo
+from src import twitter_context as twitter, bsky_context as bsky
+from bench.fixtures import KINDS, SIZES, load_page
+from bench.replay import replay_driver
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BSKY_AUTHOR = "bob.bsky.social"
+
+# What each kind of page is scraped with: (module, find function, args, key function, item xpath)
+SCRAPERS = {
+    "twitter_timeline" : (twitter, "tweets", (), twitter.tweet_key, twitter.TWEET_XPATH),
+    "twitter_following" : (twitter, "users", (), twitter.user_key, twitter.USER_XPATH),
+    "twitter_media" : (twitter, "images_media", (), twitter.media_key, None),
+    "twitter_status" : (twitter, "images_post", ("alice", ), twitter.media_key, twitter.TWEET_XPATH),
+    "bsky_feed" : (bsky, "tweets", (BSKY_AUTHOR, ), bsky.post_key, bsky.POST_XPATH),
+}
+# Only the timeline is virtualized, the others keep every item loaded
+WINDOWS = {"twitter_timeline" : 40}
+
+
+def find_func(kind:str, backend:str):
+    module, name, args, _, _ = SCRAPERS[kind]
+    return module.PARSERS[backend][name], args
+
+
+def measure(func, *args, repeat:int=3) -> dict:
+    """Best time of repeat calls of func(*args), and peak memory of one more traced call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds" : best, "peak_kb" : peak / 1024, "result" : res}
+
+
+def bench_parse(sizes:list, repeat:int) -> list[dict]:
+    """Parsing a whole page, per backend"""
+    results = []
+    for kind in KINDS:
+        for size in sizes:
+            page_source = load_page(kind, size)
+            for backend in BACKENDS:
+                func, args = find_func(kind, backend)
+                m = measure(func, page_source, *args, repeat=repeat)
+                results.append({
+                    "bench" : "parse", "kind" : kind, "size" : size, "variant" : backend,
+                    "seconds" : m["seconds"], "per_item_us" : m["seconds"] / size * 1e6,
+                    "items" : len(m["result"]), "peak_kb" : m["peak_kb"],
+                })
+                print(f"[INFO] parse {kind} {size} {backend}: {m['seconds'] * 1e3:.1f}ms")
+    return results
+
+
+def bench_text(sizes:list, repeat:int) -> list[dict]:
+    """get_text_with_emojis of every tweet text, per backend"""
+    from bs4 import BeautifulSoup
+    from src.fast_parse import parse_html
+    results = []
+    for size in sizes:
+        page_source = load_page("twitter_timeline", size)
+        tags = {
+            "bs4" : (twitter.get_text_with_emojis, BeautifulSoup(page_source, features="lxml").find_all("div", {"data-testid" : "tweetText"})),
+            "lxml" : (twitter.get_text_with_emojis_lxml, twitter.RULES["text"](parse_html(page_source))),
+        }
+        for backend, (func, texts) in tags.items():
+            m = measure(lambda: [func(tag) for tag in texts], repeat=repeat)
+            results.append({
+                "bench" : "text", "kind" : "twitter_timeline", "size" : size, "variant" : backend,
+                "seconds" : m["seconds"], "per_item_us" : m["seconds"] / max(1, len(texts)) * 1e6,
+                "items" : len(texts), "peak_kb" : m["peak_kb"],
+            })
+            print(f"[INFO] text {size} {backend}: {m['seconds'] * 1e3:.1f}ms")
+    return results
+
+
+def bench_dedup(sizes:list, repeat:int) -> list[dict]:
+    """Adding every item twice (new, then repeated) to a dedup_index"""
+    results = []
+    for kind in KINDS:
+        _, _, _, key_func, _ = SCRAPERS[kind]
+        for size in sizes:
+            func, args = find_func(kind, "lxml")
+            parsed = func(load_page(kind, size), *args)
+            for keep_items in (True, False):
+                def fill():
+                    index = dedup_index(key_func, update_seen=True, keep_items=keep_items)
+                    for item in parsed + parsed:
+                        index.add(item)
+                    return index
+                m = measure(fill, repeat=repeat)
+                results.append({
+                    "bench" : "dedup", "kind" : kind, "size" : size,
+                    "variant" : "items" if keep_items else "hashes",
+                    "seconds" : m["seconds"], "per_item_us" : m["seconds"] / max(1, 2 * len(parsed)) * 1e6,
+                    "items" : len(m["result"]), "peak_kb" : m["peak_kb"],
+                })
+                print(f"[INFO] dedup {kind} {size} {'items' if keep_items else 'hashes'}: {m['seconds'] * 1e3:.1f}ms")
+    return results
+
+
+def bench_scroll(sizes:list, repeat:int) -> list[dict]:
+    """continuously_scroll over a replayed feed, with and without delta parsing"""
+    results = []
+    for kind in KINDS:
+        _, _, _, key_func, xpath = SCRAPERS[kind]
+        func, args = find_func(kind, "lxml")
+        for size in sizes:
+            for variant in ("full", "delta"):
+                if variant == "delta" and xpath == None:
+                    continue
+                drivers = []
+                def scroll():
+                    driver = replay_driver(kind, size, window=WINDOWS.get(kind, 0))
+                    drivers.append(driver)
+                    delta = feed_items(xpath) if variant == "delta" else None
+                    scroller = adaptive_scroller(xpath, min_delay=0., end_after=0.)
+                    # Like twitter_context.process, with a fresh memo every run
+                    f = functools.partial(func, memo=parse_memo()) if kind == "twitter_timeline" else func
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        things, _ = continuously_scroll(driver, 3600., f, *args, delta=delta,
+                                index=dedup_index(key_func, update_seen=True), scroller=scroller)
+                    return things
+                m = measure(scroll, repeat=repeat)
+                results.append({
+                    "bench" : "scroll", "kind" : kind, "size" : size, "variant" : variant,
+                    "seconds" : m["seconds"], "per_item_us" : m["seconds"] / size * 1e6,
+                    "items" : len(m["result"]), "peak_kb" : m["peak_kb"],
+                    "page_sources" : drivers[-1].fetches,
+                })
+                print(f"[INFO] scroll {kind} {size} {variant}: {m['seconds'] * 1e3:.1f}ms")
+    return results
+
+
+BENCHES = {
+    "parse" : bench_parse,
+    "text" : bench_text,
+    "dedup" : bench_dedup,
+    "scroll" : bench_scroll,
+}
+
+
+def git_commit() -> str:
+    try:
+        res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return res.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(benches:list, sizes:list, scroll_sizes:list, repeat:int, out_dir:str) -> str:
+    """Runs benches, saves the results to out_dir and returns the file they are in"""
+    logging.getLogger().setLevel(logging.WARNING)
+    report = {
+        "commit" : git_commit(), "date" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python" : platform.python_version(), "platform" : platform.platform(),
+        "results" : [],
+    }
+    for name in benches:
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info(f"Running {name} benchmarks")
+        logging.getLogger().setLevel(logging.WARNING)
+        report["results"] += BENCHES[name](scroll_sizes if name == "scroll" else sizes, repeat)
+    logging.getLogger().setLevel(logging.INFO)
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{report['commit'] or 'nogit'}.json")
+    with open(out_file, "w") as file:
+        json.dump(report, file, indent=4)
+    logging.info(f"Results saved to: {out_file}")
+    return out_file
+
+
+def compare(old_file:str, new_file:str):
+    """Prints how the time of every benchmark changed between two result files"""
+    with open(old_file, "r") as file:
+        old = json.load(file)
+    with open(new_file, "r") as file:
+        new = json.load(file)
+    key = lambda r: (r["bench"], r["kind"], r["size"], r["variant"])
+    old_results = {key(r) : r for r in old["results"]}
+    print(f"{old['commit']} -> {new['commit']}")
+    for r in new["results"]:
+        before = old_results.get(key(r))
+        if before == None:
+            continue
+        ratio = r["seconds"] / before["seconds"] if before["seconds"] > 0 else float("inf")
+        print(f"{' '.join(map(str, key(r))):<48} {before['seconds'] * 1e3:>10.2f}ms {r['seconds'] * 1e3:>10.2f}ms {ratio:>6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench', description='Benchmarks parsing, dedup and scrolling on stored pages.')
+    parser.add_argument('-b', '--bench', nargs="+", default=list(BENCHES), choices=list(BENCHES), help="Benchmarks to run.")
+    parser.add_argument('-s', '--sizes', nargs="+", default=list(SIZES), type=int, help="Items per page.")
+    parser.add_argument('--scroll-sizes', nargs="+", default=[100, 1000], type=int, help="Items per scrolled feed, every scroll reparses the page.")
+    parser.add_argument('-r', '--repeat', default=3, type=int, help="Runs of each benchmark, the best one counts.")
+    parser.add_argument('-o', '--out', default=RESULTS_DIR, type=str, help="Directory to save the results in.")
+    parser.add_argument('-c', '--compare', nargs=2, default=None, help="Compare two result files instead of running.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    if args.compare != None:
+        compare(*args.compare)
+    else:
+        run(args.bench, args.sizes, args.scroll_sizes, args.repeat, args.out)
@@ -0,0 +1,145 @@
+import time
+import logging
+import dataclasses
+import concurrent.futures
+import multiprocessing
+
+
+@dataclasses.dataclass
+class batch_job:
+    site:str
+    user:str
+    data_type:str
+    # Same as socialmedia_context.timeout
+    timeout:float = 600.
+
+
+@dataclasses.dataclass
+class job_result:
+    job:batch_job
+    ok:bool
+    items:int = 0
+    elapsed:float = 0.
+    error:str = ""
+
+
+def read_jobs(path:str, default_timeout:float=600.) -> list[batch_job]:
+    """
+    Reads a jobs file, with one 'site user data_type [timeout]' job per line.
+    Use '-' as user for the home tab, lines starting with # are ignored.
+    """
+    jobs = []
+    with open(path, "r") as file:
+        for line in file.read().split("\n"):
+            line = line.strip()
+            if line == "" or line[0] == "#":
+                continue
+            fields = line.split()
+            if len(fields) < 3:
+                logging.error(f"Ignoring job '{line}', expected: site user data_type [timeout]")
+                continue
+            try:
+                timeout = float(fields[3]) if len(fields) > 3 else default_timeout
+            except ValueError:
+                logging.error(f"Ignoring job '{line}', bad timeout")
+                continue
+            user = "" if fields[1] == "-" else fields[1]
+            jobs.append(batch_job(fields[0], user, fields[2], timeout))
+    return jobs
+
+
+def run_job(job_func, job:batch_job) -> job_result:
+    start = time.time()
+    try:
+        n = job_func(job)
+        return job_result(job, True, n, time.time() - start)
+    except Exception as e:
+        logging.error(f"Job {job} failed: {e}")
+        return job_result(job, False, 0, time.time() - start, str(e))
+
+
+def run_batch(jobs:list[batch_job], job_func, *, workers:int=2, use_processes:bool=False,
+        grace:float=120.) -> list[job_result]:
+    """
+    Runs job_func(job) -> number of items found, for every job, with up to
+    workers jobs at the same time.
+    A job taking longer than job.timeout + grace seconds (its scroll timeout
+    plus startup/downloads) is reported as timed out. With threads it can
+    only be reported once it finishes, with use_processes it is killed.
+    """
+    if use_processes:
+        return run_batch_processes(jobs, job_func, workers, grace)
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job_func, job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if result.ok and (result.elapsed > result.job.timeout + grace):
+                result.ok = False
+                result.error = f"Timed out after {result.elapsed:.1f}s"
+            results.append(result)
+            logging.info(f"Finished {len(results)}/{len(jobs)} jobs")
+    return results
+
+
+def _process_main(job_func, job:batch_job, conn):
+    result = run_job(job_func, job)
+    conn.send(result)
+    conn.close()
+
+
+def run_batch_processes(jobs:list[batch_job], job_func, workers:int, grace:float) -> list[job_result]:
+    pending = list(jobs)
+    running = {}
+    results = []
+    while (len(pending) > 0) or (len(running) > 0):
+        # Fill the workers
+        while (len(pending) > 0) and (len(running) < workers):
+            job = pending.pop(0)
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_process_main, args=(job_func, job, send_conn))
+            proc.start()
+            send_conn.close()
+            running[proc] = (job, recv_conn, time.time())
+        # Collect finished/overdue ones
+        for proc in list(running):
+            job, conn, start = running[proc]
+            elapsed = time.time() - start
+            if conn.poll():
+                results.append(conn.recv())
+            elif not proc.is_alive():
+                results.append(job_result(job, False, 0, elapsed, f"Worker died with code {proc.exitcode}"))
+            elif elapsed > job.timeout + grace:
+                proc.terminate()
+                results.append(job_result(job, False, 0, elapsed, f"Timed out after {elapsed:.1f}s"))
+            else:
+                continue
+            proc.join()
+            conn.close()
+            del running[proc]
+            logging.info(f"Finished {len(results)}/{len(jobs)} jobs")
+        time.sleep(0.1)
+    return results
+
+
+def summarize(results:list[job_result], elapsed:float) -> dict:
+    """Throughput and failures of a batch that took elapsed seconds"""
+    ok = [r for r in results if r.ok]
+    items = sum(r.items for r in ok)
+    summary = {
+        "jobs" : len(results),
+        "ok" : len(ok),
+        "failed" : len(results) - len(ok),
+        "items" : items,
+        "elapsed" : elapsed,
+        "jobs_per_min" : 60. * len(results) / elapsed if elapsed > 0 else 0.,
+        "items_per_sec" : items / elapsed if elapsed > 0 else 0.,
+        "failures" : [dataclasses.asdict(r) for r in results if not r.ok],
+        "results" : [dataclasses.asdict(r) for r in results],
+    }
+    logging.info(f"{summary['ok']}/{summary['jobs']} jobs ok, {items} items in {elapsed:.1f}s "
+            f"({summary['jobs_per_min']:.1f} jobs/min, {summary['items_per_sec']:.1f} items/s)")
+    for r in results:
+        if not r.ok:
+            logging.error(f"Failed {r.job.site} {r.job.user} {r.job.data_type}: {r.error}")
+    return summary
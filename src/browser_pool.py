@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+import contextlib
+# thirdparty
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.common.exceptions import WebDriverException
+# thirdparty (optional)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+# local imports
+from src.common import base_url_of, login, open_browser
+
+
+class browser_session:
+    """A browser kept alive by browser_pool, and the sites it's logged in"""
+    def __init__(self, browser:WebDriver, lean:bool=False, bidi:bool=False):
+        self.browser = browser
+        self.lean = lean
+        self.bidi = bidi
+        self.logged_in = set()
+        self.uses = 0
+        self.created = time.time()
+
+    def healthy(self) -> bool:
+        try:
+            return len(self.browser.window_handles) > 0
+        except WebDriverException:
+            return False
+
+    def memory_mb(self) -> float:
+        """RSS of the browser (and driver) processes, 0 if it can't be known"""
+        if psutil == None:
+            return 0.
+        try:
+            proc = psutil.Process(self.browser.service.process.pid)
+            procs = [proc] + proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs) / 2**20
+        except (AttributeError, psutil.Error):
+            return 0.
+
+    def quit(self):
+        try:
+            self.browser.quit()
+        except WebDriverException:
+            pass
+
+
+class browser_pool:
+    """
+    Keeps up to max_sessions browsers open, so they can be reused across
+    targets (and sites) without paying for the browser startup and login again.
+    A session is recycled after max_uses, when it grows past max_memory_mb
+    (needs psutil) or when it stops responding.
+    """
+    def __init__(self, max_sessions:int=1, max_uses:int=20, max_memory_mb:float=2048.):
+        self.max_sessions = max_sessions
+        self.max_uses = max_uses
+        self.max_memory_mb = max_memory_mb
+        self.idle = []
+        self.busy = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, url:str, cookie_path:str, lean:bool=False, bidi:bool=False) -> browser_session:
+        """
+        Takes an idle session with the same profile (see browser_options),
+        or opens a new one, logged in url's site
+        """
+        stale = None
+        with self.cond:
+            while True:
+                same = [s for s in self.idle if (s.lean == lean) and (s.bidi == bidi)]
+                if len(same) > 0:
+                    session = same[-1]
+                    self.idle.remove(session)
+                    break
+                session = None
+                if self.busy + len(self.idle) < self.max_sessions:
+                    break
+                if len(self.idle) > 0:
+                    # Make room for a session with the other profile
+                    stale = self.idle.pop(0)
+                    break
+                self.cond.wait()
+            self.busy += 1
+        try:
+            if stale != None:
+                stale.quit()
+            if (session != None) and (not session.healthy()):
+                logging.warning("Dropping dead pooled browser")
+                session.quit()
+                session = None
+            if session == None:
+                logging.info("Opening new pooled browser")
+                session = browser_session(open_browser(lean, bidi), lean, bidi)
+            base_url = base_url_of(url)
+            if os.path.exists(cookie_path) and (base_url not in session.logged_in):
+                login(session.browser, url, cookie_path)
+                session.logged_in.add(base_url)
+        except Exception:
+            with self.cond:
+                self.busy -= 1
+                self.cond.notify()
+            raise
+        session.uses += 1
+        return session
+
+    def release(self, session:browser_session):
+        """Gives back a session, quitting it if it has to be recycled"""
+        recycle = False
+        if session.uses >= self.max_uses:
+            logging.info(f"Recycling browser after {session.uses} uses")
+            recycle = True
+        elif not session.healthy():
+            logging.warning("Recycling unresponsive browser")
+            recycle = True
+        else:
+            memory = session.memory_mb()
+            if memory > self.max_memory_mb:
+                logging.info(f"Recycling browser using {memory:.0f}MB")
+                recycle = True
+        if recycle:
+            session.quit()
+        with self.cond:
+            if not recycle:
+                self.idle.append(session)
+            self.busy -= 1
+            self.cond.notify()
+
+    @contextlib.contextmanager
+    def browser(self, url:str, cookie_path:str, lean:bool=False, bidi:bool=False):
+        session = self.acquire(url, cookie_path, lean, bidi)
+        try:
+            yield session.browser
+        finally:
+            self.release(session)
+
+    def close(self):
+        with self.cond:
+            sessions, self.idle = self.idle, []
+        for session in sessions:
+            session.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,142 @@
+import time
+import logging
+import dataclasses
+import concurrent.futures
+# thirdparty
+import requests
+# local imports
+from src.common import Info_type, collect_items
+from src.downloader import RETRY_STATUS, new_session, retry_after_of
+from src.bsky_context import bsky_context, post_from_api, images_from_api, user_from_api
+from src.metrics import get_metrics
+from src.ratelimit import get_limiter
+
+# Public AppView, serves the app.bsky.* XRPC endpoints without login
+API_BASE = "https://public.api.bsky.app"
+# Max items per page the endpoints allow
+PAGE_SIZE = 100
+
+
+class bsky_client:
+    """
+    Client of the bsky XRPC api, reusing connections from a pooled
+    session. Failed requests (connection errors, 429/5xx) are retried
+    with exponential backoff, honoring Retry-After.
+    """
+    def __init__(self, api_base:str=API_BASE, *, retries:int=3, backoff:float=0.5,
+            timeout:tuple=(10., 30.), session:requests.Session=None):
+        self.api_base = api_base.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session if session != None else new_session(4)
+        self.requests = 0
+
+    def get(self, method:str, **params) -> dict:
+        """Response of the XRPC query method, raises requests.HTTPError if it failed"""
+        url = f"{self.api_base}/xrpc/{method}"
+        params = {k: v for k, v in params.items() if v != None}
+        limiter = get_limiter()
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2**attempt
+            try:
+                limiter.wait(url)
+                with get_metrics().timer("api_request"):
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                self.requests += 1
+                retry_after = retry_after_of(response)
+                limiter.feedback(url, response.status_code, retry_after=retry_after)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                if retry_after != None:
+                    wait = max(wait, retry_after)
+                if attempt == self.retries:
+                    response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Error getting {method}: {e}")
+            time.sleep(wait)
+
+    def paginate(self, method:str, key:str, **params):
+        """
+        Yields the items (response[key]) of every page of method, following
+        its cursor. The next page is fetched while the current one is used.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.get, method, limit=PAGE_SIZE, **params)
+            while future != None:
+                page = future.result()
+                cursor = page.get("cursor")
+                future = None
+                if (cursor != None) and (len(page[key]) > 0):
+                    future = executor.submit(self.get, method, limit=PAGE_SIZE, cursor=cursor, **params)
+                yield page[key]
+
+    def profile(self, actor:str) -> dict:
+        return self.get("app.bsky.actor.getProfile", actor=actor)
+
+    def author_feed(self, actor:str, feed_filter:str=None):
+        return self.paginate("app.bsky.feed.getAuthorFeed", "feed", actor=actor, filter=feed_filter)
+
+    def follows(self, actor:str):
+        return self.paginate("app.bsky.graph.getFollows", "follows", actor=actor)
+
+
+@dataclasses.dataclass
+class bsky_api_context(bsky_context):
+    """
+    bsky_context getting the same records from the XRPC api instead of a
+    browser, so it's much faster and supports followers
+    """
+    api_base:str = API_BASE
+    client:object = None
+
+    def needs_browser(self) -> bool:
+        return False
+
+    def fetch(self, url:str) -> bool:
+        if self.client == None:
+            self.client = bsky_client(self.api_base)
+        actor = self.user
+        try:
+            profile = self.client.profile(actor)
+            logging.info(f"{profile['handle']} has {profile.get('postsCount', 0)} posts, "
+                    f"follows {profile.get('followsCount', 0)}")
+            if self.info_type == Info_type.TWEETS:
+                pages = self.client.author_feed(actor)
+                to_items = lambda item: [post_from_api(item, profile["handle"])]
+                index = self.new_index(update_seen=True)
+            elif self.info_type == Info_type.IMAGES:
+                pages = self.client.author_feed(actor, feed_filter="posts_with_media")
+                to_items = lambda item: images_from_api(item, profile["handle"])
+                index = self.new_index()
+            elif self.info_type == Info_type.FOLLOWERS:
+                pages = self.client.follows(actor)
+                to_items = lambda item: [user_from_api(item)]
+                index = self.new_index()
+            else:
+                logging.error(f"{self.info_type} not implemented for bsky api!")
+                return False
+            self.data = self.__collect(pages, to_items, index)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.error(f"Couldn't get {self.info_type.name.lower()} of {actor}: {e}")
+            return False
+        return True
+
+    def __collect(self, pages, to_items, index) -> list:
+        start = time.time()
+        for page in pages:
+            items = []
+            for item in page:
+                items += [i for i in to_items(item) if i != None]
+            if collect_items(items, index, self.sink, self.state):
+                print("\n[INFO] Reached already collected items, exiting!", end="")
+                break
+            diff = time.time() - start
+            print(f"[INFO] Time elapsed: {diff:.1f}s; Found: {len(index)} things; {self.client.requests} requests\r", end="")
+            if diff > self.timeout:
+                break
+        print("")
+        return index.values()
@@ -1,13 +1,23 @@
+import re
 import logging
 import json
 import time
+import datetime
+import functools
 # thirdparty
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.common.exceptions import NoSuchElementException
 from bs4 import BeautifulSoup
 # local imports
-from src.common import Info_type, continuously_scroll, socialmedia_context
+from src.common import Info_type, continuously_scroll, feed_items, socialmedia_context
+from src.fast_parse import compile_rules, parse_html, first, bs_contents, bs_string, bs_next_sibling
+from src.js_extract import js_extractor
+from src.capture import response_capture
+from src.records import post_record, user_record, media_ref
+
+# Feed items for delta parsing, see feed_items
+POST_XPATH = "//div[starts-with(@data-testid, 'feedItem-by-')]"
 
 
 def handle_text(tag):
@@ -20,7 +30,7 @@ def handle_text(tag):
     return buff
     
 
-def find_tweets(page_source:str, author:str) -> list[dict]:
+def find_tweets(page_source:str, author:str) -> list[post_record]:
     soup = BeautifulSoup(page_source, features="lxml")
 
     def get(tag, id:str, name:str):
@@ -39,7 +49,7 @@ def find_tweets(page_source:str, author:str) -> list[dict]:
         post = get(root, "div", "contentHider-post")
         if post == None: continue
 
-        res = {}
+        res = post_record()
     
         # Metadata
         res["context"] = root.get("data-feed-context") 
@@ -47,6 +57,8 @@ def find_tweets(page_source:str, author:str) -> list[dict]:
         res["name"] = temp.string[1:-1]
         res["handle"] = handle
         res["date"] = temp.parent.parent.parent.next_sibling.get("data-tooltip")
+        temp = root.find("a", href=lambda href: (href != None) and ("/post/" in href))
+        res["url"] = post_url(temp.get("href")) if temp != None else None
 
         # Content
         for child in post.children:
@@ -105,11 +117,339 @@ def find_images_bsky(page_source:str, author:str) -> list[str]:
         # If not found skip
         if main_div.img == None:
             continue
-        images.append( main_div.img.get("src") )
+        images.append(media_ref(main_div.img.get("src")))
     # remove tab
     return images
 
+#################################################
+# lxml backend, same output as the functions above
+#################################################
+RULES = compile_rules({
+    "feed_page" : "//div[@data-testid='customFeedPage']",
+    "posts" : ".//div[starts-with(@data-testid, 'feedItem-by-')]",
+    "content" : ".//div[@data-testid='contentHider-post']",
+    "profile" : ".//a[@aria-label='View profile']",
+    "quote" : ".//div[@role='link']",
+    "like" : ".//button[@data-testid='likeBtn']",
+    "repost" : ".//div[@data-testid='repostCount']",
+    "reply" : ".//button[@data-testid='replyBtn']",
+    "post_link" : ".//a[contains(@href, '/post/')]",
+})
+
+
+def handle_text_lxml(tag):
+    buff = ""
+    for child in bs_contents(tag):
+        if isinstance(child, str):
+            buff += child
+            continue
+        buff += bs_string(child)
+    return buff
+
+
+def find_tweets_lxml(page_source:str, author:str) -> list[post_record]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    base = first(RULES["feed_page"], root)
+    if base == None:
+        base = root
+    tweets = []
+    for root in RULES["posts"](base):
+        handle = root.get("data-testid").removeprefix("feedItem-by-")
+        if (author != "") and (handle != author): continue
+        post = first(RULES["content"], root)
+        if post == None: continue
+
+        res = post_record()
+    
+        # Metadata
+        res["context"] = root.get("data-feed-context") 
+        temp = first(RULES["profile"], root)
+        res["name"] = bs_string(temp)[1:-1]
+        res["handle"] = handle
+        res["date"] = bs_next_sibling(temp.getparent().getparent().getparent()).get("data-tooltip")
+        temp = first(RULES["post_link"], root)
+        res["url"] = post_url(temp.get("href")) if temp != None else None
+
+        # Content
+        for child in bs_contents(post):
+            if child.get("data-testid") == "postText":
+                res["text"] = handle_text_lxml(child)
+                continue
+            others = bs_contents(child.find(".//div"))
+            for div in others:
+                quote = first(RULES["quote"], div)
+                if quote != None:
+                    res["quoting"] = quote.get("aria-label")
+                    continue
+                img = div.find(".//img")
+                if img != None:
+                    res["img"] = img.get("src")
+                    res["img_alt"] = img.get("alt")
+                    continue
+                # asssume it has video
+                res["has_video"] = True
+                res["video_url"] = None
+
+        if res.get("text") == None:
+            res["text"] = None
+        if res.get("img") == None:
+            res["img"] = None
+            res["img_alt"] = None
+        if res.get("quoting") == None:
+            res["quoting"] = None
+        if res.get("has_video") == None:
+            res["has_video"] = False
+            res["video_url"] = None
+
+        # Metrics
+        butt = first(RULES["like"], root).get("aria-label").removeprefix("Like (")
+        butt = butt[:butt.find(" ")].replace(",", "")
+        res["like_count"] = int(butt)
+        butt = first(RULES["repost"], root)
+        res["repost_count"] = bs_string(butt) if butt != None else 0
+        butt = first(RULES["reply"], root).find(".//div")
+        res["comment_count"] = bs_string(butt) if butt != None else 0
+        
+        tweets.append(res)
+    return tweets
+
+
+def find_images_bsky_lxml(page_source:str, author:str) -> list[str]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    images = []
+    for post in root.xpath("//div[@data-testid=$name]", name=f"feedItem-by-{author}"):
+        main_div = first(RULES["content"], post)
+        # If not found skip
+        img = main_div.find(".//img")
+        if img == None:
+            continue
+        images.append(media_ref(img.get("src")))
+    return images
+
+
+#################################################
+# In browser extraction (see js_extract), same output as find_tweets
+#################################################
+POSTS_JS = """
+const author = arguments[1];
+
+function handleText(tag) {
+    let buff = "";
+    for (const child of tag.childNodes) {
+        if (child.nodeType === Node.TEXT_NODE || child.nodeType === Node.COMMENT_NODE) {
+            buff += child.data;
+            continue;
+        }
+        buff += must(bsString(child));
+    }
+    return buff;
+}
+
+const base = document.querySelector("div[data-testid='customFeedPage']") || document;
+const tweets = [];
+for (const root of base.querySelectorAll("div[data-testid^='feedItem-by-']")) {
+    const handle = root.getAttribute("data-testid").slice("feedItem-by-".length);
+    if (author !== "" && handle !== author) continue;
+    const post = root.querySelector("div[data-testid='contentHider-post']");
+    if (post === null) continue;
+    if (wssIsSeen(root)) continue;
+
+    const res = {};
+
+    // Metadata
+    res.context = root.getAttribute("data-feed-context");
+    const temp = root.querySelector("a[aria-label='View profile']");
+    res.name = bsString(temp).slice(1, -1);
+    res.handle = handle;
+    res.date = bsNextSibling(temp.parentElement.parentElement.parentElement).getAttribute("data-tooltip");
+    const link = root.querySelector("a[href*='/post/']");
+    res.url = link !== null ? new URL(link.getAttribute("href"), "https://bsky.app").href : null;
+
+    // Content
+    for (const child of post.children) {
+        if (child.getAttribute("data-testid") === "postText") {
+            res.text = handleText(child);
+            continue;
+        }
+        for (const div of child.querySelector("div").children) {
+            const quote = div.querySelector("div[role='link']");
+            if (quote !== null) {
+                res.quoting = quote.getAttribute("aria-label");
+                continue;
+            }
+            const img = div.querySelector("img");
+            if (img !== null) {
+                res.img = img.getAttribute("src");
+                res.img_alt = img.getAttribute("alt");
+                continue;
+            }
+            // asssume it has video
+            res.has_video = true;
+            res.video_url = null;
+        }
+    }
+
+    if (res.text == null) res.text = null;
+    if (res.img == null) {
+        res.img = null;
+        res.img_alt = null;
+    }
+    if (res.quoting == null) res.quoting = null;
+    if (res.has_video == null) {
+        res.has_video = false;
+        res.video_url = null;
+    }
+
+    // Metrics
+    let butt = root.querySelector("button[data-testid='likeBtn']").getAttribute("aria-label");
+    if (butt.startsWith("Like (")) butt = butt.slice("Like (".length);
+    butt = butt.slice(0, butt.indexOf(" ")).replaceAll(",", "");
+    res.like_count = pyInt(butt);
+    butt = root.querySelector("div[data-testid='repostCount']");
+    res.repost_count = butt !== null ? bsString(butt) : 0;
+    butt = root.querySelector("button[data-testid='replyBtn']").querySelector("div");
+    res.comment_count = butt !== null ? bsString(butt) : 0;
+
+    tweets.push(res);
+}
+return wssDone(tweets);
+"""
+
+
+#################################################
+# Api responses (see capture and bsky_api), same records as
+# find_tweets but with exact counts
+#################################################
+API_PATTERN = r"/xrpc/app\.bsky\.feed\.getAuthorFeed\b"
+
+
+def api_date(indexed_at:str) -> str:
+    """2024-01-05T13:00:00.000Z -> Jan 5, 2024 at 1:00 PM (local time), as the page tooltip shows it"""
+    # Before python 3.11 fromisoformat takes no Z, and only 3 or 6 digit fractions
+    indexed_at = re.sub(r"Z$", "+00:00", indexed_at.strip())
+    indexed_at = re.sub(r"\.(\d+)", lambda m: "." + (m.group(1) + "00000")[:6], indexed_at)
+    date = datetime.datetime.fromisoformat(indexed_at).astimezone()
+    hour = date.hour % 12 if date.hour % 12 != 0 else 12
+    return f"{date:%b} {date.day}, {date.year} at {hour}:{date:%M} {date:%p}"
+
+
+def post_from_api(item:dict, author:str) -> post_record:
+    """Record of a feed view post (app.bsky.feed.defs#feedViewPost), None if filtered out"""
+    post = item["post"]
+    handle = post["author"]["handle"]
+    if (author != "") and (handle != author):
+        return None
+    res = post_record()
+
+    # Metadata
+    res["context"] = item.get("feedContext")
+    res["name"] = post["author"].get("displayName") or handle
+    res["handle"] = handle
+    res["date"] = api_date(post["indexedAt"])
+    res["url"] = f"https://bsky.app/profile/{handle}/post/{post['uri'].rsplit('/', 1)[-1]}" if "uri" in post else None
+
+    # Content
+    res["text"] = post["record"].get("text") or None
+    res["img"], res["img_alt"] = None, None
+    res["quoting"] = None
+    res["has_video"], res["video_url"] = False, None
+    embed = post.get("embed", {})
+    if embed.get("$type") == "app.bsky.embed.record#view":
+        res["quoting"] = embed["record"].get("uri")
+    elif embed.get("$type") == "app.bsky.embed.recordWithMedia#view":
+        res["quoting"] = embed["record"]["record"].get("uri")
+        embed = embed["media"]
+    if embed.get("$type") == "app.bsky.embed.images#view":
+        res["img"] = embed["images"][0]["thumb"]
+        res["img_alt"] = embed["images"][0].get("alt")
+    elif embed.get("$type") == "app.bsky.embed.video#view":
+        res["has_video"], res["video_url"] = True, embed.get("playlist")
+
+    # Metrics
+    res["like_count"] = post.get("likeCount", 0)
+    res["repost_count"] = post.get("repostCount", 0)
+    res["comment_count"] = post.get("replyCount", 0)
+    return res
+
+
+def images_from_api(item:dict, author:str) -> list[str]:
+    """Image thumbnails of a feed view post, as find_images_bsky gives them"""
+    post = item["post"]
+    if post["author"]["handle"] != author:
+        return []
+    embed = post.get("embed", {})
+    if embed.get("$type") == "app.bsky.embed.recordWithMedia#view":
+        embed = embed["media"]
+    if embed.get("$type") != "app.bsky.embed.images#view":
+        return []
+    return [media_ref(image["thumb"]) for image in embed["images"]]
+
+
+def user_from_api(profile:dict) -> user_record:
+    """Record of a profile view, same as twitter find_following_users"""
+    return user_record(handle=profile["handle"], name=profile.get("displayName") or profile["handle"])
+
+
+def map_api_response(url:str, data:dict, author:str="") -> list[post_record]:
+    """Posts of an app.bsky.feed.getAuthorFeed response"""
+    posts = []
+    for item in data["feed"]:
+        post = post_from_api(item, author)
+        if post != None:
+            posts.append(post)
+    return posts
+
+
+# find functions of each parser backend
+PARSERS = {
+    "bs4" : {
+        "tweets" : find_tweets,
+        "images" : find_images_bsky,
+    },
+    "lxml" : {
+        "tweets" : find_tweets_lxml,
+        "images" : find_images_bsky_lxml,
+    },
+}
+
+
+def post_url(href:str) -> str:
+    """/profile/<handle>/post/<rkey> -> https://bsky.app/profile/<handle>/post/<rkey>"""
+    return href if href.startswith("https://") else "https://bsky.app" + href
+
+
+def post_key(post:dict) -> str:
+    # The url (ending in the post's rkey) when the card links it, the date
+    # is only to the minute and image only posts have no text
+    if post.get("url") != None:
+        return post["url"]
+    return f"{post['handle']}|{post['date']}|{post['text']}|{post.get('img')}|{post.get('quoting')}"
+
+
 class bsky_context(socialmedia_context):
+    def item_key(self, item):
+        if self.info_type == Info_type.TWEETS:
+            return post_key(item)
+        if self.info_type == Info_type.FOLLOWERS:
+            return item["handle"]
+        return item
+
+    def record_type(self):
+        if self.info_type == Info_type.TWEETS:
+            return post_record
+        if self.info_type == Info_type.FOLLOWERS:
+            return user_record
+        return None
+
+    def new_capture(self):
+        if self.info_type != Info_type.TWEETS:
+            return None
+        return response_capture(API_PATTERN, functools.partial(map_api_response, author=self.user))
+
     def pre_process(self, browser:WebDriver) -> bool:
         if not self.retry(browser, "Page Not Found"):
             return False
@@ -126,18 +466,37 @@ class bsky_context(socialmedia_context):
         return True
 
     def process(self, browser:WebDriver) -> bool:
+        funcs = PARSERS[self.parser]
         args = (self.user, )
+        script = None
         if self.info_type == Info_type.TWEETS:
-            f = find_tweets
+            f = funcs["tweets"]
+            script = POSTS_JS
+            index = self.new_index(update_seen=True)
         elif self.info_type == Info_type.IMAGES:
-            f = find_images_bsky
+            f = funcs["images"]
+            index = self.new_index()
         else:
             logging.error(f"{self.info_type} not implemented for bsky yet!")
             return False
 
-        self.data, _ = continuously_scroll(browser, self.timeout, f, *args)
+        delta = feed_items(POST_XPATH) if self.delta_parse else None
+        extract = js_extractor(self.info_type.name, script, *args, record=post_record) if (self.in_browser and script != None) else None
+        if self.responses != None:
+            extract = self.responses
+        self.data, _ = continuously_scroll(browser, self.timeout, f, *args,
+                delta=delta, index=index, sink=self.sink, state=self.state, workers=self.parse_workers,
+                scroller=self.new_scroller(POST_XPATH), extract=extract)
         return True
 
     def get_filenames(self) -> list[str]:
-        return self.data
+        # .../plain/<did>/<cid>@jpeg -> <user>_<cid>.jpeg
+        names = []
+        for url in self.data:
+            name = url[url.rfind("/")+1:]
+            index = name.find("@")
+            if index != -1:
+                name = name[:index] + "." + name[index+1:]
+            names.append(f"{self.user}_{name}")
+        return names
         
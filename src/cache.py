@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlsplit
+# local imports
+from src.records import to_json
+from src.metrics import get_metrics
+
+DAY = 24 * 60 * 60.
+# Time to live of the entries by (site, kind), "*" matches anything
+DEFAULT_TTLS = {
+    ("*", "*") : 7 * DAY,
+    ("*", "source") : DAY,
+    # Images of a multiple image post, see twitter_context.expand_posts
+    ("*", "expand") : 30 * DAY,
+    ("x.com", "images") : DAY,
+    ("bsky.app", "images") : DAY,
+}
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+caches = {}
+caches_lock = threading.Lock()
+
+
+def get_cache(cache_dir:str="./cache/") -> "scrape_cache":
+    """Cache stored in cache_dir, shared by everyone using the same dir"""
+    with caches_lock:
+        if cache_dir not in caches:
+            caches[cache_dir] = scrape_cache(os.path.join(cache_dir, "cache.db"))
+        return caches[cache_dir]
+
+
+def log_cache_stats():
+    """Logs the hits, misses and size of every cache used by this process"""
+    with caches_lock:
+        used = list(caches.values())
+    for cache in used:
+        stats = cache.stats()
+        logging.info(f"Cache {cache.path}: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries, {stats['bytes'] / 2**20:.1f}MB")
+
+
+def site_of(url:str) -> str:
+    """https://x.com/user -> x.com"""
+    return urlsplit(url).netloc
+
+
+class scrape_cache:
+    """
+    Sqlite backed cache of typed entries (page sources, scraped items...)
+    keyed by url and kind. Entries expire after the ttl of their
+    (site, kind), and the least recently used ones are evicted when the
+    total size grows past max_bytes.
+    The total size is kept as entries are put/removed, only summed up again
+    when it seems to be past max_bytes (other processes may have removed some).
+    """
+    def __init__(self, path:str, *, ttls:dict=None, max_bytes:int=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls != None:
+            self.ttls.update(ttls)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.__connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                url TEXT, kind TEXT, site TEXT, value TEXT, size INTEGER,
+                created REAL, accessed REAL, PRIMARY KEY (url, kind))""")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self.size = self.__total_size(db)
+
+    def ttl(self, site:str, kind:str) -> float:
+        for key in ((site, kind), (site, "*"), ("*", kind), ("*", "*")):
+            if key in self.ttls:
+                return self.ttls[key]
+        return 0.
+
+    def get(self, url:str, kind:str):
+        """Cached value of url, None if it isn't cached or it expired"""
+        now = time.time()
+        with self.__connect() as db:
+            row = db.execute("SELECT value, created FROM entries WHERE url = ? AND kind = ?",
+                    (url, kind)).fetchone()
+            if (row != None) and (now - row[1] > self.ttl(site_of(url), kind)):
+                self.__delete(db, url, kind)
+                row = None
+            if row == None:
+                with self.lock:
+                    self.misses += 1
+                get_metrics().count("cache_misses")
+                return None
+            db.execute("UPDATE entries SET accessed = ? WHERE url = ? AND kind = ?", (now, url, kind))
+        with self.lock:
+            self.hits += 1
+        get_metrics().count("cache_hits")
+        return json.loads(row[0])
+
+    def put(self, url:str, kind:str, value):
+        """Caches value (anything json serializable) for url"""
+        data = json.dumps(value, ensure_ascii=False, default=to_json)
+        now = time.time()
+        with self.__connect() as db:
+            self.__delete(db, url, kind)
+            db.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, kind, site_of(url), data, len(data), now, now))
+            with self.lock:
+                self.size += len(data)
+            self.__evict(db)
+
+    def remove(self, url:str, kind:str):
+        with self.__connect() as db:
+            self.__delete(db, url, kind)
+
+    def stats(self) -> dict:
+        with self.__connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries" : entries, "bytes" : size, "hits" : self.hits, "misses" : self.misses,
+            "hit_rate" : self.hits / total if total > 0 else 0.,
+        }
+
+    def __delete(self, db, url:str, kind:str):
+        row = db.execute("SELECT size FROM entries WHERE url = ? AND kind = ?", (url, kind)).fetchone()
+        if row != None:
+            db.execute("DELETE FROM entries WHERE url = ? AND kind = ?", (url, kind))
+            with self.lock:
+                self.size -= row[0]
+
+    def __total_size(self, db) -> int:
+        return db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def __evict(self, db):
+        if self.size <= self.max_bytes:
+            return
+        size = self.__total_size(db)
+        if size <= self.max_bytes:
+            with self.lock:
+                self.size = size
+            return
+        evicted = 0
+        for url, kind, entry_size in db.execute("SELECT url, kind, size FROM entries ORDER BY accessed").fetchall():
+            if size <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE url = ? AND kind = ?", (url, kind))
+            size -= entry_size
+            evicted += 1
+        with self.lock:
+            self.size = size
+        logging.info(f"Evicted {evicted} cache entries")
+
+    def __connect(self):
+        return closing_connection(self.path)
+
+
+class closing_connection:
+    """sqlite3 connection that commits (or rolls back) and closes on exit"""
+    def __init__(self, path:str):
+        self.db = sqlite3.connect(path, timeout=30.)
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type == None:
+            self.db.commit()
+        else:
+            self.db.rollback()
+        self.db.close()
@@ -0,0 +1,102 @@
+import json
+import logging
+# thirdparty
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+# Patches fetch and XMLHttpRequest so the responses of the urls matching
+# the regex pattern are kept (as text) in window.__wss_responses
+CAPTURE_JS = """(pattern) => {
+    if (window.__wss_capture !== undefined) return;
+    window.__wss_capture = new RegExp(pattern);
+    window.__wss_responses = [];
+    const keep = (url, body) => {
+        if (window.__wss_responses.length < 1000) window.__wss_responses.push({url: url, body: body});
+    };
+    const fetch = window.fetch;
+    window.fetch = async function(...args) {
+        const response = await fetch.apply(this, args);
+        if (window.__wss_capture.test(response.url)) {
+            response.clone().text().then(body => keep(response.url, body), () => {});
+        }
+        return response;
+    };
+    if (window.XMLHttpRequest === undefined) return;
+    const open = XMLHttpRequest.prototype.open;
+    XMLHttpRequest.prototype.open = function(method, url, ...rest) {
+        this.__wss_url = String(url);
+        return open.call(this, method, url, ...rest);
+    };
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function(...args) {
+        if (window.__wss_capture.test(this.__wss_url)) {
+            this.addEventListener("load", () => {
+                const text = (this.responseType === "" || this.responseType === "text");
+                keep(this.responseURL || this.__wss_url, text ? this.responseText : JSON.stringify(this.response));
+            });
+        }
+        return send.apply(this, args);
+    };
+}"""
+
+# Responses captured since the last call
+DRAIN_JS = """
+const responses = window.__wss_responses;
+if (responses === undefined) return null;
+window.__wss_responses = [];
+return responses;
+"""
+
+
+class response_capture:
+    """
+    Records the api (json) responses the page receives, and maps them into
+    the records the find functions would give, using map_func(url, data) -> list.
+    Its hook (CAPTURE_JS) is installed before the page loads when the browser
+    supports WebDriver BiDi preload scripts, otherwise right after it loads,
+    missing the responses of the first items (parse_first is True then, so
+    continuously_scroll parses those from the page).
+    Used as the extract of continuously_scroll, see js_extract.extract_items.
+    """
+    def __init__(self, pattern:str, map_func):
+        self.pattern = pattern
+        self.map_func = map_func
+        self.preload = None
+        self.parse_first = True
+        self.responses = 0
+        self.errors = 0
+
+    def install(self, browser:WebDriver):
+        """Installs the hook in every page opened from now on, call before browser.get"""
+        try:
+            declaration = f"() => ({CAPTURE_JS})({json.dumps(self.pattern)})"
+            self.preload = browser.script.add_preload_script(declaration)["script"]
+            self.parse_first = False
+        except (WebDriverException, KeyError, AttributeError) as e:
+            logging.info(f"Can't capture responses from the start, no BiDi support: {e}")
+
+    def inject(self, browser:WebDriver):
+        """Installs the hook in the current page, if install couldn't"""
+        if self.preload == None:
+            browser.execute_script(f"({CAPTURE_JS})(arguments[0])", self.pattern)
+
+    def uninstall(self, browser:WebDriver):
+        if self.preload != None:
+            browser.script.remove_preload_script(script=self.preload)
+            self.preload = None
+
+    def __call__(self, browser:WebDriver) -> list:
+        responses = browser.execute_script(DRAIN_JS)
+        if responses == None:
+            # Page reloaded without the hook
+            self.inject(browser)
+            return []
+        items = []
+        for response in responses:
+            self.responses += 1
+            try:
+                items += self.map_func(response["url"], json.loads(response["body"]))
+            except (ValueError, KeyError, TypeError) as e:
+                self.errors += 1
+                logging.warning(f"Can't map response of {response['url']}: {e}")
+        return items
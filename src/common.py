@@ -1,15 +1,26 @@
 import os
 import time
+import json
 import requests
-import concurrent.futures
 import logging
 import dataclasses
+import multiprocessing
+import concurrent.futures
 from enum import Enum
 # thirdparty
+import lxml.html
 from selenium import webdriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.remote.webdriver import WebDriver
+# local imports
+from src.downloader import downloader
+from src.cache import get_cache
+from src.scroll import adaptive_scroller
+from src.js_extract import extract_items
+from src.metrics import get_metrics
+from src.ratelimit import get_limiter
+from src.records import record
 
 class Info_type(Enum):
     IMAGES = 0
@@ -17,6 +28,9 @@ class Info_type(Enum):
     FOLLOWERS = 2
     BOOKMARKS = 4
 
+# Text only types, that don't need images/media/fonts loaded, see browser_options
+LEAN_TYPES = (Info_type.TWEETS, Info_type.FOLLOWERS, Info_type.BOOKMARKS)
+
 @dataclasses.dataclass
 class socialmedia_context:
     user:str = ""
@@ -26,6 +40,24 @@ class socialmedia_context:
     info_type:Info_type = Info_type.TWEETS
     data:list = dataclasses.field(default_factory=list)
     max_reloads:int = 3
+    delta_parse:bool = True
+    sink:object = None
+    lean:bool = True
+    state:object = None
+    # Parser backend, see fast_parse.BACKENDS
+    parser:str = "lxml"
+    # Processes parsing while scrolling, see parse_pipeline
+    parse_workers:int = 0
+    # Scroll as fast as the feed loads, see scroll.adaptive_scroller
+    adaptive_scroll:bool = False
+    # Extract the items inside the browser, see js_extract
+    in_browser:bool = False
+    # Map the api responses instead of parsing the page, see capture
+    capture:bool = False
+    # response_capture in use, set by run_context
+    responses:object = None
+    # Panic string still on the page after max_reloads, see retry
+    panic:str = ""
     
     def pre_process(self, browser:WebDriver) -> bool:
         return True
@@ -40,16 +72,52 @@ class socialmedia_context:
     def get_data(self):
         return self.data
 
+    def lean_browser(self) -> bool:
+        """Wether a lean browser (see browser_options) is enough for this context"""
+        return self.lean and (self.info_type in LEAN_TYPES)
+
+    def needs_browser(self) -> bool:
+        """Wether it scrapes with a browser (process...) or on its own (fetch)"""
+        return True
+
+    def fetch(self, url:str) -> bool:
+        """Gets the items without a browser, see needs_browser"""
+        logging.error("Implement fetch function when deriving from this class")
+        return False
+
+    def item_key(self, item):
+        """Stable identity of a scraped item, see dedup_index"""
+        return default_key(item)
+
+    def record_type(self):
+        """records.record subclass of the scraped items, None if they aren't records"""
+        return None
+
+    def new_capture(self):
+        """capture.response_capture mapping the api responses of this context, None if unsupported"""
+        return None
+
+    def new_scroller(self, xpath:str=None):
+        return adaptive_scroller(xpath) if self.adaptive_scroll else None
+
+    def new_index(self, update_seen:bool=False):
+        # Items already streamed to the sink don't need to be kept in memory
+        return dedup_index(self.item_key, update_seen, keep_items=self.sink == None)
+
     def retry(self, browser:WebDriver, panic_str:str):
         time.sleep(0.5)
         reload_times = 0
-        # If panic, reload
+        limiter = get_limiter()
+        # If panic, reload (slower, the site may be throttling us)
         while browser.page_source.find(panic_str) != -1:
+            limiter.feedback(browser.current_url, panic=True)
             if reload_times > self.max_reloads:
                 logging.error(f"Max reloads reached: {self.max_reloads}, shutting down")
+                self.panic = panic_str
                 return False
             reload_times += 1
             logging.info(f"Refreshing: {reload_times}")
+            limiter.wait(browser.current_url)
             browser.refresh()
         return True
 
@@ -78,7 +146,182 @@ def get_cookie_from_file(filename:str) -> list:
     return cookies
 
 
-def continuously_scroll(browser:WebDriver, timeout:float, find_func, *args):
+class feed_items:
+    """
+    Splits a page source into its feed items (tweets, posts, user cells...)
+    given by an xpath, and remembers the ones already seen, so only the
+    markup of new/changed items has to be parsed again.
+    """
+    def __init__(self, xpath:str):
+        self.xpath = xpath
+        self.seen = set()
+
+    def new_source(self, page_source:str) -> str:
+        """Returns the markup of all items not seen before, "" if there are none"""
+        doc = lxml.html.document_fromstring(page_source)
+        new = []
+        for item in doc.xpath(self.xpath):
+            markup = lxml.html.tostring(item, encoding="unicode", with_tail=False)
+            key = hash(markup)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            new.append(markup)
+        return "\n".join(new)
+
+
+class dedup_index:
+    """
+    Insertion ordered index of scraped items, keyed by key_func(item)
+    (tweet url, user handle, media url...) so repeated items are found in O(1).
+    If update_seen, an already seen item that changed (e.g. its stats) is
+    replaced in place, keeping its original position.
+    If not keep_items, only a hash of each item is kept (e.g. when items are
+    streamed somewhere else), and values() is empty.
+    """
+    def __init__(self, key_func=None, update_seen:bool=False, keep_items:bool=True):
+        self.key_func = key_func if key_func != None else default_key
+        self.update_seen = update_seen
+        self.keep_items = keep_items
+        self.items = {}
+        self.duplicates = 0
+        self.updates = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item) -> bool:
+        return self.key_func(item) in self.items
+
+    def add(self, item) -> bool:
+        """
+        Adds item, returns True if it was stored, that is if it wasn't
+        seen before or it updated an already seen item
+        """
+        key = self.key_func(item)
+        if key not in self.items:
+            self.items[key] = self.__value(item)
+            return True
+        self.duplicates += 1
+        if self.update_seen and self.items[key] != self.__value(item):
+            self.update(item)
+            return True
+        return False
+
+    def update(self, item):
+        """Replaces the already seen item with the same key"""
+        key = self.key_func(item)
+        if key not in self.items:
+            logging.error(f"Can't update {key}, it hasn't been seen")
+            return
+        self.items[key] = self.__value(item)
+        self.updates += 1
+
+    def values(self) -> list:
+        if not self.keep_items:
+            return []
+        return list(self.items.values())
+
+    def __value(self, item):
+        if self.keep_items:
+            return item
+        return hash(default_key(item))
+
+
+def default_key(item):
+    """Identity for hashable items, dicts (and records) are keyed by their contents"""
+    if isinstance(item, record):
+        item = item.to_dict()
+    if isinstance(item, dict):
+        return json.dumps(item, sort_keys=True)
+    return item
+
+
+class parse_pipeline:
+    """
+    Parses page snapshots with find_func(snapshot, *args) in a pool of worker
+    processes, so the browser keeps scrolling while they are parsed.
+    At most max_pending snapshots are parsed at once, while they are busy
+    only the newest snapshot waits (older waiting ones are superseded and
+    dropped), so parsing never holds back scrolling.
+    Dropping is only lossless for feeds that keep growing (bsky, following
+    lists), on virtualized timelines items may scroll out of a dropped snapshot.
+    With merge, what's pushed are the new items of each snapshot (see
+    feed_items), and the waiting ones are joined instead of dropped.
+    """
+    def __init__(self, find_func, args:tuple, workers:int, max_pending:int=0, merge:bool=False):
+        self.find_func = find_func
+        self.args = args
+        self.merge = merge
+        self.max_pending = max_pending if max_pending > 0 else workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        self.running = []
+        self.waiting = None
+        self.last = None
+        self.dropped = 0
+
+    def push(self, page_source:str) -> list:
+        """Queues a snapshot, returns the items of the snapshots parsed meanwhile"""
+        if self.merge:
+            if page_source != "":
+                self.waiting = page_source if self.waiting == None else self.waiting + "\n" + page_source
+        elif page_source != self.last:
+            if self.waiting != None:
+                self.dropped += 1
+            self.waiting = page_source
+            self.last = page_source
+        return self.__collect()
+
+    def close(self) -> list:
+        """Waits for all the snapshots and returns their items"""
+        items = []
+        while (self.waiting != None) or (len(self.running) > 0):
+            concurrent.futures.wait(self.running[:1])
+            items += self.__collect()
+        self.executor.shutdown()
+        if self.dropped > 0:
+            logging.info(f"Dropped {self.dropped} superseded snapshots")
+        return items
+
+    def __collect(self) -> list:
+        items = []
+        # In order, so items keep the feed order
+        while (len(self.running) > 0) and self.running[0].done():
+            items += self.running.pop(0).result()
+        if (self.waiting != None) and (len(self.running) < self.max_pending):
+            self.running.append(self.executor.submit(self.find_func, self.waiting, *self.args))
+            self.waiting = None
+        return items
+
+
+def collect_items(items:list, things:dedup_index, sink=None, state=None) -> bool:
+    """
+    Adds items to things, writing the new (or updated) ones to sink.
+    Items already collected in a previous run (in state) are skipped, returns
+    True once state.stop_after of them have been found in a row.
+    """
+    stop = False
+    for item in items:
+        new = item not in things
+        if not things.add(item):
+            continue
+        if (state != None) and new:
+            key = things.key_func(item)
+            if key in state:
+                state.known_run += 1
+                stop = stop or (state.known_run >= state.stop_after)
+                continue
+            state.known_run = 0
+            state.add(key)
+        if sink != None:
+            sink.write(item)
+    return stop
+
+
+def continuously_scroll(browser:WebDriver, timeout:float, find_func, *args,
+        delta:feed_items=None, index:dedup_index=None, sink=None, state=None, workers:int=0,
+        scroller=None, extract=None):
     """
     This function continuously_scroll scroll the browser in current site
     each time it does a scroll operation it calls func(browser.page_source, *args)
@@ -87,106 +330,168 @@ def continuously_scroll(browser:WebDriver, timeout:float, find_func, *args):
 
     Arguments:
         timeout:float - Time passing scrolling
+    Keyword Arguments:
+        delta:feed_items - If given, only the feed items not seen in previous
+            iterations are passed to func, instead of the whole page source
+        index:dedup_index - Index used to ensure no repeats, defaults to one keyed by the item itself
+        sink - If given, new (or updated) items are written to sink.write(item) as soon as found
+        state:scrape_state - Items collected in previous runs, scrolling stops
+            once a run of them is found (see collect_items)
+        workers:int - If > 0, page sources are parsed by this many processes
+            while scrolling (see parse_pipeline), with delta only the new items
+            are sent to them, so none is lost on virtualized feeds
+        scroller:adaptive_scroller - If given, it decides how much to scroll
+            and when the feed is over, and the page is only parsed when it changed
+        extract:js_extractor - If given, the new items are extracted inside the
+            browser (or from its responses, see capture), find_func is only used if it fails
     """
     start = time.time()
     last_page_source, diff = "", 0.0
     timestamp = time.time()
+    metrics = get_metrics()
     # To ensure no repeats
-    things = []
+    things = index if index != None else dedup_index()
+    pipeline = parse_pipeline(find_func, args, workers, merge=delta != None) if workers > 0 else None
+    if (extract != None) and extract.parse_first:
+        # Items that were there before extract could see them
+        with metrics.timer("page_source"):
+            last_page_source = browser.page_source
+        with metrics.timer("parse"):
+            res = find_func(last_page_source, *args)
+        with metrics.timer("dedup"):
+            collect_items(res, things, sink, state)
     while (diff <= timeout):
         # Scroll
-        for _ in range(5):
-            ActionChains(browser).send_keys(Keys.PAGE_DOWN).perform()
-        # Do parsing
-        res = find_func(browser.page_source, *args)
-        for item in res:
-            if item in things:
+        if scroller != None:
+            with metrics.timer("scroll"):
+                changed = scroller.scroll(browser)
+            if scroller.ended:
+                print("\n[INFO] Reached end of feed, exiting!", end="")
+                break
+            diff = time.time() - start
+            if not changed:
+                # Nothing new to parse
                 continue
-            things.append(item)
+        else:
+            with metrics.timer("scroll"):
+                for _ in range(5):
+                    ActionChains(browser).send_keys(Keys.PAGE_DOWN).perform()
+        res = None
+        if extract != None:
+            with metrics.timer("extract"):
+                res = extract_items(browser, extract)
+        if res != None:
+            changed = len(res) > 0
+        else:
+            # Fall back to parsing the page source
+            extract = None
+            with metrics.timer("page_source"):
+                page_source = browser.page_source
+            with metrics.timer("parse"):
+                if pipeline != None:
+                    res = pipeline.push(delta.new_source(page_source) if delta != None else page_source)
+                elif delta == None:
+                    res = find_func(page_source, *args)
+                else:
+                    source = delta.new_source(page_source)
+                    res = find_func(source, *args) if source != "" else []
+            changed = last_page_source != page_source
+            last_page_source = page_source
+        with metrics.timer("dedup"):
+            stop = collect_items(res, things, sink, state)
+        if stop:
+            print("\n[INFO] Reached already collected items, exiting!", end="")
+            break
         # Check if already at the end of feed
-        if last_page_source != browser.page_source:
-            last_page_source = browser.page_source
+        if changed:
             timestamp = time.time()
         else:
-            if (time.time() - timestamp > 8.0):
+            if (scroller == None) and (time.time() - timestamp > 8.0):
                 print("\n[INFO] Done early, exiting!", end="")
                 break
         # Show info
         diff = time.time() - start
-        print(f"[INFO] Time elapsed: {diff:.1f}s; Found: {len(things)} things\r", end="")
+        rate = len(things) / diff if diff > 0 else 0.
+        print(f"[INFO] Time elapsed: {diff:.1f}s; Found: {len(things)} things; {rate:.1f} things/s\r", end="")
     print("")
-    return list(things), last_page_source
+    if pipeline != None:
+        with metrics.timer("parse"):
+            res = pipeline.close()
+        collect_items(res, things, sink, state)
+    diff = time.time() - start
+    metrics.count("items_found", len(things))
+    metrics.count("duplicates", things.duplicates)
+    logging.info(f"Found {len(things)} items in {diff:.1f}s ({len(things) / max(diff, 1e-3):.1f} items/s)")
+    if scroller != None:
+        logging.info(f"Scrolled {scroller.scrolls} times, backed off {scroller.backoffs} times")
+    logging.info(f"Repeated items: {things.duplicates}, updated: {things.updates}")
+    return things.values(), last_page_source
 
 
-def download_file(url:str, out_dir:str, name):
+def download_file(url:str, out_dir:str, name, engine:downloader=None) -> bool:
     """Download url to out_dir"""
     if url == "":
         logging.error("Can't download empty url")
-        return
+        return False
     filepath = os.path.join(out_dir, name)
     # If already downloaded do not download again
     if os.path.exists(filepath):
         logging.error("Already downloaded that file")
-        return
+        return True
     # Get file
-    data = requests.get(url)
-    if data.ok:
-        with open(filepath, "wb") as f:
-            f.write(data.content) 
-    else:
-        logging.error(f"Couldn't Download {url}!")
+    if engine == None:
+        engine = downloader(workers=1)
+    return engine.download(url, filepath)
 
 
-def download_files(urls:list, out_dir:str, names:list):
+def download_files(urls:list, out_dir:str, names:list, engine:downloader=None, store=None, user:str=""):
     """
     Download all urls (if urls are files) using various threds
     You must provide a filename for each url provided
+    If a media_store is given, files already in it aren't downloaded again
+    and the new ones are added to it.
     """
     # Making sure inputs makes sense
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
     if len(urls) == 0:
         logging.info("Nothing to download!")
         return
     if list(names) == 0:
         names = urls
-    # Cap # of threads
-    if len(urls) < 16:
-        size = len(urls)
-    else:
-        size = 16
-    # Download concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=size) as executor:
-        futures = {executor.submit(download_file, url, out_dir, name):url for url, name in zip(urls, names)}
-        count = 0
-        for _ in concurrent.futures.as_completed(futures):
-            count += 1
-            print(f"[INFO] Downloading {count}/{len(urls)}\r", end="")
-        print("")
+    if engine == None:
+        engine = downloader()
+    if store != None:
+        store.download(urls, out_dir, names, user, engine)
+        return
+    # Download concurrently, skipping the ones already downloaded
+    todo = []
+    for url, name in zip(urls, names):
+        if url == "":
+            logging.error("Can't download empty url")
+            continue
+        filepath = os.path.join(out_dir, name)
+        if not os.path.exists(filepath):
+            todo.append((url, filepath))
+    if len(todo) < len(urls):
+        logging.info(f"Skipping {len(urls) - len(todo)} files already downloaded")
+    engine.download_all([url for url, _ in todo], [path for _, path in todo])
 
 
 def cache_source(source:str, url:str, cache_dir:str = "./cache/"):
-    n = len("https://")
-    filename = url[n:] + ".html"
-    filename = filename.replace("/", "::")
-    with open(cache_dir + filename, "w") as file:
-        file.write(source)
+    get_cache(cache_dir).put(url, "source", source)
 
 
 def get_cache_source(url:str, cache_dir:str = "./cache/"):
-    n = len("https://")
-    filename = url[n:] + ".html"
-    filename = cache_dir + filename.replace("/", "::")
-    if os.path.exists(filename):
-        return open(filename, "r").read()
-    else:
-        return ""
+    source = get_cache(cache_dir).get(url, "source")
+    return source if source != None else ""
 
 
 def cached_get_url(url:str, cache_dir:str = "./cache/"):
     source = get_cache_source(url, cache_dir)
     if source == "":
+        get_limiter().wait(url)
         response = requests.get(url)
+        get_limiter().feedback(url, response.status_code)
         if response.ok:
             source = response.content.decode("latin 1")
             cache_source(source, url, cache_dir)
@@ -197,95 +502,175 @@ def cached_get_url(url:str, cache_dir:str = "./cache/"):
     
 
 def cache_scrape_func(url:str, context, *, bypass_cache:bool=False, action_func = None,
-        cache_entire_source:bool=False, cookie_path:str=""):
+        cache_entire_source:bool=False, cookie_path:str="", pool=None) -> bool:
     """
     This calls get_items_from_url_using_func(..., find_func, *func_args) if the site or data hasn't been cached yet
     This function assumes that find_func returns a list
-    It writes the cache in ./cache/
+    It caches the result in ./cache/ (see scrape_cache), unless scraping failed
 
     Keyword Arguments:
         bypass_cache:bool - Ignores cache, functionally the same as just calling scrape_func and cache the result
         cache_entire_source:bool - Wether to cache the site or the result of scraping
+        pool:browser_pool - Pool to take the browser from, see get_items_from_url
     """
-    ext = ".html" if cache_entire_source else ".data"
-    n = len("https://")
-    url_cache_path = "./cache/" + url.replace("/", "-") + ext
-    if not os.path.exists("./cache"):
-        os.mkdir("cache")
+    cache = get_cache("./cache/")
+    kind = "source" if cache_entire_source else context.info_type.name.lower()
     # Check if in cache
-    if os.path.exists(url_cache_path) and (not bypass_cache):
-        if cache_entire_source:
-            # Data is the source
-            data = open(url_cache_path, "r").read() 
-        else:
-            with open(url_cache_path, "r") as file:
-                data = file.read().split("\n")
+    data = None if bypass_cache else cache.get(url, kind)
+    if data != None:
+        logging.info(f"Using cached {kind} of {url}")
         context.data = data
-    else:
-        # Actually get items using browser
-        if action_func == None:
-            action_func = lambda x: x
-        get_items_from_url(url, cookie_path, context)
-        # Cached it
-        with open(url_cache_path, "w") as file:
-            for element in context.data:
-                file.write(str(element)+"\n")
+        return True
+    # Actually get items using browser
+    if action_func == None:
+        action_func = lambda x: x
+    ok = get_items_from_url(url, cookie_path, context, pool=pool)
+    # Cached it
+    if ok:
+        cache.put(url, kind, context.data)
+    return ok
+
+
+def base_url_of(url:str) -> str:
+    """https://x.com/user/media -> https://x.com"""
+    index = url.find("/", len("https://"))
+    return url if index == -1 else url[:index]
+
+
+def login(browser:WebDriver, url:str, cookie_path:str):
+    """Inserts the cookies in cookie_path into the browser, for the site of url"""
+    get_limiter().wait(url)
+    with get_metrics().timer("cookie_injection"):
+        # Make sure we actually are in the correct url
+        browser.get(base_url_of(url))
+        browser.implicitly_wait(5.0)
+        # Add the cookie in the base url
+        cookies = get_cookie_from_file(cookie_path)
+        logging.info(f"Inserting cookie")
+        for cookie in cookies:
+            browser.add_cookie(cookie)
+
+
+def browser_options(lean:bool=False, bidi:bool=False) -> webdriver.FirefoxOptions:
+    """
+    Default firefox options, if lean the browser is headless, with a small
+    window/cache and doesn't load images, media or fonts.
+    If bidi, WebDriver BiDi is enabled, so capture can hook the page before it loads
+    """
+    options = webdriver.FirefoxOptions()
+    if bidi:
+        options.web_socket_url = True
+    if not lean:
+        return options
+    options.add_argument("-headless")
+    options.add_argument("--width=1280")
+    options.add_argument("--height=900")
+    # Images, media and fonts
+    options.set_preference("permissions.default.image", 2)
+    options.set_preference("media.autoplay.default", 5)
+    options.set_preference("media.autoplay.blocking_policy", 2)
+    options.set_preference("media.preload.default", 0)
+    options.set_preference("gfx.downloadable_fonts.enabled", False)
+    options.set_preference("browser.display.use_document_fonts", 0)
+    # Trackers
+    options.set_preference("privacy.trackingprotection.enabled", True)
+    # Cache
+    options.set_preference("browser.cache.disk.enable", False)
+    options.set_preference("browser.cache.memory.capacity", 32768)
+    options.set_preference("browser.sessionhistory.max_entries", 5)
+    return options
 
 
-def get_items_from_url(url:str, cookie_path:str, context):
+def open_browser(lean:bool=False, bidi:bool=False) -> WebDriver:
+    with get_metrics().timer("browser_startup"):
+        return webdriver.Firefox(options=browser_options(lean, bidi))
+
+
+def get_items_from_url(url:str, cookie_path:str, context, pool=None) -> bool:
     """
     Opens a selenium browser, gets to url (using cookie if necessary) using context
     then continuously_scroll the url using func(page_source, *args) to parse the site
     to continuously collect whatever items we want.
+    If a browser_pool is given, an already opened (and logged in) browser
+    is taken from it and given back afterwards, instead of opening a new one.
+    Returns False if any stage of the context failed.
     """
+    if not context.needs_browser():
+        return context.fetch(url)
     # Create browser
-    options = webdriver.FirefoxOptions()
-    browser = webdriver.Firefox(options=options)
-    
+    lean = context.lean_browser()
+    capture = context.new_capture() if context.capture else None
+    # Only an installed capture needs BiDi
+    bidi = capture != None
+    if pool == None:
+        browser = open_browser(lean, bidi)
+        if os.path.exists(cookie_path):
+            login(browser, url, cookie_path)
+    else:
+        session = pool.acquire(url, cookie_path, lean=lean, bidi=bidi)
+        browser = session.browser
+
+    try:
+        return run_context(browser, url, context, capture)
+    finally:
+        if pool == None:
+            browser.close()
+        else:
+            pool.release(session)
+
+
+def run_context(browser:WebDriver, url:str, context, capture=None) -> bool:
+    """Gets to url and runs all the stages of context on it, mapping its responses with capture if given"""
+    if capture != None:
+        capture.install(browser)
     # Extract all webpage
     logging.info(f"Opening website")
-    # Add the cookie
-    if os.path.exists(cookie_path):
-        base_url = url[:url.find("/", len("https://"))]
-        browser.get(base_url)
-        browser.implicitly_wait(5.0)
-        # Add the cookie in the base url
-        # Make sure we actually are in the correct url
-        cookies = get_cookie_from_file(cookie_path)
-        logging.info(f"Inserting cookie")
-        for cookie in cookies:
-            browser.add_cookie(cookie)
+    get_limiter().wait(url)
+    with get_metrics().timer("page_load"):
         browser.get(url)
+        # Ensure we are on the page
         browser.implicitly_wait(5.0)
-    else:
-        # Assume it doesn't need cookies
-        browser.get(url)
-    # Ensure we are on the page
-    browser.implicitly_wait(5.0)
+    if capture != None:
+        capture.inject(browser)
+    context.responses = capture
+    try:
+        return run_stages(browser, context)
+    finally:
+        if capture != None:
+            logging.info(f"Captured {capture.responses} responses, {capture.errors} couldn't be mapped")
+            context.responses = None
+            try:
+                capture.uninstall(browser)
+            except Exception as e:
+                # Don't hide what made the stages fail
+                logging.error(f"Couldn't remove the capture hook: {e}")
+
 
+def run_stages(browser:WebDriver, context) -> bool:
+    """Runs the pre_process, process and post_process stages of context"""
+    metrics = get_metrics()
     # Do any special treatement on the page before scrolling
     # like reloading if not responding, clicking buttons and so on
-    ok = context.pre_process(browser)
+    with metrics.timer("pre_process"):
+        ok = context.pre_process(browser)
     if not ok:
         logging.error("Error in pre_process stage, exiting")
-        browser.close()
-        return
+        return False
 
     # Now that we are going to work
-    ok = context.process(browser)
+    with metrics.timer("process"):
+        ok = context.process(browser)
     if not ok:
         logging.error("Error in process stage, exiting")
-        browser.close()
-        return
+        return False
 
     # Stop working, and do final cleanout or whatever
-    ok = context.post_process(browser)
+    with metrics.timer("post_process"):
+        ok = context.post_process(browser)
     if not ok:
         logging.error("Error in post_process stage, exiting")
-        browser.close()
-        return
-    
-    browser.close()
+        return False
+    return True
     
 
 #################################################
@@ -293,7 +678,7 @@ def get_items_from_url(url:str, cookie_path:str, context):
 #################################################
 def test_url_root():
     url = "https://bsky.app/profile/badempanada.com"
-    base_url = url[:url.find("/", 9)] # len( "https://" )
+    base_url = base_url_of(url)
     logging.info(f"{base_url}")
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+import os
+import time
+import json
+import heapq
+import random
+import signal
+import logging
+import threading
+import dataclasses
+import http.server
+import concurrent.futures
+# local imports
+from src.metrics import get_metrics
+from src.ratelimit import get_limiter
+
+# Suffixes of the intervals of a watchlist, see parse_interval
+UNITS = {"s" : 1., "m" : 60., "h" : 3600., "d" : 86400.}
+
+
+def parse_interval(value:str) -> float:
+    """"90" -> 90., "15m" -> 900., "2h" -> 7200., in seconds"""
+    value = value.strip().lower()
+    scale = UNITS.get(value[-1:], None)
+    if scale == None:
+        return float(value)
+    return float(value[:-1]) * scale
+
+
+@dataclasses.dataclass
+class watch_target:
+    site:str
+    user:str
+    data_type:str
+    # Seconds between polls, see watch_daemon
+    interval:float = 3600.
+    # Same as socialmedia_context.timeout
+    timeout:float = 600.
+
+    def name(self) -> str:
+        return f"{self.site} {self.user or '-'} {self.data_type}"
+
+
+class target_panic(Exception):
+    """Raised by a job function when the site kept showing its panic string, see socialmedia_context.retry"""
+
+
+def read_watchlist(path:str, default_interval:float=3600., default_timeout:float=600.) -> list[watch_target]:
+    """
+    Reads a watchlist, with one 'site user data_type [interval [timeout]]'
+    target per line, the interval can be given as 90, 15m, 2h or 1d.
+    Use '-' as user for the home tab, lines starting with # are ignored.
+    """
+    targets = []
+    with open(path, "r") as file:
+        for line in file.read().split("\n"):
+            line = line.strip()
+            if line == "" or line[0] == "#":
+                continue
+            fields = line.split()
+            if len(fields) < 3:
+                logging.error(f"Ignoring target '{line}', expected: site user data_type [interval [timeout]]")
+                continue
+            try:
+                interval = parse_interval(fields[3]) if len(fields) > 3 else default_interval
+                timeout = float(fields[4]) if len(fields) > 4 else default_timeout
+            except ValueError:
+                logging.error(f"Ignoring target '{line}', bad interval/timeout")
+                continue
+            user = "" if fields[1] == "-" else fields[1]
+            targets.append(watch_target(fields[0], user, fields[2], interval, timeout))
+    return targets
+
+
+class target_status:
+    """Runs, latency and backoff of a watch_target"""
+    def __init__(self, target:watch_target):
+        self.target = target
+        self.runs = 0
+        self.failures = 0
+        self.panics = 0
+        # Panics in a row, the target is backed off while > 0
+        self.panic_streak = 0
+        self.items = 0
+        self.last_items = 0
+        self.last_latency = 0.
+        self.total_latency = 0.
+        self.max_latency = 0.
+        self.last_run = 0.
+        self.last_error = ""
+        self.next_run = 0.
+        self.running = False
+
+    def add_run(self, items:int, latency:float, error:str="", panic:bool=False):
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_latency = latency
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_items = items
+        self.items += items
+        self.last_error = error
+        if error != "":
+            self.failures += 1
+        if panic:
+            self.panics += 1
+            self.panic_streak += 1
+        elif error == "":
+            self.panic_streak = 0
+
+    def to_dict(self, now:float) -> dict:
+        return {
+            "site" : self.target.site, "user" : self.target.user, "data_type" : self.target.data_type,
+            "interval" : self.target.interval, "running" : self.running,
+            "next_run" : self.next_run, "next_run_in" : max(0., self.next_run - now),
+            "runs" : self.runs, "failures" : self.failures, "panics" : self.panics,
+            "panic_streak" : self.panic_streak, "items" : self.items, "last_items" : self.last_items,
+            "last_run" : self.last_run, "last_latency" : self.last_latency, "max_latency" : self.max_latency,
+            "mean_latency" : self.total_latency / self.runs if self.runs > 0 else 0.,
+            "last_error" : self.last_error,
+        }
+
+
+class watch_daemon:
+    """
+    Polls every target of a watchlist on its own interval, running
+    job_func(target) -> number of new items, with up to workers targets at
+    the same time.
+    Every delay is randomized by +-jitter (a fraction of it), so targets
+    don't poll in lockstep. A target that raises target_panic is backed
+    off, its interval multiplied by backoff_factor for every panic in a
+    row (up to max_backoff seconds), until it runs fine again.
+    The queue and the state of every target are written to status_file
+    every status_every seconds and after every run, and can be served
+    over http (see serve).
+    """
+    def __init__(self, targets:list[watch_target], job_func, *, workers:int=1, jitter:float=0.1,
+            backoff_factor:float=2., max_backoff:float=24*3600., status_file:str="", status_every:float=10.):
+        self.targets = [target_status(t) for t in targets]
+        self.job_func = job_func
+        self.workers = workers
+        self.jitter = jitter
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_file = status_file
+        self.status_every = status_every
+        # Heap of (next_run, target index) of the targets not running
+        self.queue = []
+        self.running = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.server = None
+
+    def run(self):
+        """Polls the targets until stop is called (or SIGINT/SIGTERM), then waits for the running ones"""
+        if threading.current_thread() == threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        now = time.time()
+        with self.lock:
+            for i, status in enumerate(self.targets):
+                # Spread the first polls, instead of starting every target at once
+                status.next_run = now + random.uniform(0., self.jitter * status.target.interval)
+                heapq.heappush(self.queue, (status.next_run, i))
+        logging.info(f"Watching {len(self.targets)} targets with {self.workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while not self.stopping.is_set():
+                    self.wake.clear()
+                    self.__launch_due(executor)
+                    self.save_status()
+                    self.wake.wait(self.__sleep_time())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stopping.set()
+                logging.info(f"Stopping, waiting for {self.running} running targets")
+        self.save_status()
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+
+    def status(self) -> dict:
+        now = time.time()
+        with self.lock:
+            return {
+                "started" : self.started, "updated" : now, "workers" : self.workers,
+                "running" : self.running,
+                "queue_depth" : sum(1 for s in self.targets if (not s.running) and (s.next_run <= now)),
+                "stopping" : self.stopping.is_set(),
+                "targets" : [s.to_dict(now) for s in self.targets],
+                "rate_limits" : get_limiter().report(),
+            }
+
+    def save_status(self):
+        if self.status_file == "":
+            return
+        tmp_path = self.status_file + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.status(), file, indent=4)
+        os.replace(tmp_path, self.status_file)
+
+    def serve(self, port:int, host:str="127.0.0.1"):
+        """Serves status() on /status and the metrics on /metrics (Prometheus text format)"""
+        self.server = http.server.ThreadingHTTPServer((host, port), status_handler)
+        self.server.daemon_threads = True
+        self.server.watch = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"Serving status on http://{host}:{self.server.server_address[1]}/status")
+
+    def delay(self, status:target_status) -> float:
+        """Seconds until the next poll of status' target"""
+        delay = status.target.interval
+        if status.panic_streak > 0:
+            delay = max(delay, min(self.max_backoff, delay * self.backoff_factor ** status.panic_streak))
+        return delay * random.uniform(1. - self.jitter, 1. + self.jitter)
+
+    def __launch_due(self, executor):
+        now = time.time()
+        with self.lock:
+            while (len(self.queue) > 0) and (self.queue[0][0] <= now) and (self.running < self.workers):
+                _, i = heapq.heappop(self.queue)
+                self.targets[i].running = True
+                self.running += 1
+                executor.submit(self.__run_target, i)
+
+    def __sleep_time(self) -> float:
+        with self.lock:
+            if (len(self.queue) == 0) or (self.running >= self.workers):
+                return self.status_every
+            return min(self.status_every, max(0., self.queue[0][0] - time.time()))
+
+    def __run_target(self, i:int):
+        status = self.targets[i]
+        target = status.target
+        metrics = get_metrics()
+        logging.info(f"Polling {target.name()}")
+        n, error, panic = 0, "", False
+        start = time.time()
+        try:
+            n = self.job_func(target)
+        except target_panic as e:
+            error, panic = str(e), True
+        except Exception as e:
+            logging.error(f"Polling {target.name()} failed: {e}")
+            error = str(e)
+        latency = time.time() - start
+        metrics.add_time("watch_poll", latency)
+        metrics.count("watch_polls")
+        if error != "":
+            metrics.count("watch_panics" if panic else "watch_failures")
+        with self.lock:
+            status.add_run(n, latency, error, panic)
+            delay = self.delay(status)
+            status.next_run = time.time() + delay
+            status.running = False
+            self.running -= 1
+            heapq.heappush(self.queue, (status.next_run, i))
+        if panic:
+            logging.warning(f"{target.name()} panicked {status.panic_streak} times in a row, backing off for {delay:.0f}s")
+        elif error != "":
+            logging.info(f"Next poll of {target.name()} in {delay:.0f}s")
+        else:
+            logging.info(f"{target.name()}: {n} new items in {latency:.1f}s, next poll in {delay:.0f}s")
+        self.wake.set()
+
+
+class status_handler(http.server.BaseHTTPRequestHandler):
+    """Handler of watch_daemon.serve"""
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path in ("", "/status"):
+            body = json.dumps(self.server.watch.status(), indent=4).encode()
+            content_type = "application/json"
+        elif path == "/metrics":
+            body = get_metrics().prometheus_text().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
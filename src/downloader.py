@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import concurrent.futures
+from urllib.parse import urlsplit
+# thirdparty
+import requests
+from requests.adapters import HTTPAdapter
+# local imports
+from src.metrics import get_metrics
+from src.ratelimit import get_limiter
+
+# Worth retrying, with backoff
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def new_session(pool_size:int=16) -> requests.Session:
+    """Session keeping up to pool_size connections alive per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class resume_journal:
+    """
+    Json file (.resume.json, next to the downloads) recording the url,
+    validator (ETag/Last-Modified) and total size of every unfinished
+    download, so its .part file can be resumed later with a Range request.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, out_dir:str):
+        self.path = os.path.join(out_dir, ".resume.json")
+
+    def get(self, filepath:str) -> dict:
+        with self.lock:
+            return self.__load().get(os.path.basename(filepath))
+
+    def set(self, filepath:str, entry:dict):
+        with self.lock:
+            entries = self.__load()
+            entries[os.path.basename(filepath)] = entry
+            self.__save(entries)
+
+    def remove(self, filepath:str):
+        with self.lock:
+            entries = self.__load()
+            if entries.pop(os.path.basename(filepath), None) == None:
+                return
+            if len(entries) == 0:
+                os.remove(self.path)
+            else:
+                self.__save(entries)
+
+    def __load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            logging.warning(f"Ignoring corrupted {self.path}")
+            return {}
+
+    def __save(self, entries:dict):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+
+
+class downloader:
+    """
+    Downloads files reusing connections from a shared requests.Session,
+    streaming them to disk in chunks so memory doesn't grow with file size.
+    At most per_host downloads hit the same host at once, failed ones
+    (connection errors, 429/5xx) are retried with exponential backoff.
+    Files are written to <file>.part and renamed once complete, an
+    interrupted .part is resumed (see resume_journal) instead of restarted.
+    """
+    def __init__(self, workers:int=16, per_host:int=8, *, retries:int=3, backoff:float=0.5,
+            timeout:tuple=(10., 30.), chunk_size:int=1 << 16):
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = new_session(max(workers, per_host))
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.start = time.time()
+
+    def rate(self) -> float:
+        """Bytes per second downloaded since the downloader was created"""
+        elapsed = time.time() - self.start
+        return self.bytes / elapsed if elapsed > 0 else 0.
+
+    def download(self, url:str, filepath:str) -> bool:
+        """Downloads url into filepath, returns False if it couldn't"""
+        metrics = get_metrics()
+        with metrics.timer("download"):
+            ok = self.__download(url, filepath)
+        metrics.count("downloads" if ok else "downloads_failed")
+        return ok
+
+    def __download(self, url:str, filepath:str) -> bool:
+        limiter = get_limiter()
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2**attempt
+            try:
+                limiter.wait(url)
+                with self.__host_slot(url):
+                    status, retry_after = self.__fetch(url, filepath)
+                if status == None:
+                    # Already downloaded, the server wasn't asked
+                    return True
+                limiter.feedback(url, status, retry_after=retry_after)
+                if status < 400:
+                    return True
+                if status not in RETRY_STATUS:
+                    logging.error(f"Couldn't Download {url}: {status}")
+                    return False
+                if retry_after != None:
+                    wait = max(wait, retry_after)
+            except requests.RequestException as e:
+                logging.warning(f"Error downloading {url}: {e}")
+            if attempt < self.retries:
+                time.sleep(wait)
+        logging.error(f"Couldn't Download {url} after {self.retries} retries!")
+        return False
+
+    def download_all(self, urls:list, filepaths:list) -> int:
+        """Downloads each url into its filepath concurrently, returns how many succeded"""
+        size = max(1, min(len(urls), self.workers))
+        count, done = 0, 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(self.download, url, path) for url, path in zip(urls, filepaths)]
+            for future in concurrent.futures.as_completed(futures):
+                count += 1
+                done += 1 if future.result() else 0
+                print(f"[INFO] Downloading {count}/{len(urls)}; {self.rate() / 2**20:.2f}MB/s\r", end="")
+            print("")
+        logging.info(f"Downloaded {self.bytes / 2**20:.1f}MB at {self.rate() / 2**20:.2f}MB/s")
+        return done
+
+    def __fetch(self, url:str, filepath:str):
+        """Streams url into filepath, returns the http status (None if no request was needed) and Retry-After"""
+        part = filepath + ".part"
+        journal = resume_journal(os.path.dirname(filepath))
+        entry = journal.get(filepath)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {}
+        if (offset > 0) and (entry != None) and (entry["url"] == url):
+            if offset == entry["size"]:
+                # Finished, but wasn't renamed
+                os.replace(part, filepath)
+                journal.remove(filepath)
+                return None, None
+            headers["Range"] = f"bytes={offset}-"
+            # The .part has the decoded bytes, the range must be of them too
+            headers["Accept-Encoding"] = "identity"
+            if entry["validator"] != None:
+                headers["If-Range"] = entry["validator"]
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if (response.status_code == 416) and ("Range" in headers):
+                # Our .part doesn't match the file anymore, start again right away
+                response.close()
+                os.remove(part)
+                journal.remove(filepath)
+                return self.__fetch(url, filepath)
+            if not response.ok:
+                return response.status_code, retry_after_of(response)
+            if response.status_code == 206:
+                mode = "ab"
+                size = total_size_of(response)
+                logging.info(f"Resuming {url} from {offset / 2**20:.1f}MB")
+            else:
+                mode = "wb"
+                size = int(response.headers.get("Content-Length", -1))
+            if response.headers.get("Content-Encoding", "identity") != "identity":
+                # Content-Length is the encoded size and iter_content decodes
+                # the body, so it can't be checked nor resumed with a Range
+                size = -1
+                journal.remove(filepath)
+            else:
+                journal.set(filepath, {
+                    "url" : url, "size" : size,
+                    "validator" : response.headers.get("ETag", response.headers.get("Last-Modified")),
+                })
+            with open(part, mode) as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    with self.lock:
+                        self.bytes += len(chunk)
+            get_metrics().count("download_bytes", os.path.getsize(part) - (offset if mode == "ab" else 0))
+            if (size != -1) and (os.path.getsize(part) != size):
+                raise requests.ConnectionError(f"Got {os.path.getsize(part)} of {size} bytes")
+            os.replace(part, filepath)
+            journal.remove(filepath)
+            return response.status_code, None
+
+    @contextlib.contextmanager
+    def __host_slot(self, url:str):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            slot = self.hosts[host]
+        with slot:
+            yield
+
+
+def total_size_of(response) -> int:
+    """Content-Range: bytes 100-199/200 -> 200, -1 if unknown"""
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(total) if total.isdigit() else -1
+
+
+def retry_after_of(response) -> float:
+    value = response.headers.get("Retry-After")
+    if value == None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
@@ -0,0 +1,120 @@
+import logging
+from collections import OrderedDict
+# thirdparty
+import lxml.html
+from lxml import etree
+
+# The lxml backend is a faster drop in replacement for the BeautifulSoup
+# find functions (the reference implementation). Its extraction rules are
+# xpaths declared once per site and compiled with compile_rules, and the
+# bs_* helpers mimic the BeautifulSoup accessors the reference uses, so
+# both give the same output.
+BACKENDS = ("bs4", "lxml")
+
+
+def compile_rules(rules:dict[str, str]) -> dict[str, etree.XPath]:
+    return {name: etree.XPath(xpath) for name, xpath in rules.items()}
+
+
+def parse_html(page_source:str):
+    """Root of page_source (may be just some feed items), None if empty"""
+    if page_source.strip() == "":
+        return None
+    return lxml.html.document_fromstring(page_source)
+
+
+class parse_memo:
+    """
+    Bounded LRU of what a parse function gave for each markup (feed items
+    like tweet articles), so items repeated across page snapshots aren't
+    extracted again. Markups are kept as their hash, at most max_size of them.
+    """
+    def __init__(self, max_size:int=4096):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, markup, func, *args):
+        """func(*args), or what it gave last time for the same markup"""
+        key = hash(markup)
+        if key in self.items:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+        self.misses += 1
+        res = func(*args)
+        self.items[key] = res
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+        return res
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def clear(self):
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def first(rule:etree.XPath, el):
+    """First match of rule in el, None if there's none"""
+    res = rule(el)
+    return res[0] if len(res) > 0 else None
+
+
+def bs_contents(el) -> list:
+    """Tag.contents: text and child elements, in order"""
+    contents = []
+    if el.text:
+        contents.append(el.text)
+    for child in el:
+        contents.append(child)
+        if child.tail:
+            contents.append(child.tail)
+    return contents
+
+
+def bs_string(el) -> str:
+    """Tag.string: the only string inside el, None if there isn't exactly one"""
+    contents = bs_contents(el)
+    if len(contents) != 1:
+        return None
+    child = contents[0]
+    if isinstance(child, str):
+        return child
+    if child.tag is etree.Comment:
+        return child.text
+    return bs_string(child)
+
+
+def bs_next_sibling(el):
+    """Tag.next_sibling: text right after el, or the next element"""
+    if el.tail:
+        return el.tail
+    return el.getnext()
+
+
+def tag_names(el) -> set[str]:
+    """Names of el and all its descendants"""
+    return {e.tag for e in el.iter() if isinstance(e.tag, str)}
+
+
+def compare_backends(reference, fast, page_source:str, *args) -> list[str]:
+    """
+    Runs both find functions over page_source, and returns how their
+    output differs (empty if it's the same)
+    """
+    expected = reference(page_source, *args)
+    got = fast(page_source, *args)
+    diffs = []
+    if len(expected) != len(got):
+        diffs.append(f"Found {len(got)} items instead of {len(expected)}")
+    for i, (a, b) in enumerate(zip(expected, got)):
+        if a != b:
+            diffs.append(f"Item {i}: {b} instead of {a}")
+    for diff in diffs:
+        logging.error(f"{fast.__name__}: {diff}")
+    return diffs
@@ -0,0 +1,110 @@
+import logging
+# thirdparty
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+# Helpers of the extraction scripts, arguments[0] is the name of the
+# extractor, the rest are its arguments.
+# The bs* functions mimic the BeautifulSoup accessors the python parsers
+# use (like fast_parse does for lxml), so both give the same records.
+COMMON_JS = """
+const wssName = arguments[0];
+window.__wss_seen = window.__wss_seen || {};
+const wssSeen = window.__wss_seen[wssName] = window.__wss_seen[wssName] || new Set();
+const wssFound = [];
+
+// cyrb53, 53 bit hash of a string
+function wssHash(str) {
+    let h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+    for (let i = 0; i < str.length; i++) {
+        const ch = str.charCodeAt(i);
+        h1 = Math.imul(h1 ^ ch, 2654435761);
+        h2 = Math.imul(h2 ^ ch, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    return 4294967296 * (2097151 & h2) + (h1 >>> 0);
+}
+
+// True if el (with its current markup) was already extracted
+function wssIsSeen(el) {
+    const hash = wssHash(el.outerHTML);
+    if (wssSeen.has(hash)) return true;
+    wssFound.push(hash);
+    return false;
+}
+
+// Marks what was found as seen, only once everything was extracted
+function wssDone(items) {
+    for (const hash of wssFound) wssSeen.add(hash);
+    return items;
+}
+
+function must(value) {
+    if (value === null || value === undefined) throw new Error("Missing value");
+    return value;
+}
+
+// int() of python
+function pyInt(str) {
+    if (!/^\s*[+-]?\d+\s*$/.test(str)) throw new Error(`Not an int: ${str}`);
+    return parseInt(str, 10);
+}
+
+function bsString(el) {
+    const nodes = el.childNodes;
+    if (nodes.length !== 1) return null;
+    const node = nodes[0];
+    if (node.nodeType === Node.TEXT_NODE || node.nodeType === Node.COMMENT_NODE) return node.data;
+    return bsString(node);
+}
+
+function bsNextSibling(el) {
+    let node = el.nextSibling;
+    while (node !== null && node.nodeType === Node.TEXT_NODE && node.data === "") node = node.nextSibling;
+    if (node !== null && node.nodeType === Node.TEXT_NODE) throw new Error("Text after element");
+    return node;
+}
+
+function tagNames(el) {
+    const names = new Set([el.localName]);
+    for (const child of el.getElementsByTagName("*")) names.add(child.localName);
+    return names;
+}
+"""
+
+
+class js_extractor:
+    """
+    Extracts feed items inside the page with execute_script, instead of
+    sending the whole page source to be parsed in python.
+    script returns the records of the feed items it hasn't returned
+    before (or that changed since), see COMMON_JS, as dicts turned into
+    record(item) if given (see records).
+    """
+    def __init__(self, name:str, script:str, *args, record=None):
+        self.name = name
+        self.script = COMMON_JS + script
+        self.args = args
+        self.record = record
+        # It sees the items already in the page
+        self.parse_first = False
+
+    def __call__(self, browser:WebDriver) -> list:
+        res = browser.execute_script(self.script, self.name, *self.args)
+        if (self.record != None) and isinstance(res, list):
+            res = [self.record(item) for item in res]
+        return res
+
+
+def extract_items(browser:WebDriver, extract:js_extractor) -> list:
+    """Items found by extract, None if it failed"""
+    try:
+        res = extract(browser)
+    except WebDriverException as e:
+        logging.warning(f"In browser extraction failed, parsing page sources instead: {e.msg}")
+        return None
+    if not isinstance(res, list):
+        logging.warning(f"In browser extraction returned {type(res).__name__}, parsing page sources instead")
+        return None
+    return res
@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+# local imports
+from src.downloader import downloader
+
+# Query parameters that change the content, the rest (sizes...) are dropped
+KEEP_PARAMS = ("format", )
+
+manifest_lock = threading.Lock()
+
+
+def normalize_media_url(url:str) -> str:
+    """https://pbs.twimg.com/media/ID?format=jpg&name=small -> https://pbs.twimg.com/media/ID?format=jpg"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k in KEEP_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def file_sha256(path:str, chunk_size:int=1 << 16) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_file(src:str, dst:str):
+    """Hardlinks src into dst, copying it if they are in different filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class media_store:
+    """
+    Content addressed store of downloaded media.
+    Each file is saved once in root/blobs/<sha256[:2]>/<sha256> and
+    hardlinked to wherever it's wanted (e.g. out_path/user/name).
+    root/manifest.json maps normalized media urls to blobs, and users to
+    the files they have, so media already downloaded (by any user) is
+    never downloaded or written again.
+    """
+    def __init__(self, root:str):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self.manifest = self.__load()
+
+    def blob_path(self, sha:str) -> str:
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def lookup(self, url:str) -> str:
+        """Path to the blob of url, "" if it isn't stored"""
+        entry = self.manifest["urls"].get(normalize_media_url(url))
+        if entry == None:
+            return ""
+        path = self.blob_path(entry["sha256"])
+        return path if os.path.exists(path) else ""
+
+    def download(self, urls:list, out_dir:str, names:list, user:str="", engine:downloader=None) -> int:
+        """
+        Puts each url in out_dir/name, downloading only the ones not in the store
+        Returns how many files are in out_dir afterwards
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        todo, tmp_paths = [], []
+        placed = 0
+        for url, name in zip(urls, names):
+            if url == "":
+                logging.error("Can't download empty url")
+                continue
+            blob = self.lookup(url)
+            if blob != "":
+                placed += self.__place(blob, out_dir, name, user)
+                continue
+            todo.append((url, name))
+            tmp_paths.append(os.path.join(self.root, "tmp", hashlib.sha1(url.encode()).hexdigest()))
+        logging.info(f"{placed} files already in the store, downloading {len(todo)}")
+        if len(todo) > 0:
+            if engine == None:
+                engine = downloader()
+            engine.download_all([url for url, _ in todo], tmp_paths)
+        for (url, name), tmp_path in zip(todo, tmp_paths):
+            if not os.path.exists(tmp_path):
+                continue
+            blob = self.add(url, tmp_path, os.path.splitext(name)[1])
+            placed += self.__place(blob, out_dir, name, user)
+        self.save()
+        return placed
+
+    def add(self, url:str, path:str, ext:str="") -> str:
+        """Moves the file at path (downloaded from url) into the store, returns its blob path"""
+        sha = file_sha256(path)
+        blob = self.blob_path(sha)
+        if os.path.exists(blob):
+            # Same content under another url
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+        self.manifest["urls"][normalize_media_url(url)] = {
+            "sha256" : sha, "ext" : ext, "size" : os.path.getsize(blob)
+        }
+        return blob
+
+    def save(self):
+        """Writes the manifest, merging it with any changes saved meanwhile"""
+        with manifest_lock:
+            on_disk = self.__load()
+            for key in ("urls", "users"):
+                for k, v in self.manifest[key].items():
+                    if key == "users" and k in on_disk[key]:
+                        on_disk[key][k].update(v)
+                    else:
+                        on_disk[key][k] = v
+            self.manifest = on_disk
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.manifest, file)
+            os.replace(tmp_path, self.manifest_path)
+
+    def __place(self, blob:str, out_dir:str, name:str, user:str) -> int:
+        dst = os.path.join(out_dir, name)
+        if not os.path.exists(dst):
+            link_file(blob, dst)
+        sha = os.path.basename(blob)
+        self.manifest["users"].setdefault(user, {})[name] = sha
+        return 1
+
+    def __load(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {"urls" : {}, "users" : {}}
+        with open(self.manifest_path, "r") as file:
+            return json.load(file)
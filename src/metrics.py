@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+from collections import Counter
+
+# Profilers that can be hooked around a phase, see metrics.profile
+PROFILERS = ("cprofile", "sample")
+
+
+class phase_stats:
+    """Calls, total and max duration of a timed phase"""
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds:float):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls" : self.calls, "seconds" : self.total, "max_seconds" : self.max,
+            "mean_seconds" : self.total / self.calls if self.calls > 0 else 0.,
+        }
+
+
+class stack_sampler:
+    """
+    Sampling profiler, a thread that every interval seconds records the
+    stack of the threads inside the profiled phase.
+    Saved as collapsed stacks ("outer;inner;leaf count" lines), the input
+    of flamegraph.pl/speedscope.
+    """
+    def __init__(self, interval:float=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enable(self):
+        with self.lock:
+            self.threads.add(threading.get_ident())
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+
+    def disable(self):
+        with self.lock:
+            self.threads.discard(threading.get_ident())
+
+    def save(self, path:str):
+        with self.lock:
+            self.thread = None
+            stacks = list(self.stacks.items())
+        with open(path, "w") as file:
+            for stack, count in sorted(stacks, key=lambda s: -s[1]):
+                file.write(f"{stack} {count}\n")
+
+    def __run(self):
+        me = threading.current_thread()
+        while self.thread == me:
+            with self.lock:
+                threads = set(self.threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                names = []
+                while frame != None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if len(names) > 0:
+                    with self.lock:
+                        self.stacks[";".join(reversed(names))] += 1
+            time.sleep(self.interval)
+
+
+class metrics:
+    """
+    Timers and counters of the phases of a scrape (browser startup, page
+    source fetches, parsing, dedup, downloads...), shared by every thread.
+    Timed phases that run concurrently (downloads) add up their durations.
+    Can be saved as a json report or a Prometheus textfile (see save_prometheus),
+    and one phase can be profiled (see profile).
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.profiler = None
+        self.profile_phase = None
+        self.profiling = False
+
+    @contextlib.contextmanager
+    def timer(self, phase:str):
+        """Times the block as a call of phase"""
+        profiler = self.__start_profile(phase)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+            if profiler != None:
+                profiler.disable()
+                self.profiling = False
+
+    def add_time(self, phase:str, seconds:float):
+        with self.lock:
+            if phase not in self.timers:
+                self.timers[phase] = phase_stats()
+            self.timers[phase].add(seconds)
+
+    def count(self, name:str, n:int=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def profile(self, phase:str, profiler:str="cprofile"):
+        """Profiles every call of phase with profiler (see PROFILERS), saved by save_profile"""
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one of {PROFILERS}")
+        self.profile_phase = phase
+        self.profiler = cProfile.Profile() if profiler == "cprofile" else stack_sampler()
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "elapsed" : time.time() - self.start,
+                "phases" : {phase : stats.to_dict() for phase, stats in self.timers.items()},
+                "counters" : dict(self.counters),
+            }
+
+    def save_json(self, path:str):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=4)
+        logging.info(f"Metrics saved to: {path}")
+
+    def prometheus_text(self, labels:dict=None) -> str:
+        """The metrics in the Prometheus text format"""
+        report = self.report()
+        label_str = ",".join(f'{k}="{escape_label(v)}"' for k, v in (labels or {}).items())
+        with_phase = lambda phase: "{" + ",".join(filter(None, [f'phase="{escape_label(phase)}"', label_str])) + "}"
+        lines = [
+            "# HELP wss_phase_seconds_total Time spent in each phase of the scrape.",
+            "# TYPE wss_phase_seconds_total counter",
+        ]
+        lines += [f"wss_phase_seconds_total{with_phase(p)} {s['seconds']}" for p, s in report["phases"].items()]
+        lines += [
+            "# HELP wss_phase_calls_total Times each phase of the scrape ran.",
+            "# TYPE wss_phase_calls_total counter",
+        ]
+        lines += [f"wss_phase_calls_total{with_phase(p)} {s['calls']}" for p, s in report["phases"].items()]
+        lines += [
+            "# HELP wss_phase_max_seconds Longest run of each phase of the scrape.",
+            "# TYPE wss_phase_max_seconds gauge",
+        ]
+        lines += [f"wss_phase_max_seconds{with_phase(p)} {s['max_seconds']}" for p, s in report["phases"].items()]
+        for name, value in report["counters"].items():
+            metric = "wss_" + "".join(c if c.isalnum() else "_" for c in name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric}{{{label_str}}} {value}" if label_str != "" else f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, path:str, labels:dict=None):
+        """
+        Saves the metrics in the Prometheus text format, to be picked up by
+        node_exporter's textfile collector (written to a temporary file
+        and renamed, so it's never read half written)
+        """
+        text = self.prometheus_text(labels)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+        logging.info(f"Prometheus metrics saved to: {path}")
+
+    def save_profile(self, path:str):
+        """Saves the profile of the profiled phase (.prof of pstats or collapsed stacks)"""
+        if self.profiler == None:
+            return
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.dump_stats(path)
+            pstats.Stats(self.profiler).sort_stats("cumulative").print_stats(15)
+        else:
+            self.profiler.save(path)
+        logging.info(f"Profile of {self.profile_phase} saved to: {path}")
+
+    def log_summary(self):
+        report = self.report()
+        for phase, stats in sorted(report["phases"].items(), key=lambda p: -p[1]["seconds"]):
+            logging.info(f"{phase}: {stats['seconds']:.2f}s in {stats['calls']} calls (max {stats['max_seconds']:.2f}s)")
+        for name, value in report["counters"].items():
+            logging.info(f"{name}: {value}")
+
+    def __start_profile(self, phase:str):
+        if (self.profiler == None) or (phase != self.profile_phase):
+            return None
+        with self.lock:
+            # cProfile can't profile nested/concurrent calls
+            if self.profiling:
+                return None
+            self.profiling = True
+        self.profiler.enable()
+        return self.profiler
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Metrics of this process, see get_metrics
+current = metrics()
+
+
+def get_metrics() -> metrics:
+    """Metrics shared by everything running in this process"""
+    return current
@@ -0,0 +1,283 @@
+import io
+import os
+import gzip
+import json
+import time
+import zlib
+import logging
+from time import strftime
+# thirdparty (optional)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+# local imports
+from src.records import to_json
+
+COMPRESSIONS = {"": "", "gzip": ".gz", "zstd": ".zst"}
+# Extension of the files of each export format, see export
+FORMATS = {"json": ".json", "ndjson": ".ndjson", "parquet": ".parquet", "arrow": ".arrow"}
+# Records per parquet row group/arrow record batch
+ROW_GROUP_SIZE = 64 * 1024
+# Raised reading a compressed file cut short (by a crash or a killed job)
+TRUNCATED_ERRORS = (EOFError, zlib.error, gzip.BadGzipFile) + ((zstandard.ZstdError, ) if zstandard != None else ())
+
+
+def open_text(path:str, mode:str, compression:str=""):
+    """Opens path in text mode, (de)compressing it with gzip/zstd if asked"""
+    if compression == "":
+        return open(path, mode, encoding="utf-8")
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        if zstandard == None:
+            raise Exception("zstd compression needs the zstandard package")
+        if mode == "r":
+            # Appending adds frames, read all of them
+            reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+    raise Exception(f"Unknown compression: {compression}")
+
+
+def compression_of(path:str) -> str:
+    for compression, ext in COMPRESSIONS.items():
+        if ext != "" and path.endswith(ext):
+            return compression
+    return ""
+
+
+class ndjson_sink:
+    """
+    Writes records to a newline delimited json file as soon as they are found,
+    so a crash only loses what hasn't been flushed yet.
+    It flushes every flush_every records or flush_interval seconds.
+    """
+    def __init__(self, path:str, compression:str="", *, append:bool=False,
+            flush_every:int=100, flush_interval:float=5.):
+        self.path = path
+        self.compression = compression
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        if append:
+            repair_ndjson(path, compression)
+        self.file = open_text(path, "a" if append else "w", compression)
+        self.pending = 0
+        self.last_flush = time.time()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, default=to_json) + "\n")
+        self.count += 1
+        self.pending += 1
+        if (self.pending >= self.flush_every) or (time.time() - self.last_flush > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_ndjson(path:str):
+    """Yields all records in a (maybe compressed) ndjson file, skipping a truncated last line/stream"""
+    with open_text(path, "r", compression_of(path)) as file:
+        try:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping truncated record in {path}")
+        except TRUNCATED_ERRORS as e:
+            logging.warning(f"Skipping the truncated end of {path}: {e}")
+
+
+def repair_ndjson(path:str, compression:str=""):
+    """
+    Makes a file left by a crash safe to append to: drops its partial last
+    line, or for a truncated gzip/zstd stream, rewrites the complete lines
+    it has into a new one (what's appended after a broken stream can't be read)
+    """
+    if not os.path.exists(path):
+        return
+    if compression == "":
+        with open(path, "rb+") as file:
+            end = file.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            file.seek(end - 1)
+            if file.read(1) == b"\n":
+                return
+            # Look for the last complete line backwards
+            keep = 0
+            while end > 0:
+                start = max(0, end - (1 << 16))
+                file.seek(start)
+                index = file.read(end - start).rfind(b"\n")
+                if index != -1:
+                    keep = start + index + 1
+                    break
+                end = start
+            file.truncate(keep)
+        logging.warning(f"Dropped the partial last line of {path}")
+        return
+    if complete_stream(path, compression):
+        return
+    tmp_path = path + ".tmp"
+    n = 0
+    with open_text(path, "r", compression) as src, open_text(tmp_path, "w", compression) as dst:
+        try:
+            for line in src:
+                if not line.endswith("\n"):
+                    break
+                dst.write(line)
+                n += 1
+        except TRUNCATED_ERRORS:
+            pass
+    os.replace(tmp_path, path)
+    logging.warning(f"Rewrote the truncated {path}, keeping its {n} complete lines")
+
+
+def complete_stream(path:str, compression:str) -> bool:
+    """Wether the compressed file at path can be read to its end, ending in a newline"""
+    last = "\n"
+    with open_text(path, "r", compression) as file:
+        try:
+            for line in file:
+                last = line
+        except TRUNCATED_ERRORS:
+            return False
+    return last.endswith("\n")
+
+
+def latest_records(ndjson_path:str, key_func=None) -> list[dict]:
+    """
+    Records streamed to ndjson_path, the ones repeated with the same
+    key_func(record) keep their latest version (in their first position)
+    """
+    if key_func == None:
+        return list(read_ndjson(ndjson_path))
+    records = {}
+    for record in read_ndjson(ndjson_path):
+        records[key_func(record)] = record
+    return list(records.values())
+
+
+def finalize_json(ndjson_path:str, out_file:str, data_type:str, key_func=None) -> int:
+    """
+    Writes the records streamed to ndjson_path into out_file using the
+    {"date": ..., data_type: [...]} envelope.
+    Records repeated with the same key_func(record) keep their latest version.
+    Returns the number of records written.
+    """
+    stuff = latest_records(ndjson_path, key_func)
+    n = len(stuff)
+    with open(out_file, "w") as file:
+        now = strftime("%H:%M:%S-%d/%m/%Y")
+        file.write("{\n\"date\" : \"" + now + "\",\n")
+        file.write(f"\"{data_type}\" : [\n")
+        for i, element in enumerate(stuff):
+            json.dump(element, file, indent=4)
+            if i < n-1: file.write(", \n")
+        file.write("]\n}")
+    return n
+
+
+def compact_ndjson(ndjson_path:str, key_func=None) -> int:
+    """
+    Rewrites ndjson_path (keeping its compression) without the old versions
+    of repeated records, returns the number of records left
+    """
+    stuff = latest_records(ndjson_path, key_func)
+    tmp_path = ndjson_path + ".tmp"
+    with open_text(tmp_path, "w", compression_of(ndjson_path)) as file:
+        for record in stuff:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, ndjson_path)
+    return len(stuff)
+
+
+def arrow_schema(record_type) -> "pyarrow.Schema":
+    """Fixed schema of the flat columns of record_type (see records.record.columns)"""
+    types = {str : pyarrow.string(), int : pyarrow.int64(), bool : pyarrow.bool_()}
+    return pyarrow.schema([(name, types[kind]) for name, kind in record_type.columns()])
+
+
+def record_batches(stuff:list, record_type, schema, row_group_size:int=ROW_GROUP_SIZE):
+    """Yields stuff as arrow record batches of row_group_size records, with flattened columns"""
+    names = schema.names
+    for start in range(0, len(stuff), row_group_size):
+        rows = [record_type.flatten(record) for record in stuff[start:start + row_group_size]]
+        columns = [[row[name] for row in rows] for name in names]
+        yield pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def write_parquet(stuff:list, out_file:str, record_type, row_group_size:int=ROW_GROUP_SIZE) -> int:
+    """Writes stuff to out_file as zstd compressed parquet, a row group every row_group_size records"""
+    if pyarrow == None:
+        raise Exception("parquet output needs the pyarrow package")
+    schema = arrow_schema(record_type)
+    tmp_path = out_file + ".tmp"
+    with pyarrow.parquet.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        for batch in record_batches(stuff, record_type, schema, row_group_size):
+            writer.write_batch(batch)
+    os.replace(tmp_path, out_file)
+    return len(stuff)
+
+
+def write_arrow(stuff:list, out_file:str, record_type, row_group_size:int=ROW_GROUP_SIZE) -> int:
+    """Writes stuff to out_file as an arrow ipc (feather) file, a record batch every row_group_size records"""
+    if pyarrow == None:
+        raise Exception("arrow output needs the pyarrow package")
+    schema = arrow_schema(record_type)
+    tmp_path = out_file + ".tmp"
+    options = pyarrow.ipc.IpcWriteOptions(compression="zstd")
+    with pyarrow.ipc.new_file(tmp_path, schema, options=options) as writer:
+        for batch in record_batches(stuff, record_type, schema, row_group_size):
+            writer.write_batch(batch)
+    os.replace(tmp_path, out_file)
+    return len(stuff)
+
+
+def export(ndjson_path:str, out_base:str, out_format:str, data_type:str, key_func=None,
+        record_type=None) -> tuple[str, int]:
+    """
+    Exports the records streamed to ndjson_path as out_format (see FORMATS)
+    into out_base + its extension, keeping the latest version of repeated records:
+        json - pretty printed, with the envelope of finalize_json
+        ndjson - the streamed file itself, compacted
+        parquet/arrow - columnar, with the fixed schema of record_type (stats flattened)
+    Returns the file written and its number of records.
+    """
+    if out_format == "ndjson":
+        return ndjson_path, compact_ndjson(ndjson_path, key_func)
+    out_file = out_base + FORMATS[out_format]
+    if out_format == "json":
+        return out_file, finalize_json(ndjson_path, out_file, data_type, key_func)
+    if record_type == None:
+        raise Exception(f"{data_type} have no schema for {out_format} output")
+    stuff = latest_records(ndjson_path, key_func)
+    if out_format == "parquet":
+        return out_file, write_parquet(stuff, out_file, record_type)
+    if out_format == "arrow":
+        return out_file, write_arrow(stuff, out_file, record_type)
+    raise Exception(f"Unknown output format: {out_format}")
@@ -0,0 +1,184 @@
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+# local imports
+from src.metrics import get_metrics
+
+# Requests per second and burst allowed by default for each domain (and
+# its subdomains, the longest match wins), see rate_limiter
+DEFAULT_RATES = {
+    "x.com" : (1., 5),
+    "twitter.com" : (1., 5),
+    "twimg.com" : (10., 20),
+    "bsky.app" : (1., 5),
+    "api.bsky.app" : (5., 10),
+    "cdn.bsky.app" : (10., 20),
+    # Any other host, each with its own bucket
+    "*" : (5., 10),
+}
+# http status that make a domain slow down
+SLOWDOWN_STATUS = (429, 500, 502, 503, 504)
+
+
+def parse_rate(value:str) -> tuple[str, float, int]:
+    """"x.com=0.5" -> ("x.com", 0.5, 1), "twimg.com=10/20" -> ("twimg.com", 10., 20), a rate of 0 is unlimited"""
+    domain, _, rate = value.partition("=")
+    rate, _, burst = rate.partition("/")
+    if (domain == "") or (rate == ""):
+        raise ValueError(f"Expected domain=rate[/burst], got '{value}'")
+    return domain.strip().lower(), float(rate), int(burst) if burst != "" else max(1, int(float(rate)))
+
+
+class token_bucket:
+    """
+    rate tokens per second, up to burst of them, every request takes one.
+    slowdown divides the rate, see rate_limiter.penalize. No tokens are
+    earned until blocked_until, the requests waiting then are spaced out
+    after it at the slowed rate
+    """
+    def __init__(self, rate:float, burst:int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.slowdown = 1.
+        self.blocked_until = 0.
+        self.requests = 0
+        self.waits = 0
+        self.waited = 0.
+        self.penalties = 0
+
+    def reserve(self) -> float:
+        """Takes a token, returns the seconds to wait until it can be used"""
+        self.requests += 1
+        if self.rate <= 0.:
+            return 0.
+        now = self.refill()
+        # Negative tokens are the requests already waiting for one
+        self.tokens -= 1.
+        wait = -self.tokens * self.slowdown / self.rate if self.tokens < 0. else 0.
+        return max(0., self.blocked_until - now) + wait
+
+    def refill(self) -> float:
+        """Adds the tokens earned since the last refill, returns the current time"""
+        now = time.monotonic()
+        if self.rate > 0.:
+            earned = max(0., now - max(self.updated, self.blocked_until)) * self.rate / self.slowdown
+            self.tokens = min(float(self.burst), self.tokens + earned)
+        self.updated = now
+        return now
+
+    def set_slowdown(self, slowdown:float):
+        # Tokens earned until now count at the old rate
+        self.refill()
+        self.slowdown = slowdown
+
+    def to_dict(self) -> dict:
+        return {
+            "rate" : self.rate, "burst" : self.burst, "slowdown" : self.slowdown,
+            "requests" : self.requests, "waits" : self.waits, "waited_seconds" : self.waited,
+            "penalties" : self.penalties,
+        }
+
+
+class rate_limiter:
+    """
+    Token bucket per domain (x.com, twimg.com, bsky.app...), shared by
+    everything hitting the sites from this process: page loads, expanded
+    posts, downloads and api requests call wait(url) before each request.
+    A domain answering 429/5xx or showing a panic string (see feedback)
+    is slowed down, halving its rate every time (up to max_slowdown), and
+    recovers a bit with every request that works.
+    """
+    def __init__(self, rates:dict=None, *, max_slowdown:float=16., recovery:float=0.9):
+        self.rates = dict(DEFAULT_RATES if rates == None else rates)
+        self.max_slowdown = max_slowdown
+        self.recovery = recovery
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def set_rate(self, domain:str, rate:float, burst:int):
+        with self.lock:
+            self.rates[domain] = (rate, burst)
+            # Buckets are made again with the new rate
+            self.buckets = {d : b for d, b in self.buckets.items() if self.__rate_of(d) != domain}
+
+    def domain_of(self, url:str) -> str:
+        """Key of the bucket of url, the longest domain of rates it's in, or its host"""
+        host = (urlsplit(url).hostname or "").lower()
+        domain = self.__rate_of(host)
+        return domain if domain != "*" else host
+
+    def wait(self, url:str) -> float:
+        """Waits until a request to url is allowed, returns the seconds waited"""
+        domain = self.domain_of(url)
+        with self.lock:
+            bucket = self.__bucket(domain)
+            delay = bucket.reserve()
+            if delay > 0.:
+                bucket.waits += 1
+                bucket.waited += delay
+        if delay > 0.:
+            time.sleep(delay)
+            get_metrics().add_time("ratelimit_wait", delay)
+        return delay
+
+    def feedback(self, url:str, status:int=None, *, panic:bool=False, retry_after:float=None):
+        """Slows url's domain down if the request got a 429/5xx or a panic string, else lets it recover"""
+        if panic or (status in SLOWDOWN_STATUS):
+            self.penalize(url, retry_after)
+        elif (status != None) and (status < 400):
+            domain = self.domain_of(url)
+            with self.lock:
+                bucket = self.__bucket(domain)
+                if bucket.slowdown > 1.:
+                    bucket.set_slowdown(max(1., bucket.slowdown * self.recovery))
+
+    def penalize(self, url:str, retry_after:float=None):
+        """Halves the rate of url's domain, blocking it for retry_after seconds if given"""
+        domain = self.domain_of(url)
+        with self.lock:
+            bucket = self.__bucket(domain)
+            bucket.set_slowdown(min(self.max_slowdown, bucket.slowdown * 2.))
+            bucket.penalties += 1
+            # Drop the burst, the domain already had too much
+            bucket.tokens = min(bucket.tokens, 0.)
+            if retry_after != None:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            slowdown = bucket.slowdown
+        get_metrics().count("ratelimit_penalties")
+        logging.warning(f"Slowing down requests to {domain}, {slowdown:.0f}x slower")
+
+    def report(self) -> dict:
+        with self.lock:
+            return {domain : bucket.to_dict() for domain, bucket in self.buckets.items()}
+
+    def log_summary(self):
+        for domain, stats in self.report().items():
+            if stats["waits"] > 0 or stats["penalties"] > 0:
+                logging.info(f"{domain}: {stats['requests']} requests, waited {stats['waited_seconds']:.1f}s "
+                        f"in {stats['waits']} waits, slowed down {stats['penalties']} times")
+
+    def __rate_of(self, host:str) -> str:
+        """Longest domain of rates host is (a subdomain of), "*" if none"""
+        best = "*"
+        for domain in self.rates:
+            if (host == domain) or host.endswith("." + domain):
+                if (best == "*") or (len(domain) > len(best)):
+                    best = domain
+        return best
+
+    def __bucket(self, domain:str) -> token_bucket:
+        if domain not in self.buckets:
+            self.buckets[domain] = token_bucket(*self.rates[self.__rate_of(domain)])
+        return self.buckets[domain]
+
+
+# Limiter of this process, see get_limiter
+current = rate_limiter()
+
+
+def get_limiter() -> rate_limiter:
+    """Rate limiter shared by everything running in this process"""
+    return current
@@ -0,0 +1,222 @@
+import sys
+import logging
+from collections.abc import Mapping
+
+
+class missing_type:
+    """Value of the fields a record doesn't have, see record"""
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+    def __reduce__(self):
+        return "MISSING"
+
+MISSING = missing_type()
+
+
+def to_count(value) -> int:
+    """3 -> 3, "1,234" -> 1234, "1.2K" -> 1200, as the sites abbreviate counts"""
+    if isinstance(value, int):
+        return value
+    if (value == None) or (value.strip() == ""):
+        return 0
+    value = value.strip().replace(",", "")
+    scale = {"K" : 10**3, "M" : 10**6, "B" : 10**9}.get(value[-1].upper(), 1)
+    try:
+        if scale == 1:
+            return int(value)
+        return round(float(value[:-1]) * scale)
+    except ValueError:
+        logging.warning(f"Can't read count: {value}")
+        return 0
+
+
+def restore_record(cls, values:tuple):
+    """Inverse of record.__reduce__"""
+    res = cls.__new__(cls)
+    for field, value in zip(cls.FIELDS, values):
+        if value is not MISSING:
+            object.__setattr__(res, field, value)
+    return res
+
+
+class record(Mapping):
+    """
+    Base of the scraped records, their fields are kept in __slots__ instead
+    of a dict per record, but they read (and are written, see to_dict) like
+    the dicts the parsers used to give, so record["handle"], .get(), "in"
+    and == keep working.
+    Fields that were never set aren't in the record, like a missing key.
+    """
+    __slots__ = ()
+    # Keys of the record, in order
+    KEYS = ()
+    # Fields with few different values (tweet types, handles...), interned
+    # so every record shares the same string
+    INTERNED = ()
+    # Fields stored as ints, see to_count
+    COUNTS = ()
+    # Fields that are True/False
+    BOOLS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(f for c in reversed(cls.__mro__) for f in c.__dict__.get("__slots__", ()))
+        cls.KEY_SET = frozenset(cls.KEYS)
+
+    def __init__(self, fields:dict=None, **kwargs):
+        if fields != None:
+            for key, value in fields.items():
+                self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key:str):
+        if key not in self.KEY_SET:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key:str, value):
+        if key not in self.KEY_SET:
+            raise KeyError(f"{type(self).__name__} has no field '{key}'")
+        if (key in self.INTERNED) and isinstance(value, str):
+            value = sys.intern(value)
+        elif key in self.COUNTS:
+            value = to_count(value)
+        setattr(self, key, value)
+
+    def __delitem__(self, key:str):
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other) -> bool:
+        if type(other) == type(self):
+            return self.__values() == other.__values()
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Just the values, much smaller than a pickled dict (see parse_pipeline)
+        return restore_record, (type(self), self.__values())
+
+    def to_dict(self) -> dict:
+        return {key : getattr(self, key) for key in self}
+
+    @classmethod
+    def columns(cls) -> list[tuple[str, type]]:
+        """(name, type) of the flat columns of the record, see flatten"""
+        return [(key, int if key in cls.COUNTS else bool if key in cls.BOOLS else str) for key in cls.KEYS]
+
+    @classmethod
+    def flatten(cls, item:Mapping) -> dict:
+        """Values of the columns of item (a record or its dict), None if it doesn't have them"""
+        res = {key : item.get(key) for key in cls.KEYS}
+        for key in cls.COUNTS:
+            if res[key] != None:
+                res[key] = to_count(res[key])
+        return res
+
+    def __values(self) -> tuple:
+        return tuple(getattr(self, field, MISSING) for field in self.FIELDS)
+
+
+class tweet_record(record):
+    """Tweet, see twitter_context.find_tweets. Its stats are kept as int fields"""
+    __slots__ = ("tweet_type", "repost_handle", "name", "handle", "date", "text", "ext_link",
+            "has_video", "img_link", "quote_link", "url", "replies", "reposts", "likes", "bookmarks", "views")
+    KEYS = ("tweet_type", "repost_handle", "name", "handle", "date", "text", "ext_link",
+            "has_video", "img_link", "stats", "quote_link", "url")
+    INTERNED = ("tweet_type", "repost_handle", "name", "handle")
+    BOOLS = ("has_video", )
+    STATS = ("replies", "reposts", "likes", "bookmarks", "views")
+
+    @classmethod
+    def columns(cls) -> list[tuple[str, type]]:
+        # A stats_<stat> column per stat
+        columns = []
+        for name, kind in super().columns():
+            if name == "stats":
+                columns += [(f"stats_{stat}", int) for stat in cls.STATS]
+            else:
+                columns.append((name, kind))
+        return columns
+
+    @classmethod
+    def flatten(cls, item:Mapping) -> dict:
+        res = super().flatten(item)
+        stats = res.pop("stats") or {}
+        for stat in cls.STATS:
+            res[f"stats_{stat}"] = stats.get(stat)
+        return res
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {stat : getattr(self, stat) for stat in self.STATS if hasattr(self, stat)}
+
+    @stats.setter
+    def stats(self, stats:dict):
+        for stat in self.STATS:
+            if stat in stats:
+                setattr(self, stat, to_count(stats[stat]))
+            elif hasattr(self, stat):
+                delattr(self, stat)
+
+
+class post_record(record):
+    """bsky post, see bsky_context.find_tweets"""
+    __slots__ = ("context", "name", "handle", "date", "text", "img", "img_alt", "quoting",
+            "has_video", "video_url", "like_count", "repost_count", "comment_count", "url")
+    KEYS = __slots__
+    INTERNED = ("name", "handle")
+    COUNTS = ("like_count", "repost_count", "comment_count")
+    BOOLS = ("has_video", )
+
+
+class user_record(record):
+    """Followed user, of twitter or bsky"""
+    __slots__ = ("handle", "name")
+    KEYS = __slots__
+
+
+class media_ref(str):
+    """
+    Url of an image, or (prefixed with "*") of a post with multiple images
+    that still have to be expanded, see twitter_context.post_process
+    """
+    __slots__ = ()
+
+    @property
+    def multiple(self) -> bool:
+        return self.startswith("*")
+
+    @property
+    def post_url(self) -> str:
+        return self[1:] if self.multiple else ""
+
+
+def to_json(obj):
+    """default of json.dump(s), so records are written as their dicts"""
+    if isinstance(obj, record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
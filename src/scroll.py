@@ -0,0 +1,115 @@
+import time
+import logging
+# thirdparty
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.remote.webdriver import WebDriver
+
+# Installs a MutationObserver counting the elements added to the page,
+# arguments[0] is the xpath of the feed items ("" to not count them)
+WATCH_JS = """
+const w = {xpath: arguments[0], added: 0};
+w.observer = new MutationObserver(records => {
+    for (const r of records)
+        for (const n of r.addedNodes) if (n.nodeType === Node.ELEMENT_NODE) w.added++;
+});
+w.observer.observe(document.body, {childList: true, subtree: true});
+if (window.__wss_watch !== undefined) window.__wss_watch.observer.disconnect();
+window.__wss_watch = w;
+"""
+
+# Feed status since the last call, null if the watcher is gone (page reloaded)
+STATUS_JS = """
+const w = window.__wss_watch;
+if (w === undefined) return null;
+const items = w.xpath === "" ? 0 : document.evaluate("count(" + w.xpath + ")",
+    document, null, XPathResult.NUMBER_TYPE, null).numberValue;
+const added = w.added;
+w.added = 0;
+return {
+    added: added, items: items,
+    spinner: document.querySelector(arguments[0]) !== null,
+    y: window.scrollY, view: window.innerHeight,
+    height: document.documentElement.scrollHeight,
+};
+"""
+
+# Loading indicator of both twitter and bsky
+SPINNER_CSS = "[role='progressbar']"
+
+
+class adaptive_scroller:
+    """
+    Scrolls a feed as fast as it loads, instead of a fixed 5 PAGE_DOWNs.
+    Injected javascript (WATCH_JS) reports the nodes added, feed items and
+    spinners since the last scroll, so:
+      - While the feed grows, more keys are sent per scroll.
+      - While a spinner shows and nothing arrives (loading or throttled),
+        it waits longer between scrolls, up to max_delay.
+      - At the bottom, with no spinner and nothing new for end_after
+        seconds, the feed is over (ended).
+    """
+    def __init__(self, xpath:str="", *, min_keys:int=1, max_keys:int=10,
+            min_delay:float=0.1, max_delay:float=8., end_after:float=2.,
+            give_up_after:float=60., spinner_css:str=SPINNER_CSS):
+        self.xpath = xpath if xpath != None else ""
+        self.min_keys = min_keys
+        self.max_keys = max_keys
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.end_after = end_after
+        self.give_up_after = give_up_after
+        self.spinner_css = spinner_css
+        self.keys = min_keys
+        self.delay = min_delay
+        self.ended = False
+        self.height = 0
+        self.items = 0
+        self.installed = False
+        self.last_change = time.time()
+        self.scrolls = 0
+        self.backoffs = 0
+
+    def scroll(self, browser:WebDriver) -> bool:
+        """Scrolls once, returns True if the page changed since the last scroll"""
+        if not self.installed:
+            self.__install(browser)
+            return True
+        for _ in range(self.keys):
+            ActionChains(browser).send_keys(Keys.PAGE_DOWN).perform()
+        self.scrolls += 1
+        time.sleep(self.delay)
+        status = browser.execute_script(STATUS_JS, self.spinner_css)
+        if status == None:
+            logging.info("Feed watcher lost, reinstalling it")
+            self.__install(browser)
+            return True
+
+        changed = (status["added"] > 0) or (status["height"] != self.height) or (status["items"] != self.items)
+        self.height, self.items = status["height"], status["items"]
+        at_bottom = status["y"] + status["view"] >= status["height"] - 2
+        now = time.time()
+        if changed:
+            # Feed is growing, go faster
+            self.last_change = now
+            self.delay = self.min_delay
+            self.keys = min(self.max_keys, self.keys + 1)
+        elif status["spinner"]:
+            # Loading (or throttled), wait for it
+            self.backoffs += 1
+            self.delay = min(self.max_delay, self.delay * 2)
+            self.keys = self.min_keys
+            if now - self.last_change > self.give_up_after:
+                logging.warning(f"Feed stuck loading for {self.give_up_after:.0f}s, giving up")
+                self.ended = True
+        elif at_bottom:
+            self.ended = now - self.last_change > self.end_after
+        else:
+            # Nothing new yet, but still feed left to scroll through
+            self.keys = min(self.max_keys, self.keys + 1)
+        return changed
+
+    def __install(self, browser:WebDriver):
+        browser.execute_script(WATCH_JS, self.xpath)
+        self.installed = True
+        self.last_change = time.time()
@@ -0,0 +1,54 @@
+import os
+import json
+import logging
+
+
+class scrape_state:
+    """
+    Keys (see socialmedia_context.item_key) of the newest items already
+    collected for a (site, user, info_type), stored in
+    state_dir/<site>_<user>_<info_type>.json, newest first.
+    continuously_scroll stops once it finds stop_after known items in a row.
+    """
+    def __init__(self, site:str, user:str, info_type, *, state_dir:str="./state",
+            max_keys:int=2000, stop_after:int=10):
+        self.path = os.path.join(state_dir, f"{site}_{user}_{info_type.name.lower()}.json")
+        self.max_keys = max_keys
+        self.stop_after = stop_after
+        self.keys = []
+        self.new_keys = []
+        # Known items found in a row, see collect_items
+        self.known_run = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                self.keys = json.load(file)["keys"]
+        self.known = set(self.keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self.known
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key):
+        """Records a newly collected item, in feed order"""
+        if key in self.known:
+            return
+        self.known.add(key)
+        self.new_keys.append(key)
+
+    def clear(self):
+        """Forget everything, e.g. when the stored dataset is gone"""
+        self.keys, self.new_keys = [], []
+        self.known = set()
+
+    def save(self):
+        self.keys = (self.new_keys + self.keys)[:self.max_keys]
+        self.known = set(self.keys)
+        logging.info(f"{len(self.new_keys)} new items since last run")
+        self.new_keys = []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"keys" : self.keys}, file)
+        os.replace(tmp_path, self.path)
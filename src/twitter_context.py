@@ -1,14 +1,33 @@
 import logging
-import time
+import html
+import datetime
+import functools
 import dataclasses
 # thirdparty
 from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException, WebDriverException
 from bs4 import BeautifulSoup
+from lxml import etree
 # local imports
-from src.common import Info_type, continuously_scroll, socialmedia_context
+from src.common import Info_type, continuously_scroll, feed_items, socialmedia_context
+from src.fast_parse import compile_rules, parse_html, first, bs_contents, bs_string, tag_names, parse_memo
+from src.js_extract import js_extractor
+from src.capture import response_capture
+from src.records import tweet_record, user_record, media_ref
+from src.cache import get_cache
+from src.metrics import get_metrics
+from src.ratelimit import get_limiter
 
 logger = logging.getLogger(__name__)
 
+# Feed items for delta parsing, see feed_items
+TWEET_XPATH = "//article[@data-testid='tweet']"
+USER_XPATH = "//button[@data-testid='UserCell']"
+# Photos of the tweets in a status page, see twitter_context.expand_posts
+PHOTO_CSS = "article[data-testid='tweet'] div[data-testid='tweetPhoto'] img"
+
 def get_text_with_emojis(tag) -> str:
     text = ""
     for el in tag.children:
@@ -45,96 +64,104 @@ def get_stats(stats:str) -> dict[str, int]:
     return res
 
 
-def find_tweets(page_source:str) -> list[dict]:
+def find_tweets(page_source:str, memo:parse_memo=None) -> list[tweet_record]:
+    """Tweets of page_source, reusing the ones of the articles already in memo if given"""
     soup = BeautifulSoup(page_source, features="lxml")
     posts = soup.find_all("article", {"data-testid" : "tweet"})
-    posts = posts[:3]
     tweets = []
     for post in posts:
-        ctweet = {}
-        # Check if quote_tweet
-        tag = post.find_all("div", {"data-testid" : "Tweet-User-Avatar"})
-        if len(tag) > 1:
-            ctweet["tweet_type"] = "quote"
-        tag = post.find("span", {"data-testid" : "socialContext"})
-        if tag != None:
-            ctweet["tweet_type"] = "repost"
-            tag = tag.find_parent()
-            if tag != None:
-                ctweet["repost_handle"] = tag.get("href")
-            else:
-                ctweet["repost_handle"] = ""
-        tag = post.find("div").find("div").find("div").find("div").find("div").find("div")
+        # Timelines are virtualized, most articles were already parsed in previous snapshots
+        ctweet = memo.get(str(post), parse_tweet, post) if memo != None else parse_tweet(post)
+        if ctweet != None:
+            tweets.append(ctweet)
+    return tweets
+
+
+def parse_tweet(post) -> tweet_record:
+    """Tweet of an article, None for ads"""
+    ctweet = tweet_record()
+    # Check if quote_tweet
+    tag = post.find_all("div", {"data-testid" : "Tweet-User-Avatar"})
+    if len(tag) > 1:
+        ctweet["tweet_type"] = "quote"
+    tag = post.find("span", {"data-testid" : "socialContext"})
+    if tag != None:
+        ctweet["tweet_type"] = "repost"
+        tag = tag.find_parent()
         if tag != None:
-            ctweet["tweet_type"] = "reply"
-        if ctweet.get("tweet_type") == None:
-            ctweet["tweet_type"] = "tweet"
-
-        # Creator and time header (doesn't exist for ads)
-        a_tags_header = post.find("div", {"data-testid" : "User-Name"}).find_all("a", {"role" : "link"})
-        if len(a_tags_header) == 3:
-            try:
-                ctweet["name"] = get_text_with_emojis( a_tags_header[0].span )
-                ctweet["handle"] = a_tags_header[1].span.string[1:]
-                ctweet["date"] = a_tags_header[2].time.get("datetime")
-            except Exception as e:
-                ctweet["name"] = ""
-                ctweet["handle"] = ""
-                ctweet["date"] = ""
-                logger.error(f"Can't parse {a_tags_header}\n\t> {e}")
+            ctweet["repost_handle"] = tag.get("href")
         else:
-            # Ignore adds by default
-            ctweet["tweet_type"] = "ad"
-            continue
+            ctweet["repost_handle"] = ""
+    tag = post.find("div").find("div").find("div").find("div").find("div").find("div")
+    if tag != None:
+        ctweet["tweet_type"] = "reply"
+    if ctweet.get("tweet_type") == None:
+        ctweet["tweet_type"] = "tweet"
 
-        tag = post.find("div", {"data-testid" : "tweetText"})
-        if tag != None: ctweet["text"] = get_text_with_emojis(tag)
-        else: ctweet["text"] = ""
+    # Creator and time header (doesn't exist for ads)
+    a_tags_header = post.find("div", {"data-testid" : "User-Name"}).find_all("a", {"role" : "link"})
+    if len(a_tags_header) == 3:
+        try:
+            ctweet["name"] = get_text_with_emojis( a_tags_header[0].span )
+            ctweet["handle"] = a_tags_header[1].span.string[1:]
+            ctweet["date"] = a_tags_header[2].time.get("datetime")
+        except Exception as e:
+            ctweet["name"] = ""
+            ctweet["handle"] = ""
+            ctweet["date"] = ""
+            logger.error(f"Can't parse {a_tags_header}\n\t> {e}")
+    else:
+        # Ignore adds by default
+        ctweet["tweet_type"] = "ad"
+        return None
 
-        tag = post.find("div", {"data-testid" : "card.wrapper"})
-        if tag != None: ctweet["ext_link"] = tag.find("a").get("href")
-        else: ctweet["ext_link"] = ""
+    tag = post.find("div", {"data-testid" : "tweetText"})
+    if tag != None: ctweet["text"] = get_text_with_emojis(tag)
+    else: ctweet["text"] = ""
 
-        tag = post.find("div", {"data-testid" : "videoComponent"})
-        if tag != None: ctweet["has_video"] = True
-        else: ctweet["has_video"] = False
+    tag = post.find("div", {"data-testid" : "card.wrapper"})
+    if tag != None: ctweet["ext_link"] = tag.find("a").get("href")
+    else: ctweet["ext_link"] = ""
 
-        tag = post.find("div", {"data-testid" : "tweetPhoto"})
-        if tag != None:
-            if tag.img != None:
-                ctweet["img_link"] = tag.img.get("src")
-            else:
-                ctweet["img_link"] = ""
+    tag = post.find("div", {"data-testid" : "videoComponent"})
+    if tag != None: ctweet["has_video"] = True
+    else: ctweet["has_video"] = False
+
+    tag = post.find("div", {"data-testid" : "tweetPhoto"})
+    if tag != None:
+        if tag.img != None:
+            ctweet["img_link"] = tag.img.get("src")
         else:
             ctweet["img_link"] = ""
+    else:
+        ctweet["img_link"] = ""
 
-        tag = post.find("div", {"class": "css-175oi2r", "role": "group"})
-        if tag != None: ctweet["stats"] = get_stats(tag.get("aria-label"))
-        else: ctweet["stats"] = {}
+    tag = post.find("div", {"class": "css-175oi2r", "role": "group"})
+    if tag != None: ctweet["stats"] = get_stats(tag.get("aria-label"))
+    else: ctweet["stats"] = {}
 
-        links = []
-        ctweet["quote_link"] = ""
-        for el in post.find_all("a", {"role" : "link"}):
-            temp_2 = el.get("href")
-            if temp_2 == None:
-                continue
-            index = temp_2.find("/status")
-            if index == -1:
-                continue
-            link = temp_2[1:]
-            if link.find(ctweet["handle"]) == -1:
-                ctweet["quote_link"] += link
-            links.append(link)
-        ctweet["url"] = "https://x.com/" + links[0]
-        if ctweet["tweet_type"] == "quote":
-            ctweet["quote_link"] += links[1] 
-            ctweet["quote_link"] = "https://x.com/" + ctweet["quote_link"]
-
-        tweets.append(ctweet)
-    return tweets
+    links = []
+    ctweet["quote_link"] = ""
+    for el in post.find_all("a", {"role" : "link"}):
+        temp_2 = el.get("href")
+        if temp_2 == None:
+            continue
+        index = temp_2.find("/status")
+        if index == -1:
+            continue
+        link = temp_2[1:]
+        if link.find(ctweet["handle"]) == -1:
+            ctweet["quote_link"] += link
+        links.append(link)
+    ctweet["url"] = "https://x.com/" + links[0]
+    if ctweet["tweet_type"] == "quote":
+        ctweet["quote_link"] += links[1] 
+        ctweet["quote_link"] = "https://x.com/" + ctweet["quote_link"]
+
+    return ctweet
 
 
-def find_following_users(page_source:str) -> list[dict]:
+def find_following_users(page_source:str) -> list[user_record]:
     soup = BeautifulSoup(page_source, features="lxml")
     posts = soup.find_all("button", {"data-testid" : "UserCell"})
     users = []
@@ -143,7 +170,7 @@ def find_following_users(page_source:str) -> list[dict]:
         header = post.find_all("a", {"role" : "link"})
         handle = header[2].span.string[1:]
         name = get_text_with_emojis(header[1].span) 
-        user = {}
+        user = user_record()
         user["handle"] = handle
         user["name"] = name
         users.append(user)
@@ -167,12 +194,11 @@ def find_images_post(page_source:str, author_filter:str) -> list[str]:
         # Fill data
         posible_owners = [str(o.get("href")[1:]) for o in a_tags]
         owner = posible_owners[0] if len(posible_owners) <= 2 else posible_owners[1]
-        images_tags = soup.find_all("img")
-        for img in images_tags:
+        for img in img_tags:
             src = str(img.get("src"))
             if (src.find("twimg") != -1) and (src.find("media") != -1):
                 if owner == author_filter:
-                    images.append(f"{src}")
+                    images.append(media_ref(src))
     return images
 
 
@@ -191,61 +217,661 @@ def find_images_media(page_source:str) -> list[str]:
         if len(a_tag.find_all("svg")) > 0:
             link = a_tag.get("href")
             link = "https://x.com" + link[:link.find("/photo")]
-            images.append( f"*{link}" )
+            images.append(media_ref(f"*{link}"))
             continue
         # single image case
         src = a_tag.find("img").get("src")
         if (src.find("twimg") != -1) and (src.find("media") != -1):
-            images.append(f"{src}")
+            images.append(media_ref(src))
     # remove tab
     return images
 
 
+def tweet_key(tweet:dict) -> str:
+    return tweet["url"]
+
+
+def user_key(user:dict) -> str:
+    return user["handle"]
+
+
+def media_key(url:str) -> str:
+    # Same media can show up with different sizes (&name=small...)
+    index = url.find("&name=")
+    return url if index == -1 else url[:index]
+
+
+#################################################
+# lxml backend, same output as the functions above
+#################################################
+RULES = compile_rules({
+    "tweets" : TWEET_XPATH,
+    "users" : USER_XPATH,
+    "avatars" : ".//div[@data-testid='Tweet-User-Avatar']",
+    "social_context" : ".//span[@data-testid='socialContext']",
+    "user_name" : ".//div[@data-testid='User-Name']",
+    "links" : ".//a[@role='link']",
+    "text" : ".//div[@data-testid='tweetText']",
+    "card" : ".//div[@data-testid='card.wrapper']",
+    "video" : ".//div[@data-testid='videoComponent']",
+    "photo" : ".//div[@data-testid='tweetPhoto']",
+    "stats" : ".//div[contains(concat(' ', normalize-space(@class), ' '), ' css-175oi2r ') and @role='group']",
+    "imgs" : ".//img",
+})
+
+
+def get_text_with_emojis_lxml(tag) -> str:
+    text = ""
+    for el in bs_contents(tag):
+        if isinstance(el, str) or (not isinstance(el.tag, str)):
+            continue
+        names = tag_names(el)
+        if "img" in names: # emojis
+            icon = el.get("alt")
+            if icon != None:
+                text += icon
+        elif "div" in names: # handles
+            text += bs_string(el.find(".//span").find(".//a"))
+        elif any(name.startswith("a") for name in names): # external link and hashtags
+            if el.tag == "a":
+                text += el.get("href")
+            elif el.tag == "span": # hashtag
+                text += bs_string(el.find(".//a"))
+        elif "span" in names: # plaintext
+            tempstr = bs_string(el)
+            if tempstr == None:
+                continue
+            tempstr = tempstr.replace("\n", "\\n")
+            tempstr = tempstr.replace('"', "''")
+            text += tempstr.replace("\t","\\t")
+    return text
+
+
+def find_tweets_lxml(page_source:str, memo:parse_memo=None) -> list[tweet_record]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    tweets = []
+    for post in RULES["tweets"](root):
+        # Timelines are virtualized, most articles were already parsed in previous snapshots
+        ctweet = memo.get(etree.tostring(post), parse_tweet_lxml, post) if memo != None else parse_tweet_lxml(post)
+        if ctweet != None:
+            tweets.append(ctweet)
+    return tweets
+
+
+def parse_tweet_lxml(post) -> tweet_record:
+    """Tweet of an article, None for ads"""
+    ctweet = tweet_record()
+    # Check if quote_tweet
+    if len(RULES["avatars"](post)) > 1:
+        ctweet["tweet_type"] = "quote"
+    tag = first(RULES["social_context"], post)
+    if tag != None:
+        ctweet["tweet_type"] = "repost"
+        tag = tag.getparent()
+        if tag != None:
+            ctweet["repost_handle"] = tag.get("href")
+        else:
+            ctweet["repost_handle"] = ""
+    tag = post.find(".//div").find(".//div").find(".//div").find(".//div").find(".//div").find(".//div")
+    if tag != None:
+        ctweet["tweet_type"] = "reply"
+    if ctweet.get("tweet_type") == None:
+        ctweet["tweet_type"] = "tweet"
+
+    # Creator and time header (doesn't exist for ads)
+    a_tags_header = RULES["links"](first(RULES["user_name"], post))
+    if len(a_tags_header) == 3:
+        try:
+            ctweet["name"] = get_text_with_emojis_lxml( a_tags_header[0].find(".//span") )
+            ctweet["handle"] = bs_string(a_tags_header[1].find(".//span"))[1:]
+            ctweet["date"] = a_tags_header[2].find(".//time").get("datetime")
+        except Exception as e:
+            ctweet["name"] = ""
+            ctweet["handle"] = ""
+            ctweet["date"] = ""
+            logger.error(f"Can't parse {a_tags_header}\n\t> {e}")
+    else:
+        # Ignore adds by default
+        return None
+
+    tag = first(RULES["text"], post)
+    if tag != None: ctweet["text"] = get_text_with_emojis_lxml(tag)
+    else: ctweet["text"] = ""
+
+    tag = first(RULES["card"], post)
+    if tag != None: ctweet["ext_link"] = tag.find(".//a").get("href")
+    else: ctweet["ext_link"] = ""
+
+    ctweet["has_video"] = first(RULES["video"], post) != None
+
+    tag = first(RULES["photo"], post)
+    if (tag != None) and (tag.find(".//img") != None):
+        ctweet["img_link"] = tag.find(".//img").get("src")
+    else:
+        ctweet["img_link"] = ""
+
+    tag = first(RULES["stats"], post)
+    if tag != None: ctweet["stats"] = get_stats(tag.get("aria-label"))
+    else: ctweet["stats"] = {}
+
+    links = []
+    ctweet["quote_link"] = ""
+    for el in RULES["links"](post):
+        temp_2 = el.get("href")
+        if temp_2 == None:
+            continue
+        index = temp_2.find("/status")
+        if index == -1:
+            continue
+        link = temp_2[1:]
+        if link.find(ctweet["handle"]) == -1:
+            ctweet["quote_link"] += link
+        links.append(link)
+    ctweet["url"] = "https://x.com/" + links[0]
+    if ctweet["tweet_type"] == "quote":
+        ctweet["quote_link"] += links[1] 
+        ctweet["quote_link"] = "https://x.com/" + ctweet["quote_link"]
+
+    return ctweet
+
+
+def find_following_users_lxml(page_source:str) -> list[user_record]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    users = []
+    for post in RULES["users"](root):
+        # Assume all have the same format
+        header = RULES["links"](post)
+        user = user_record()
+        user["handle"] = bs_string(header[2].find(".//span"))[1:]
+        user["name"] = get_text_with_emojis_lxml(header[1].find(".//span"))
+        users.append(user)
+    return users
+
+
+def find_images_post_lxml(page_source:str, author_filter:str) -> list[str]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    images = []
+    for post in RULES["tweets"](root):
+        # Ignore posts with no images
+        img_tags = RULES["imgs"](post)
+        if len(img_tags) <= 1:
+            continue
+        # Ignore reposts
+        a_tags = RULES["links"](post)
+        if a_tags[0].find(".//span") != None:
+            continue
+        # Fill data
+        posible_owners = [str(o.get("href")[1:]) for o in a_tags]
+        owner = posible_owners[0] if len(posible_owners) <= 2 else posible_owners[1]
+        if owner != author_filter:
+            continue
+        for img in img_tags:
+            src = str(img.get("src"))
+            if (src.find("twimg") != -1) and (src.find("media") != -1):
+                images.append(media_ref(src))
+    return images
+
+
+def find_images_media_lxml(page_source:str) -> list[str]:
+    root = parse_html(page_source)
+    if root == None:
+        return []
+    images = []
+    for a_tag in RULES["links"](root):
+        # random edge case
+        if a_tag.find(".//span") != None:
+            continue
+        # ignore tags without images
+        img = a_tag.find(".//img")
+        if img == None:
+            continue
+        # multiple images case
+        if a_tag.find(".//svg") != None:
+            link = a_tag.get("href")
+            link = "https://x.com" + link[:link.find("/photo")]
+            images.append(media_ref(f"*{link}"))
+            continue
+        # single image case
+        src = img.get("src")
+        if (src.find("twimg") != -1) and (src.find("media") != -1):
+            images.append(media_ref(src))
+    return images
+
+
+#################################################
+# In browser extraction (see js_extract), same output as
+# find_tweets/find_following_users
+#################################################
+TEXT_JS = """
+function textWithEmojis(tag) {
+    let text = "";
+    for (const el of tag.children) {
+        const names = tagNames(el);
+        if (names.has("img")) { // emojis
+            const icon = el.getAttribute("alt");
+            if (icon !== null) text += icon;
+        } else if (names.has("div")) { // handles
+            text += must(bsString(el.querySelector("span").querySelector("a")));
+        } else if ([...names].some(name => name.startsWith("a"))) { // external link and hashtags
+            if (el.localName === "a") text += must(el.getAttribute("href"));
+            else if (el.localName === "span") text += must(bsString(el.querySelector("a"))); // hashtag
+        } else if (names.has("span")) { // plaintext
+            const str = bsString(el);
+            if (str === null) continue;
+            text += str.replaceAll("\\n", "\\\\n").replaceAll('"', "''").replaceAll("\\t", "\\\\t");
+        }
+    }
+    return text;
+}
+"""
+
+TWEETS_JS = TEXT_JS + """
+function getStats(stats) {
+    const res = {};
+    const types = ["replies", "reposts", "likes", "bookmarks", "views"];
+    for (const item of stats.split(", ")) {
+        for (const t of types) {
+            if (item.endsWith(t)) {
+                res[t] = pyInt(item.slice(0, -t.length));
+                break;
+            }
+        }
+    }
+    return res;
+}
+
+const tweets = [];
+for (const post of document.querySelectorAll("article[data-testid='tweet']")) {
+    if (wssIsSeen(post)) continue;
+    const ctweet = {};
+    // Check if quote_tweet
+    if (post.querySelectorAll("div[data-testid='Tweet-User-Avatar']").length > 1) ctweet.tweet_type = "quote";
+    let tag = post.querySelector("span[data-testid='socialContext']");
+    if (tag !== null) {
+        ctweet.tweet_type = "repost";
+        tag = tag.parentElement;
+        ctweet.repost_handle = tag !== null ? tag.getAttribute("href") : "";
+    }
+    tag = post;
+    for (let i = 0; i < 5; i++) tag = tag.querySelector("div");
+    if (tag.querySelector("div") !== null) ctweet.tweet_type = "reply";
+    if (ctweet.tweet_type === undefined) ctweet.tweet_type = "tweet";
+
+    // Creator and time header (doesn't exist for ads)
+    const header = post.querySelector("div[data-testid='User-Name']").querySelectorAll("a[role='link']");
+    if (header.length !== 3) continue;
+    try {
+        ctweet.name = textWithEmojis(header[0].querySelector("span"));
+        ctweet.handle = bsString(header[1].querySelector("span")).slice(1);
+        ctweet.date = header[2].querySelector("time").getAttribute("datetime");
+    } catch (e) {
+        ctweet.name = "";
+        ctweet.handle = "";
+        ctweet.date = "";
+    }
+
+    tag = post.querySelector("div[data-testid='tweetText']");
+    ctweet.text = tag !== null ? textWithEmojis(tag) : "";
+    tag = post.querySelector("div[data-testid='card.wrapper']");
+    ctweet.ext_link = tag !== null ? tag.querySelector("a").getAttribute("href") : "";
+    ctweet.has_video = post.querySelector("div[data-testid='videoComponent']") !== null;
+    tag = post.querySelector("div[data-testid='tweetPhoto']");
+    tag = tag !== null ? tag.querySelector("img") : null;
+    ctweet.img_link = tag !== null ? tag.getAttribute("src") : "";
+    tag = post.querySelector("div.css-175oi2r[role='group']");
+    ctweet.stats = tag !== null ? getStats(tag.getAttribute("aria-label")) : {};
+
+    const links = [];
+    ctweet.quote_link = "";
+    for (const el of post.querySelectorAll("a[role='link']")) {
+        const href = el.getAttribute("href");
+        if (href === null || href.indexOf("/status") === -1) continue;
+        const link = href.slice(1);
+        if (link.indexOf(ctweet.handle) === -1) ctweet.quote_link += link;
+        links.push(link);
+    }
+    ctweet.url = "https://x.com/" + must(links[0]);
+    if (ctweet.tweet_type === "quote") {
+        ctweet.quote_link += must(links[1]);
+        ctweet.quote_link = "https://x.com/" + ctweet.quote_link;
+    }
+    tweets.push(ctweet);
+}
+return wssDone(tweets);
+"""
+
+USERS_JS = TEXT_JS + """
+const users = [];
+for (const post of document.querySelectorAll("button[data-testid='UserCell']")) {
+    if (wssIsSeen(post)) continue;
+    // Assume all have the same format
+    const header = post.querySelectorAll("a[role='link']");
+    users.push({
+        handle: bsString(header[2].querySelector("span")).slice(1),
+        name: textWithEmojis(header[1].querySelector("span")),
+    });
+}
+return wssDone(users);
+"""
+
+
+#################################################
+# Api responses (see capture), same records as
+# find_tweets/find_following_users but with exact counts
+#################################################
+# GraphQL operations with timelines of tweets or users
+API_PATTERN = r"/i/api/graphql/[^/]+/(UserTweets|UserTweetsAndReplies|UserMedia|HomeTimeline|HomeLatestTimeline|Bookmarks|Following|Followers)\b"
+
+
+def timeline_contents(data) -> list[dict]:
+    """itemContent of every timeline entry in data, in order"""
+    contents = []
+    if isinstance(data, dict):
+        if "itemContent" in data:
+            return [data["itemContent"]]
+        for value in data.values():
+            contents += timeline_contents(value)
+    elif isinstance(data, list):
+        for value in data:
+            contents += timeline_contents(value)
+    return contents
+
+
+def api_result(result:dict) -> dict:
+    """Unwraps TweetWithVisibilityResults and the like"""
+    if result.get("__typename") == "TweetWithVisibilityResults":
+        return result["tweet"]
+    return result
+
+
+def api_user(result:dict) -> tuple[str, str]:
+    """(name, handle) of a user result, wherever the api put them"""
+    core = result.get("core", {})
+    legacy = result.get("legacy", {})
+    return core.get("name", legacy.get("name")), core.get("screen_name", legacy.get("screen_name"))
+
+
+def api_date(created_at:str) -> str:
+    """Wed Oct 10 20:19:24 +0000 2018 -> 2018-10-10T20:19:24.000Z, as the page shows it"""
+    date = datetime.datetime.strptime(created_at, "%a %b %d %H:%M:%S %z %Y")
+    return date.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def api_text(tweet:dict) -> str:
+    """Text the page shows, escaped like get_text_with_emojis"""
+    note = tweet.get("note_tweet", {}).get("note_tweet_results", {}).get("result")
+    if note != None:
+        text = note["text"]
+    else:
+        legacy = tweet["legacy"]
+        # Without the trailing media link, indices are in code points of the unescaped text
+        text = html.unescape(legacy["full_text"])
+        start, end = legacy.get("display_text_range", (0, len(text)))
+        text = text[start:end]
+    return text.replace("\n", "\\n").replace('"', "''").replace("\t", "\\t")
+
+
+def api_status_url(tweet:dict) -> str:
+    return f"https://x.com/{api_user(tweet['core']['user_results']['result'])[1]}/status/{tweet['rest_id']}"
+
+
+def tweet_from_api(result:dict) -> tweet_record:
+    """Record of a tweet result, None for ads and deleted tweets"""
+    result = api_result(result)
+    if result.get("__typename") != "Tweet":
+        return None
+    ctweet = tweet_record()
+    tweet = result
+    retweet = result["legacy"].get("retweeted_status_result")
+    if retweet != None:
+        ctweet["tweet_type"] = "repost"
+        ctweet["repost_handle"] = "/" + api_user(result["core"]["user_results"]["result"])[1]
+        tweet = api_result(retweet["result"])
+    legacy = tweet["legacy"]
+    quote = tweet.get("quoted_status_result", {}).get("result")
+    if (retweet == None) and (quote != None):
+        ctweet["tweet_type"] = "quote"
+    if legacy.get("in_reply_to_status_id_str") != None:
+        ctweet["tweet_type"] = "reply"
+    if ctweet.get("tweet_type") == None:
+        ctweet["tweet_type"] = "tweet"
+
+    ctweet["name"], ctweet["handle"] = api_user(tweet["core"]["user_results"]["result"])
+    ctweet["date"] = api_date(legacy["created_at"])
+    ctweet["text"] = api_text(tweet)
+    card = tweet.get("card")
+    ctweet["ext_link"] = card["legacy"]["url"] if card != None else ""
+    media = legacy.get("extended_entities", {}).get("media", [])
+    ctweet["has_video"] = any(m["type"] in ("video", "animated_gif") for m in media)
+    ctweet["img_link"] = ""
+    for m in media:
+        if m["type"] == "photo":
+            # https://pbs.twimg.com/media/ID.jpg -> https://pbs.twimg.com/media/ID?format=jpg&name=small
+            base, _, ext = m["media_url_https"].rpartition(".")
+            ctweet["img_link"] = f"{base}?format={ext}&name=small"
+            break
+    stats = {
+        "replies" : legacy["reply_count"], "reposts" : legacy["retweet_count"],
+        "likes" : legacy["favorite_count"], "bookmarks" : legacy.get("bookmark_count", 0),
+    }
+    if "count" in tweet.get("views", {}):
+        stats["views"] = int(tweet["views"]["count"])
+    ctweet["stats"] = stats
+    ctweet["quote_link"] = ""
+    if (ctweet["tweet_type"] == "quote") and (api_result(quote).get("__typename") == "Tweet"):
+        ctweet["quote_link"] = api_status_url(api_result(quote))
+    ctweet["url"] = api_status_url(tweet)
+    return ctweet
+
+
+def map_api_response(url:str, data:dict) -> list:
+    """Tweets or users in a timeline response"""
+    items = []
+    for content in timeline_contents(data):
+        if "promotedMetadata" in content:
+            # Ignore adds by default
+            continue
+        if content.get("itemType") == "TimelineTweet":
+            tweet = tweet_from_api(content["tweet_results"].get("result", {}))
+            if tweet != None:
+                items.append(tweet)
+        elif content.get("itemType") == "TimelineUser":
+            result = content["user_results"].get("result", {})
+            if result.get("__typename") != "User":
+                continue
+            name, handle = api_user(result)
+            items.append(user_record(handle=handle, name=name))
+    return items
+
+
+# find functions of each parser backend
+PARSERS = {
+    "bs4" : {
+        "tweets" : find_tweets,
+        "users" : find_following_users,
+        "images_post" : find_images_post,
+        "images_media" : find_images_media,
+    },
+    "lxml" : {
+        "tweets" : find_tweets_lxml,
+        "users" : find_following_users_lxml,
+        "images_post" : find_images_post_lxml,
+        "images_media" : find_images_media_lxml,
+    },
+}
+
+
+@dataclasses.dataclass
 class twitter_context(socialmedia_context):
+    # Multiple image posts loaded at once (in tabs) in post_process
+    expand_tabs:int = 4
+    # Max time waiting for the photos of a post to show up
+    expand_timeout:float = 10.
+
+    def item_key(self, item):
+        if self.info_type == Info_type.IMAGES:
+            return media_key(item)
+        if self.info_type == Info_type.FOLLOWERS:
+            return user_key(item)
+        return tweet_key(item)
+
+    def record_type(self):
+        if self.info_type == Info_type.IMAGES:
+            return None
+        if self.info_type == Info_type.FOLLOWERS:
+            return user_record
+        return tweet_record
+
+    def new_capture(self):
+        if self.info_type == Info_type.IMAGES:
+            return None
+        return response_capture(API_PATTERN, map_api_response)
+
     def pre_process(self, browser:WebDriver) -> bool:
         return self.retry(browser, "Try reloading")
 
     def process(self, browser:WebDriver) -> bool:
         # Select correct function
+        funcs = PARSERS[self.parser]
         args = ()
+        xpath = None
+        script = None
+        record = tweet_record
         if self.info_type == Info_type.IMAGES:
+            index = self.new_index()
             if self.use_media:
-                f = find_images_media
+                # media grid has no feed items, parse it whole
+                f = funcs["images_media"]
             else:
-                f = find_images_post
+                f = funcs["images_post"]
                 args = (self.user, )
+                xpath = TWEET_XPATH
         elif self.info_type == Info_type.TWEETS:
-            f = find_tweets
+            f = funcs["tweets"]
+            xpath = TWEET_XPATH
+            script = TWEETS_JS
+            index = self.new_index(update_seen=True)
         elif self.info_type == Info_type.BOOKMARKS:
             # It is fundamentally the same if getting from home page, than with bookmarks page
-            f = find_tweets
+            f = funcs["tweets"]
+            xpath = TWEET_XPATH
+            script = TWEETS_JS
+            index = self.new_index(update_seen=True)
         elif self.info_type == Info_type.FOLLOWERS:
-            f = find_following_users
+            f = funcs["users"]
+            xpath = USER_XPATH
+            script = USERS_JS
+            record = user_record
+            index = self.new_index()
         else:
             logging.error(f"{self.info_type} has no implemented find_func")
             return False
-        self.data, _ = continuously_scroll(browser, self.timeout, f, *args)
+        # The timeline is virtualized, parse_pipeline workers only get its new items (see feed_items)
+        delta = feed_items(xpath) if ((self.delta_parse or self.parse_workers > 0) and xpath != None) else None
+        workers = self.parse_workers if delta != None else 0
+        if workers != self.parse_workers:
+            logging.warning("The media grid has no feed items to split, parsing it in this process")
+        extract = js_extractor(self.info_type.name, script, *args, record=record) if (self.in_browser and script != None) else None
+        if self.responses != None:
+            extract = self.responses
+        # Only this context's tweets, so concurrent jobs don't share it
+        memo = parse_memo()
+        if (f == funcs["tweets"]) and (workers == 0):
+            f = functools.partial(f, memo=memo)
+        self.data, _ = continuously_scroll(browser, self.timeout, f, *args,
+                delta=delta, index=index, sink=self.sink, state=self.state, workers=workers,
+                scroller=self.new_scroller(xpath), extract=extract)
+        if memo.hits + memo.misses > 0:
+            logging.info(f"Parsed {memo.misses} articles, reused {memo.hits} ({memo.hit_rate():.0%} hit rate)")
+            get_metrics().count("memo_hits", memo.hits)
+            get_metrics().count("memo_misses", memo.misses)
         return True
 
     def post_process(self, browser:WebDriver) -> bool:
         if self.info_type != Info_type.IMAGES:
             return True
         # Check if having more images to get
+        posts = [media_ref(url).post_url for url in self.data if media_ref(url).multiple]
+        with get_metrics().timer("expand"):
+            expanded = self.expand_posts(browser, posts)
         new_images = []
-        count = 0
         for url in self.data:
-            print(f"[INFO] Multiple files: {count}\r", end="")
             if url[0] == "*": # Multiple image case
-                browser.get(url[1:])
-                time.sleep(2.)
-                imgs = find_images_post(browser.page_source, self.user)
-                for img in imgs:
+                for img in expanded.get(url[1:], []):
                     new_images.append(self.__parse_img_url(img))
-                count += 1
             else:
                 new_images.append(self.__parse_img_url(url))
         self.data = new_images
         return True
+
+    def expand_posts(self, browser:WebDriver, posts:list[str]) -> dict[str, list[str]]:
+        """
+        Images of each multiple image post, loading expand_tabs posts at once
+        in new tabs and parsing each one as soon as its photos show up.
+        Expanded posts are cached (as "expand"), their images don't change.
+        """
+        cache = get_cache("./cache/")
+        expanded, todo = {}, []
+        for post in posts:
+            imgs = cache.get(post, "expand")
+            if imgs != None:
+                expanded[post] = imgs
+            else:
+                todo.append(post)
+        if len(expanded) > 0:
+            logging.info(f"Using cached images of {len(expanded)} posts")
+        get_metrics().count("expand_cached", len(expanded))
+        find_func = PARSERS[self.parser]["images_post"]
+        limiter = get_limiter()
+        main = browser.current_window_handle
+        try:
+            for start in range(0, len(todo), self.expand_tabs):
+                # Start loading all of them, then collect them in order
+                tabs = []
+                for post in todo[start:start + self.expand_tabs]:
+                    limiter.wait(post)
+                    browser.switch_to.new_window("tab")
+                    browser.execute_script("window.location.href = arguments[0]", post)
+                    tabs.append((post, browser.current_window_handle))
+                for post, handle in tabs:
+                    browser.switch_to.window(handle)
+                    if not self.__wait_photos(browser, post):
+                        limiter.feedback(post, panic=browser.page_source.find("Try reloading") != -1)
+                    imgs = find_func(browser.page_source, self.user)
+                    browser.close()
+                    # New windows are opened from the current one, which can't be a closed tab
+                    browser.switch_to.window(main)
+                    expanded[post] = imgs
+                    if len(imgs) > 0:
+                        cache.put(post, "expand", imgs)
+                    print(f"[INFO] Multiple files: {len(expanded)}/{len(posts)}\r", end="")
+        except WebDriverException as e:
+            logging.error(f"Couldn't expand multiple image posts: {e.msg}")
+        finally:
+            for handle in browser.window_handles:
+                if handle != main:
+                    browser.switch_to.window(handle)
+                    browser.close()
+            browser.switch_to.window(main)
+        print("")
+        return expanded
+
+    def __wait_photos(self, browser:WebDriver, post:str) -> bool:
+        """Waits until the page has multiple photos, False if they didn't show up in expand_timeout"""
+        wait = WebDriverWait(browser, self.expand_timeout, poll_frequency=0.1,
+                ignored_exceptions=(StaleElementReferenceException, ))
+        try:
+            wait.until(lambda b: len(b.find_elements(By.CSS_SELECTOR, PHOTO_CSS)) > 1)
+            return True
+        except TimeoutException:
+            logging.warning(f"Photos of {post} didn't show up in {self.expand_timeout}s")
+            return False
     
     def __parse_img_url(self, url:str) -> str:
         if self.high_quality:
@@ -255,10 +881,11 @@ class twitter_context(socialmedia_context):
     def get_filenames(self) -> list[str]:
         names = []
         if self.info_type == Info_type.IMAGES:
-            for k, url in enumerate(self.data):
+            for url in self.data:
                 temp = url.find("format=")
                 if temp != -1:
-                    name = f"{self.user}_{k:06d}" # url[url.rfind("/")+1:temp-1]
+                    # Named after the media id, so names don't change between runs
+                    name = f"{self.user}_{url[url.rfind('/')+1:temp-1]}"
                     ext = url[temp+7:]
                     f_index = ext.find("&")
                     if f_index != -1:
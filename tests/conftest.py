@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+import http.server
+import pytest
+# local imports, same as bench/run.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ratelimit import get_limiter
+
+
+class local_server:
+    """
+    http.server on a free localhost port. Each path is answered by
+    routes[path](request) -> (status, headers, body), every request
+    (its path and headers) is recorded in requests.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        owner = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                owner.requests.append((self.path, dict(self.headers)))
+                route = owner.routes.get(self.path.split("?")[0])
+                if route == None:
+                    status, headers, body = 404, {}, b""
+                else:
+                    status, headers, body = route(self)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if "Content-Length" not in headers:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval" : 0.05}, daemon=True)
+        self.thread.start()
+
+    def url(self, path:str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    res = local_server()
+    # Don't rate limit the tests, see src.ratelimit
+    get_limiter().set_rate("127.0.0.1", 0., 1)
+    yield res
+    res.close()
@@ -0,0 +1,41 @@
+import pytest
+# local imports
+from src.fast_parse import compare_backends, parse_memo
+from src import twitter_context as twitter, bsky_context as bsky
+from bench.fixtures import KINDS, page
+from bench.run import BSKY_AUTHOR
+
+# Every find function with both backends, and the fixture it parses: (kind, module, name, args)
+CASES = [
+    ("twitter_timeline", twitter, "tweets", ()),
+    ("twitter_following", twitter, "users", ()),
+    ("twitter_media", twitter, "images_media", ()),
+    ("twitter_status", twitter, "images_post", ("alice", )),
+    ("bsky_feed", bsky, "tweets", (BSKY_AUTHOR, )),
+    ("bsky_feed", bsky, "images", (BSKY_AUTHOR, )),
+]
+SIZES = [10, 200]
+
+
+def test_every_fixture_is_covered():
+    assert set(kind for kind, _, _, _ in CASES) == set(KINDS)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("kind, module, name, args", CASES, ids=[f"{c[0]}-{c[2]}" for c in CASES])
+def test_lxml_matches_bs4(kind, module, name, args, size):
+    page_source = page(kind, size)
+    reference, fast = module.PARSERS["bs4"][name], module.PARSERS["lxml"][name]
+    assert compare_backends(reference, fast, page_source, *args) == []
+    assert len(reference(page_source, *args)) > 0
+
+
+@pytest.mark.parametrize("backend", ["bs4", "lxml"])
+def test_memo_reuses_tweets(backend):
+    page_source = page("twitter_timeline", 50)
+    find = twitter.PARSERS[backend]["tweets"]
+    memo = parse_memo()
+    expected = find(page_source)
+    assert find(page_source, memo=memo) == expected
+    assert find(page_source, memo=memo) == expected
+    assert (memo.misses, memo.hits) == (50, 50)
@@ -0,0 +1,84 @@
+import io
+import json
+import contextlib
+from urllib.parse import urlsplit, parse_qs
+# local imports
+from src.common import Info_type
+from src.bsky_api import bsky_client, bsky_api_context
+
+HANDLE = "bob.bsky.social"
+PAGES = 3
+PER_PAGE = 5
+FEED = "/xrpc/app.bsky.feed.getAuthorFeed"
+
+
+def feed_item(i:int) -> dict:
+    return {"post" : {
+        "uri" : f"at://did:plc:bob/app.bsky.feed.post/r{i}",
+        "author" : {"handle" : HANDLE, "displayName" : "Bob"},
+        "indexedAt" : f"2024-01-01T00:00:{i:02d}.000Z",
+        "record" : {"text" : f"post {i}"},
+        "likeCount" : i,
+    }}
+
+
+def json_response(data:dict, status:int=200, headers:dict=None):
+    return status, {"Content-Type" : "application/json", **(headers or {})}, json.dumps(data).encode()
+
+
+def author_feed(request):
+    """Pages of PER_PAGE posts, the cursor is the index of the next one"""
+    params = parse_qs(urlsplit(request.path).query)
+    start = int(params.get("cursor", ["0"])[0])
+    stop = min(start + PER_PAGE, PAGES * PER_PAGE)
+    page = {"feed" : [feed_item(i) for i in range(start, stop)]}
+    if stop < PAGES * PER_PAGE:
+        page["cursor"] = str(stop)
+    return json_response(page)
+
+
+def feed_requests(server) -> list[dict]:
+    return [parse_qs(urlsplit(path).query) for path, _ in server.requests if path.startswith(FEED)]
+
+
+def test_paginate_follows_cursor(server):
+    server.routes[FEED] = author_feed
+    client = bsky_client(server.url(""))
+    pages = list(client.author_feed(HANDLE))
+    assert [len(page) for page in pages] == [PER_PAGE] * PAGES
+    uris = [item["post"]["uri"] for page in pages for item in page]
+    assert uris == [feed_item(i)["post"]["uri"] for i in range(PAGES * PER_PAGE)]
+    # No cursor on the first request, then the one of the previous page
+    assert [params.get("cursor") for params in feed_requests(server)] == [None, ["5"], ["10"]]
+    assert all(params["actor"] == [HANDLE] for params in feed_requests(server))
+
+
+def test_paginate_stops_on_empty_page(server):
+    server.routes[FEED] = lambda request: json_response({"feed" : [], "cursor" : "again"})
+    client = bsky_client(server.url(""))
+    assert list(client.author_feed(HANDLE)) == [[]]
+    assert len(feed_requests(server)) == 1
+
+
+def test_paginate_retries_a_page(server):
+    failed = []
+    def flaky(request):
+        if "cursor=5" in request.path and len(failed) == 0:
+            failed.append(request.path)
+            return json_response({}, 429, {"Retry-After" : "0"})
+        return author_feed(request)
+    server.routes[FEED] = flaky
+    client = bsky_client(server.url(""), backoff=0.)
+    pages = list(client.author_feed(HANDLE))
+    assert sum(len(page) for page in pages) == PAGES * PER_PAGE
+    assert [params.get("cursor") for params in feed_requests(server)] == [None, ["5"], ["5"], ["10"]]
+
+
+def test_api_context_collects_every_page(server):
+    server.routes[FEED] = author_feed
+    server.routes["/xrpc/app.bsky.actor.getProfile"] = lambda request: json_response({"handle" : HANDLE})
+    context = bsky_api_context(user=HANDLE, info_type=Info_type.TWEETS, api_base=server.url(""))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert context.fetch("")
+    assert [post["url"] for post in context.data] == \
+            [f"https://bsky.app/profile/{HANDLE}/post/r{i}" for i in range(PAGES * PER_PAGE)]
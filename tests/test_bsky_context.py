@@ -0,0 +1,34 @@
+import time
+import pytest
+# local imports
+from src.bsky_context import api_date, post_from_api
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize("indexed_at", [
+    "2024-01-05T13:00:00.000Z", "2024-01-05T13:00:00Z", "2024-01-05T13:00:00.123456Z",
+    "2024-01-05T13:00:00.1234567Z", "2024-01-05T13:00:00.12+00:00",
+])
+def test_api_date(utc, indexed_at):
+    assert api_date(indexed_at) == "Jan 5, 2024 at 1:00 PM"
+
+
+def test_post_from_api(utc):
+    item = {"post" : {
+        "uri" : "at://did:plc:bob/app.bsky.feed.post/3kabc",
+        "author" : {"handle" : "bob.bsky.social"},
+        "indexedAt" : "2024-01-05T00:30:00.000Z",
+        "record" : {"text" : "hi"},
+    }}
+    post = post_from_api(item, "bob.bsky.social")
+    assert post["date"] == "Jan 5, 2024 at 12:30 AM"
+    assert post["url"] == "https://bsky.app/profile/bob.bsky.social/post/3kabc"
+    assert post_from_api(item, "alice.bsky.social") == None
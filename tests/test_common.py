@@ -0,0 +1,27 @@
+import pytest
+# local imports
+from src import common
+from src.common import Info_type
+from src.twitter_context import twitter_context
+from src.bsky_context import bsky_context
+
+
+class closing_browser:
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("context, bidi", [
+    (twitter_context("alice", info_type=Info_type.TWEETS, capture=True), True),
+    (twitter_context("alice", info_type=Info_type.TWEETS, capture=False), False),
+    # No capture for them, see new_capture
+    (twitter_context("alice", info_type=Info_type.IMAGES, capture=True), False),
+    (bsky_context("bob", info_type=Info_type.IMAGES, capture=True), False),
+])
+def test_bidi_only_when_capture_is_installed(monkeypatch, context, bidi):
+    opened, ran = [], []
+    monkeypatch.setattr(common, "open_browser", lambda lean, bidi: opened.append(bidi) or closing_browser())
+    monkeypatch.setattr(common, "run_context", lambda browser, url, context, capture: ran.append(capture) or True)
+    assert common.get_items_from_url("https://x.com/alice", "", context)
+    assert opened == [bidi]
+    assert (ran[0] != None) == bidi
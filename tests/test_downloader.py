@@ -0,0 +1,147 @@
+import os
+import gzip
+# local imports
+from src.downloader import downloader, resume_journal
+from src.ratelimit import get_limiter
+
+BODY = os.urandom(100000)
+
+
+def ok(request):
+    return 200, {}, BODY
+
+
+def failing(statuses:list, headers:dict=None):
+    """Answers with each of statuses in turn, then with BODY"""
+    calls = []
+    def route(request):
+        calls.append(request.path)
+        if len(calls) <= len(statuses):
+            return statuses[len(calls) - 1], headers or {}, b""
+        return 200, {}, BODY
+    return route
+
+
+def test_download(server, tmp_path):
+    server.routes["/a.jpg"] = ok
+    path = str(tmp_path / "a.jpg")
+    assert downloader(workers=1).download(server.url("/a.jpg"), path)
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert not os.path.exists(path + ".part")
+
+
+def test_retry_on_429_and_5xx(server, tmp_path):
+    server.routes["/a.jpg"] = failing([429, 503, 500], {"Retry-After" : "0"})
+    path = str(tmp_path / "a.jpg")
+    assert downloader(workers=1, retries=3, backoff=0.01).download(server.url("/a.jpg"), path)
+    assert len(server.requests) == 4
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+
+
+def test_gives_up_after_retries(server, tmp_path):
+    server.routes["/a.jpg"] = failing([502] * 10)
+    path = str(tmp_path / "a.jpg")
+    assert not downloader(workers=1, retries=2, backoff=0.01).download(server.url("/a.jpg"), path)
+    assert len(server.requests) == 3
+    assert not os.path.exists(path)
+
+
+def test_no_retry_on_404(server, tmp_path):
+    path = str(tmp_path / "a.jpg")
+    assert not downloader(workers=1, retries=3, backoff=0.01).download(server.url("/missing.jpg"), path)
+    assert len(server.requests) == 1
+
+
+def test_download_all(server, tmp_path):
+    for i in range(20):
+        server.routes[f"/{i}.jpg"] = ok
+    engine = downloader(workers=4, per_host=2)
+    urls = [server.url(f"/{i}.jpg") for i in range(20)]
+    paths = [str(tmp_path / f"{i}.jpg") for i in range(20)]
+    assert engine.download_all(urls, paths) == 20
+    assert engine.bytes == 20 * len(BODY)
+
+
+def ranged(body:bytes, etag:str, cut:int=0):
+    """
+    Serves body honoring Range/If-Range, the first response (if cut > 0)
+    only sends cut bytes of it, as if the connection dropped
+    """
+    calls = []
+    def route(request):
+        calls.append(request.path)
+        length = len(body)
+        if (cut > 0) and (len(calls) == 1):
+            return 200, {"ETag" : etag, "Content-Length" : str(length)}, body[:cut]
+        value = request.headers.get("Range")
+        if (value != None) and (request.headers.get("If-Range") in (None, etag)):
+            start = int(value.removeprefix("bytes=").split("-")[0])
+            if start >= length:
+                return 416, {"Content-Range" : f"bytes */{length}"}, b""
+            return 206, {"ETag" : etag, "Content-Range" : f"bytes {start}-{length - 1}/{length}"}, body[start:]
+        return 200, {"ETag" : etag}, body
+    return route
+
+
+def test_resume_with_range(server, tmp_path):
+    server.routes["/a.jpg"] = ranged(BODY, '"v1"', cut=30000)
+    path = str(tmp_path / "a.jpg")
+    assert not downloader(workers=1, retries=0, chunk_size=1024).download(server.url("/a.jpg"), path)
+    offset = os.path.getsize(path + ".part")
+    assert 0 < offset <= 30000
+    assert resume_journal(str(tmp_path)).get(path)["validator"] == '"v1"'
+    assert downloader(workers=1, retries=0).download(server.url("/a.jpg"), path)
+    _, headers = server.requests[-1]
+    assert headers["Range"] == f"bytes={offset}-"
+    assert headers["If-Range"] == '"v1"'
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert resume_journal(str(tmp_path)).get(path) == None
+    assert not os.path.exists(path + ".part")
+
+
+def test_changed_file_is_downloaded_again(server, tmp_path):
+    server.routes["/a.jpg"] = ranged(BODY, '"v1"', cut=30000)
+    path = str(tmp_path / "a.jpg")
+    assert not downloader(workers=1, retries=0, chunk_size=1024).download(server.url("/a.jpg"), path)
+    assert os.path.getsize(path + ".part") > 0
+    # If-Range doesn't match anymore, the server sends all of the new file
+    new_body = os.urandom(50000)
+    server.routes["/a.jpg"] = ranged(new_body, '"v2"')
+    assert downloader(workers=1, retries=0).download(server.url("/a.jpg"), path)
+    with open(path, "rb") as file:
+        assert file.read() == new_body
+
+
+def test_416_restarts_without_slowing_down(server, tmp_path):
+    path = str(tmp_path / "a.jpg")
+    # A .part longer than the file on the server
+    with open(path + ".part", "wb") as file:
+        file.write(os.urandom(200000))
+    resume_journal(str(tmp_path)).set(path, {"url" : server.url("/a.jpg"), "size" : 300000, "validator" : None})
+    server.routes["/a.jpg"] = ranged(BODY, '"v1"')
+    penalties = get_limiter().report().get("127.0.0.1", {}).get("penalties", 0)
+    assert downloader(workers=1, retries=0).download(server.url("/a.jpg"), path)
+    assert [h.get("Range") for _, h in server.requests] == ["bytes=200000-", None]
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert get_limiter().report()["127.0.0.1"]["penalties"] == penalties
+
+
+def test_encoded_download_is_not_resumed(server, tmp_path):
+    encoded = gzip.compress(BODY)
+    calls = []
+    def route(request):
+        calls.append(request.path)
+        headers = {"Content-Encoding" : "gzip", "ETag" : '"v1"', "Content-Length" : str(len(encoded))}
+        return 200, headers, encoded[:len(encoded) // 2] if len(calls) == 1 else encoded
+    server.routes["/a.txt"] = route
+    path = str(tmp_path / "a.txt")
+    assert not downloader(workers=1, retries=0).download(server.url("/a.txt"), path)
+    assert resume_journal(str(tmp_path)).get(path) == None
+    assert downloader(workers=1, retries=0).download(server.url("/a.txt"), path)
+    assert "Range" not in server.requests[-1][1]
+    with open(path, "rb") as file:
+        assert file.read() == BODY
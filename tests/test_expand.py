@@ -0,0 +1,87 @@
+import io
+import contextlib
+import pytest
+# thirdparty
+from selenium.common.exceptions import NoSuchWindowException
+# local imports
+from src.common import Info_type
+from src.cache import scrape_cache
+from src.ratelimit import rate_limiter
+from src import twitter_context as twitter
+from bench.fixtures import status_article, wrap
+
+POSTS = [f"https://x.com/alice/status/{i}" for i in range(0, 50, 5)]
+
+
+class tabs_driver:
+    """
+    Stands in for a WebDriver with tabs, following the W3C rules expand_posts
+    depends on: closing a tab leaves the current context on it (closed), and
+    a new window can only be opened from an open one.
+    Each tab shows a status page with the photos of the post it loaded.
+    """
+    def __init__(self):
+        self.urls = {"main" : "https://x.com/alice/media"}
+        self.current = "main"
+        self.opened = 0
+        self.switch_to = self
+
+    @property
+    def current_window_handle(self) -> str:
+        self.__check()
+        return self.current
+
+    @property
+    def window_handles(self) -> list[str]:
+        return list(self.urls)
+
+    def new_window(self, kind:str):
+        self.__check()
+        self.opened += 1
+        self.current = f"tab{self.opened}"
+        self.urls[self.current] = "about:blank"
+
+    def window(self, handle:str):
+        if handle not in self.urls:
+            raise NoSuchWindowException(f"No window {handle}")
+        self.current = handle
+
+    def execute_script(self, script:str, *args):
+        self.__check()
+        self.urls[self.current] = args[0]
+
+    def close(self):
+        self.__check()
+        del self.urls[self.current]
+
+    @property
+    def page_source(self) -> str:
+        self.__check()
+        url = self.urls[self.current]
+        if "/status/" not in url:
+            return wrap("")
+        # Post i has 4 photos, see status_article
+        return wrap(status_article(int(url.rsplit("/", 1)[-1])))
+
+    def find_elements(self, by:str, value:str) -> list:
+        return [None] * self.page_source.count('data-testid="tweetPhoto"')
+
+    def __check(self):
+        if self.current not in self.urls:
+            raise NoSuchWindowException(f"No window {self.current}")
+
+
+@pytest.mark.parametrize("expand_tabs", [1, 3, 4])
+def test_expand_every_post(tmp_path, monkeypatch, expand_tabs):
+    cache = scrape_cache(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(twitter, "get_cache", lambda cache_dir: cache)
+    # Don't wait for x.com's rate, see src.ratelimit
+    monkeypatch.setattr(twitter, "get_limiter", lambda: rate_limiter({"*" : (0., 1)}))
+    context = twitter.twitter_context("alice", info_type=Info_type.IMAGES, expand_tabs=expand_tabs, expand_timeout=1.)
+    driver = tabs_driver()
+    with contextlib.redirect_stdout(io.StringIO()):
+        expanded = context.expand_posts(driver, POSTS)
+    assert list(expanded) == POSTS
+    assert all(len(imgs) == 4 for imgs in expanded.values())
+    # Back on the media tab, with no tab left open
+    assert (driver.current, driver.window_handles) == ("main", ["main"])
@@ -0,0 +1,16 @@
+import hashlib
+# local imports
+from src.media_store import file_sha256, normalize_media_url
+
+
+def test_file_sha256_in_chunks(tmp_path):
+    path = tmp_path / "image.jpg"
+    data = bytes(range(256)) * 1000
+    path.write_bytes(data)
+    assert file_sha256(str(path), chunk_size=1000) == hashlib.sha256(data).hexdigest()
+    assert file_sha256(str(path)) == hashlib.sha256(data).hexdigest()
+
+
+def test_normalize_media_url():
+    assert normalize_media_url("https://pbs.twimg.com/media/ID?format=jpg&name=small") == \
+            "https://pbs.twimg.com/media/ID?format=jpg"
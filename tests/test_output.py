@@ -0,0 +1,58 @@
+import os
+import gzip
+import pytest
+# local imports
+from src.output import ndjson_sink, read_ndjson
+
+RECORDS = [{"handle" : f"u{i}", "text" : "x" * 50} for i in range(20)]
+
+
+def write(path:str, records:list, compression:str="", append:bool=False):
+    with ndjson_sink(path, compression, append=append) as sink:
+        for record in records:
+            sink.write(record)
+
+
+def test_append_after_partial_line(tmp_path):
+    path = str(tmp_path / "tweets.ndjson")
+    write(path, RECORDS[:10])
+    # Crash in the middle of the last record
+    with open(path, "rb+") as file:
+        file.truncate(os.path.getsize(path) - 10)
+    assert list(read_ndjson(path)) == RECORDS[:9]
+    write(path, RECORDS[10:], append=True)
+    assert list(read_ndjson(path)) == RECORDS[:9] + RECORDS[10:]
+
+
+@pytest.mark.parametrize("cut", [0.5, 0.9])
+def test_append_after_truncated_gzip(tmp_path, cut):
+    path = str(tmp_path / "tweets.ndjson.gz")
+    write(path, RECORDS[:10], "gzip")
+    size = os.path.getsize(path)
+    with open(path, "rb+") as file:
+        file.truncate(int(size * cut))
+    with pytest.raises((EOFError, gzip.BadGzipFile)):
+        with gzip.open(path, "rt") as file:
+            file.read()
+    # Whatever is readable, without raising
+    recovered = list(read_ndjson(path))
+    assert recovered == RECORDS[:len(recovered)]
+    write(path, RECORDS[10:], "gzip", append=True)
+    records = list(read_ndjson(path))
+    assert records[len(records) - 10:] == RECORDS[10:]
+    assert records[:len(records) - 10] == RECORDS[:len(records) - 10]
+
+
+def test_append_to_complete_gzip(tmp_path):
+    path = str(tmp_path / "tweets.ndjson.gz")
+    write(path, RECORDS[:10], "gzip")
+    write(path, RECORDS[10:], "gzip", append=True)
+    assert list(read_ndjson(path)) == RECORDS
+
+
+def test_append_to_complete_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    path = str(tmp_path / "tweets.ndjson.zst")
+    write(path, RECORDS[:10], "zstd")
+    write(path, RECORDS[10:], "zstd", append=True)
+    assert list(read_ndjson(path)) == RECORDS
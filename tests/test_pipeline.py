@@ -0,0 +1,28 @@
+import io
+import contextlib
+# local imports
+from src.common import continuously_scroll, dedup_index, feed_items
+from src.scroll import adaptive_scroller
+from src import twitter_context as twitter
+from bench.replay import replay_driver
+from bench.run import WINDOWS
+
+KIND = "twitter_timeline"
+SIZE = 400
+
+
+def scroll(workers:int) -> list:
+    driver = replay_driver(KIND, SIZE, window=WINDOWS[KIND])
+    scroller = adaptive_scroller(twitter.TWEET_XPATH, min_delay=0., end_after=0.)
+    with contextlib.redirect_stdout(io.StringIO()):
+        things, _ = continuously_scroll(driver, 3600., twitter.find_tweets_lxml,
+                delta=feed_items(twitter.TWEET_XPATH), index=dedup_index(twitter.tweet_key, update_seen=True),
+                workers=workers, scroller=scroller)
+    return things
+
+
+def test_pipeline_matches_serial_on_virtualized_timeline():
+    serial = scroll(0)
+    assert len(serial) == SIZE
+    piped = scroll(2)
+    assert sorted(map(twitter.tweet_key, piped)) == sorted(map(twitter.tweet_key, serial))
@@ -0,0 +1,53 @@
+import time
+import pytest
+# local imports
+from src.ratelimit import rate_limiter, token_bucket
+
+URL = "https://example.com/a"
+
+
+def limiter() -> rate_limiter:
+    return rate_limiter({"*" : (10., 2)})
+
+
+def test_burst_then_rate():
+    bucket = token_bucket(10., 2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0., 0.]
+    assert waits[2:] == pytest.approx([0.1, 0.2], abs=0.01)
+
+
+@pytest.mark.parametrize("status", [None, 200, 404, 416])
+def test_only_slowdown_status_penalize(status):
+    res = limiter()
+    res.feedback(URL, status)
+    assert res.report().get("example.com", {}).get("penalties", 0) == 0
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_slowdown_and_recovery(status):
+    res = limiter()
+    res.feedback(URL, status)
+    stats = res.report()["example.com"]
+    assert (stats["penalties"], stats["slowdown"]) == (1, 2.)
+    res.feedback(URL, 200)
+    assert res.report()["example.com"]["slowdown"] < 2.
+
+
+def test_waiters_spaced_after_retry_after():
+    # What rate_limiter.penalize leaves after a 429 with Retry-After: 1
+    bucket = token_bucket(10., 2)
+    bucket.set_slowdown(2.)
+    bucket.tokens = 0.
+    bucket.blocked_until = time.monotonic() + 1.
+    waits = [bucket.reserve() for _ in range(4)]
+    # Queued requests don't all fire when the block ends, they keep the slowed rate (5/s)
+    assert waits == pytest.approx([1.2, 1.4, 1.6, 1.8], abs=0.05)
+
+
+def test_no_tokens_earned_while_blocked():
+    bucket = token_bucket(10., 2)
+    bucket.tokens = 0.
+    bucket.blocked_until = time.monotonic() + 0.3
+    time.sleep(0.2)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.05)
@@ -0,0 +1,61 @@
+import io
+import json
+import contextlib
+from urllib.parse import urlsplit, parse_qs
+# local imports
+import wssocial
+from src import cache
+from src.daemon import watch_target
+
+HANDLE = "bob.bsky.social"
+PER_PAGE = 5
+FEED = "/xrpc/app.bsky.feed.getAuthorFeed"
+
+
+def image_item(server, i:int) -> dict:
+    return {"post" : {
+        "uri" : f"at://did:plc:bob/app.bsky.feed.post/r{i}",
+        "author" : {"handle" : HANDLE},
+        "indexedAt" : "2024-01-01T00:00:00.000Z",
+        "record" : {"text" : f"post {i}"},
+        "embed" : {"$type" : "app.bsky.embed.images#view",
+            "images" : [{"thumb" : server.url(f"/img/feed_thumbnail/plain/did/c{i}@jpeg")}]},
+    }}
+
+
+def serve_feed(server, posts:list[int]):
+    """Feed of posts (newest first) in pages of PER_PAGE, and their images"""
+    def author_feed(request):
+        start = int(parse_qs(urlsplit(request.path).query).get("cursor", ["0"])[0])
+        page = {"feed" : [image_item(server, i) for i in posts[start:start + PER_PAGE]]}
+        if start + PER_PAGE < len(posts):
+            page["cursor"] = str(start + PER_PAGE)
+        return 200, {"Content-Type" : "application/json"}, json.dumps(page).encode()
+    server.routes[FEED] = author_feed
+    server.routes["/xrpc/app.bsky.actor.getProfile"] = lambda request: (200, {}, json.dumps({"handle" : HANDLE}).encode())
+    for i in posts:
+        server.routes[f"/img/feed_thumbnail/plain/did/c{i}@jpeg"] = lambda request, i=i: (200, {}, f"image {i}".encode())
+
+
+def poll(server, target:watch_target) -> int:
+    """Runs a poll, returns the feed pages it requested"""
+    before = sum(1 for path, _ in server.requests if path.startswith(FEED))
+    with contextlib.redirect_stdout(io.StringIO()):
+        wssocial.watch_job_func(target, backend="api", api_base=server.url(""))
+    return sum(1 for path, _ in server.requests if path.startswith(FEED)) - before
+
+
+def test_image_polls_stop_at_known_images(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, "caches", {})
+    (tmp_path / "cookies.json").write_text("[]")
+    (tmp_path / "config.json").write_text(json.dumps({"cookie_path" : "cookies.json", "out_path" : "out"}))
+    target = watch_target("bsky", HANDLE, "images")
+    old = list(range(100, 60, -1))
+    serve_feed(server, old)
+    assert poll(server, target) == len(old) // PER_PAGE
+    # Two new posts on top, the poll ends a couple of pages after the known ones start
+    serve_feed(server, [102, 101] + old)
+    assert poll(server, target) < len(old) // PER_PAGE
+    names = sorted(path.name for path in (tmp_path / "out" / HANDLE).iterdir())
+    assert names == sorted(f"{HANDLE}_c{i}.jpeg" for i in [102, 101] + old)
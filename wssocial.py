@@ -1,16 +1,30 @@
 #!/usr/bin/python3
 import argparse
+import functools
 import logging
 import json
 import os
-from time import strftime
+from time import monotonic
 # local imports
 from src.common import Info_type, download_files, cache_scrape_func, get_items_from_url
 from src.twitter_context import twitter_context
 from src.bsky_context import bsky_context
+from src.bsky_api import API_BASE, bsky_api_context
+from src.output import COMPRESSIONS, FORMATS, ndjson_sink, export
+from src.browser_pool import browser_pool
+from src.media_store import media_store
+from src.state import scrape_state
+from src.fast_parse import BACKENDS
+from src.batch import batch_job, read_jobs, run_batch, summarize
+from src.daemon import parse_interval, read_watchlist, target_panic, watch_daemon, watch_target
+from src.metrics import PROFILERS, get_metrics
+from src.ratelimit import get_limiter, parse_rate
+from src.cache import log_cache_stats
 
 LOG_LEVEL = logging.INFO
 CONFIG_FILE = "config.json"
+# Status of a scrape that failed because the site kept showing its panic string
+PANIC_STATUS = 2
 
 
 def read_defaults(path:str):
@@ -20,12 +34,34 @@ def read_defaults(path:str):
     if not os.path.exists(cfile):
         raise Exception(f"Cookie path: {cfile} does not exist")
     opath = res["out_path"]
-    if not os.path.exists(opath):
-        os.mkdir(opath)
+    os.makedirs(opath, exist_ok=True)
     return cfile, opath
 
 
-def main_api(user:str, site:str, force_not_cache:bool, time:float, use_media:bool, data_type:str):
+def main_api(user:str, site:str, force_not_cache:bool, time:float, use_media:bool, data_type:str,
+        compression:str="", envelope:bool=True, pool=None, lean:bool=True, parser:str="lxml",
+        parse_workers:int=0, adaptive_scroll:bool=False, in_browser:bool=False,
+        capture:bool=False, backend:str="browser", api_base:str=API_BASE, out_format:str="json",
+        expand_tabs:int=4) -> int:
+    status, _ = scrape(user, site, force_not_cache, time, use_media, data_type,
+            compression=compression, envelope=envelope, pool=pool, lean=lean, parser=parser,
+            parse_workers=parse_workers, adaptive_scroll=adaptive_scroll, in_browser=in_browser,
+            capture=capture, backend=backend, api_base=api_base, out_format=out_format,
+            expand_tabs=expand_tabs)
+    return status
+
+
+def scrape(user:str, site:str, force_not_cache:bool, time:float, use_media:bool, data_type:str,
+        compression:str="", envelope:bool=True, pool=None, lean:bool=True, parser:str="lxml",
+        parse_workers:int=0, adaptive_scroll:bool=False, in_browser:bool=False,
+        capture:bool=False, backend:str="browser", api_base:str=API_BASE, out_format:str="json",
+        expand_tabs:int=4, bypass_cache:bool=False) -> tuple[int, int]:
+    """
+    Same as main_api, but also returns the number of items found.
+    bypass_cache scrapes images again even if cached, but unlike
+    force_not_cache still only gets what's new since the last run (for
+    images, since the last run that bypassed the cache, see scrape_state)
+    """
     # get defaults and variousd ata
     cookie_path, out_path = read_defaults(CONFIG_FILE)
 
@@ -40,9 +76,12 @@ def main_api(user:str, site:str, force_not_cache:bool, time:float, use_media:boo
         info_type = Info_type.BOOKMARKS
     else:
         logging.error(f"Can't get '{data_type}', has not been implemented/doesn't exist!")
-        return 1
+        return 1, 0
 
     if site == "twitter":
+        if backend == "api":
+            logging.error("twitter has no api backend!")
+            return 1, 0
         url = "https://x.com/" + user
         if use_media and info_type == Info_type.IMAGES:
             url += "/media"
@@ -53,69 +92,238 @@ def main_api(user:str, site:str, force_not_cache:bool, time:float, use_media:boo
             url = "https://x.com/i/bookmarks"
             user = ""
         context = twitter_context(user, info_type=info_type, 
-                use_media=use_media, high_quality=True, timeout=time)
+                use_media=use_media, high_quality=True, timeout=time, lean=lean, parser=parser,
+                parse_workers=parse_workers, adaptive_scroll=adaptive_scroll, in_browser=in_browser,
+                capture=capture, expand_tabs=expand_tabs)
     elif site == "bsky":
         url = "https://bsky.app/profile/" + user
-        if info_type == Info_type.FOLLOWERS:
-            logging.warning("Can't get followers, since it is not implemented for bsky backend yet!")
-        context = bsky_context(user, info_type=info_type, 
-                use_media=use_media, high_quality=True, timeout=time)
+        if backend == "api":
+            context = bsky_api_context(user, info_type=info_type,
+                    use_media=use_media, high_quality=True, timeout=time, api_base=api_base)
+        else:
+            if info_type == Info_type.FOLLOWERS:
+                logging.warning("Can't get followers with the browser backend, use the api backend!")
+            context = bsky_context(user, info_type=info_type, 
+                    use_media=use_media, high_quality=True, timeout=time, lean=lean, parser=parser,
+                    parse_workers=parse_workers, adaptive_scroll=adaptive_scroll, in_browser=in_browser,
+                    capture=capture)
         cookie_path = "" # bsky doesnt require cookies
     else:
         logging.error(f"{site} has no implemented backend!")
-        return 1
+        return 1, 0
+
+    # Tweets/users are streamed to disk while scraping, images are downloaded at the end
+    out_name = user if user != "" else "home"
+    out_file = os.path.join(out_path, f"{data_type}_{site}_{out_name}.json")
+    stream_file = out_file.removesuffix(".json") + ".ndjson" + COMPRESSIONS[compression]
+    if info_type != Info_type.IMAGES:
+        # Only get what's new since the last run, unless forced to get everything
+        incremental = (not force_not_cache) and os.path.exists(stream_file)
+        context.state = scrape_state(site, out_name, info_type)
+        if not incremental:
+            context.state.clear()
+        context.sink = ndjson_sink(stream_file, compression, append=incremental)
+    elif bypass_cache and not force_not_cache:
+        # Without the cached images tab, stop at the images the previous runs found
+        context.state = scrape_state(site, out_name, info_type)
 
     # Getting Data
-    if info_type == Info_type.IMAGES:
-        cache_scrape_func(url, context, bypass_cache=force_not_cache, 
-                cache_entire_source=False, cookie_path=cookie_path)
-    else:
-        get_items_from_url(url, cookie_path, context)
+    ok = True
+    try:
+        if info_type == Info_type.IMAGES:
+            ok = cache_scrape_func(url, context, bypass_cache=force_not_cache or bypass_cache, 
+                    cache_entire_source=False, cookie_path=cookie_path, pool=pool)
+        else:
+            ok = get_items_from_url(url, cookie_path, context, pool=pool)
+    finally:
+        if context.sink != None:
+            context.sink.close()
+            context.state.save()
 
     # Collecting/Saving data
-    stuff = context.get_data()
-    n = len(stuff)
+    if info_type == Info_type.IMAGES:
+        stuff = context.get_data()
+        n = len(stuff)
+    else:
+        n = context.sink.count
     logging.info(f"We found: {n} {data_type}")
     if n > 0:
         if info_type == Info_type.IMAGES:
             filenames = context.get_filenames()
             out_dir = os.path.join(out_path, user)
             logging.info(f"Outputing to: {out_dir}")
-            download_files(stuff, out_dir, filenames)
+            store = media_store(os.path.join(out_path, ".store"))
+            download_files(stuff, out_dir, filenames, store=store, user=user)
             logging.info(f"Finished downloading images.")
+            if context.state != None:
+                # Only once downloaded, the next run stops at them
+                context.state.save()
         else:
-            if user == "": user = "home"
-            out_file = os.path.join(out_path, f"{data_type}_{site}_{user}.json") 
-            logging.info(f"Outputing to: {out_file}")
-            with open(out_file, "w") as file:
-                now = strftime("%H:%M:%S-%d/%m/%Y")
-                file.write("{\n\"date\" : \"" + now + "\",\n")
-                file.write(f"\"{data_type}\" : [\n")
-                for i, element in enumerate(stuff):
-                    json.dump(element, file, indent=4)
-                    if i < n-1: file.write(", \n")
-                file.write("]\n}")
+            logging.info(f"Streamed to: {stream_file}")
+            if envelope:
+                out_file, _ = export(stream_file, out_file.removesuffix(".json"), out_format, data_type,
+                        context.item_key, context.record_type())
+                logging.info(f"Outputing to: {out_file}")
             logging.info(f"All {data_type} have been saved.")
     else:
         logging.info(f"Nothing to download/save.")
 
+    if not ok:
+        return (PANIC_STATUS if context.panic != "" else 1), n
+    return 0, n
+
+
+def scrape_options(args) -> dict:
+    """Keyword arguments of scrape given in the command line, shared by every batch job/watched target"""
+    return dict(compression=args.compress, envelope=not args.no_json, lean=not args.full_browser,
+            parser=args.parser, parse_workers=args.parse_workers, adaptive_scroll=args.adaptive_scroll,
+            in_browser=args.in_browser, capture=args.capture, backend=args.backend, api_base=args.api_base,
+            out_format=args.format, expand_tabs=args.expand_tabs)
+
+
+def batch_job_func(job:batch_job, pool=None, **options) -> int:
+    """Runs a batch_job with the scrape options, see src.batch.run_batch"""
+    status, n = scrape(job.user, job.site, False, job.timeout, True, job.data_type, pool=pool, **options)
+    if status != 0:
+        raise Exception(f"Scraping {job.data_type} of '{job.user}' in {job.site} failed")
+    return n
+
+
+def main_batch(jobs_file:str, workers:int, use_processes:bool, time:float, options:dict=None) -> int:
+    _, out_path = read_defaults(CONFIG_FILE)
+    jobs = read_jobs(jobs_file, default_timeout=time)
+    logging.info(f"Running {len(jobs)} jobs with {workers} workers")
+    start = monotonic()
+    if use_processes:
+        # Each process opens its own browser
+        results = run_batch(jobs, functools.partial(batch_job_func, **(options or {})),
+                workers=workers, use_processes=True)
+    else:
+        with browser_pool(max_sessions=workers) as pool:
+            results = run_batch(jobs, functools.partial(batch_job_func, pool=pool, **(options or {})),
+                    workers=workers)
+    summary = summarize(results, monotonic() - start)
+    out_file = os.path.join(out_path, "batch_summary.json")
+    with open(out_file, "w") as file:
+        json.dump(summary, file, indent=4)
+    logging.info(f"Batch summary saved to: {out_file}")
+    return 0 if summary["failed"] == 0 else 1
+
+
+def watch_job_func(target:watch_target, pool=None, **options) -> int:
+    """Polls a watch_target, only getting what's new since its last poll, see src.daemon.watch_daemon"""
+    # A cached images tab would hide new images until it expires, the
+    # scrape_state of the target stops each poll at what the previous ones found
+    status, n = scrape(target.user, target.site, False, target.timeout, True, target.data_type,
+            pool=pool, bypass_cache=True, **options)
+    if status == PANIC_STATUS:
+        raise target_panic(f"{target.site} kept asking to reload for '{target.user}'")
+    if status != 0:
+        raise Exception(f"Scraping {target.data_type} of '{target.user}' in {target.site} failed")
+    return n
+
+
+def main_watch(watch_file:str, workers:int, time:float, interval:float, status_file:str="",
+        status_port:int=0, options:dict=None) -> int:
+    _, out_path = read_defaults(CONFIG_FILE)
+    targets = read_watchlist(watch_file, default_interval=interval, default_timeout=time)
+    if len(targets) == 0:
+        logging.error(f"No targets to watch in: {watch_file}")
+        return 1
+    if status_file == "":
+        status_file = os.path.join(out_path, "watch_status.json")
+    logging.info(f"Writing watch status to: {status_file}")
+    # Browsers are kept open (and logged in) between polls
+    with browser_pool(max_sessions=workers) as pool:
+        daemon = watch_daemon(targets, functools.partial(watch_job_func, pool=pool, **(options or {})),
+                workers=workers, status_file=status_file)
+        if status_port > 0:
+            daemon.serve(status_port)
+        daemon.run()
     return 0
 
 
+def save_metrics(metrics_file:str, prom_file:str, profile_file:str, labels:dict):
+    """Saves what get_metrics measured, to the files that aren't empty"""
+    metrics = get_metrics()
+    metrics.log_summary()
+    get_limiter().log_summary()
+    log_cache_stats()
+    if metrics_file != "":
+        metrics.save_json(metrics_file)
+    if prom_file != "":
+        metrics.save_prometheus(prom_file, labels)
+    if profile_file != "":
+        metrics.save_profile(profile_file)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='main', description='Downloads data/images from twitter user.')
     parser.add_argument('-u', '--user', type=str, help="Username from which we download data, set empty to set it to home tab")
-    parser.add_argument('-f', '--force', default=False, action='store_true', help="Force download all tweets/images, instead of using cache.")
+    parser.add_argument('-f', '--force', default=False, action='store_true', help="Force download all tweets/images, instead of using cache or only getting the new ones.")
     parser.add_argument('-t', '--time', default=10*60., type=float, help="Maximum time the program will use to download data.") 
     parser.add_argument('-m', '--media', default=True, action='store_true', help="Use media tab when getting images.") 
     parser.add_argument('-g', '--get', default="tweets", type=str, choices=["tweets", "images", "followers", "bookmarks"], help="What type of data to download.") 
     parser.add_argument('-s', '--site', default="twitter", type=str, choices=["twitter", "bsky"], help="Which site to download the data from") 
+    parser.add_argument('-c', '--compress', default="", type=str, choices=list(COMPRESSIONS), help="Compression of the streamed .ndjson output.") 
+    parser.add_argument('--no-json', default=False, action='store_true', help="Only stream the .ndjson output, don't write the final .json file.") 
+    parser.add_argument('--format', default="json", type=str, choices=list(FORMATS), help="Format of the final output, ndjson compacts the streamed file (see --compress), parquet/arrow need pyarrow.") 
+    parser.add_argument('-p', '--parser', default="lxml", type=str, choices=BACKENDS, help="Html parser backend, bs4 is slower but is the reference implementation.") 
+    parser.add_argument('--parse-workers', default=0, type=int, help="Number of processes parsing pages while the browser scrolls, 0 parses in between scrolls.") 
+    parser.add_argument('--adaptive-scroll', default=False, action='store_true', help="Scroll as fast as the feed loads and stop as soon as it ends, instead of a fixed pace.") 
+    parser.add_argument('--in-browser', default=False, action='store_true', help="Extract tweets/users inside the browser, only parsing the page in python if that fails.") 
+    parser.add_argument('--capture', default=False, action='store_true', help="Get tweets/users from the api responses the page receives, instead of parsing it.") 
+    parser.add_argument('--backend', default="browser", type=str, choices=["browser", "api"], help="How to get the data, the api backend (bsky only) doesn't need a browser.") 
+    parser.add_argument('--api-base', default=API_BASE, type=str, help="Url of the bsky api, for the api backend.") 
+    parser.add_argument('--expand-tabs', default=4, type=int, help="Multiple image posts loaded at once (in browser tabs) when getting twitter images.") 
+    parser.add_argument('--full-browser', default=False, action='store_true', help="Use a visible browser loading everything, even for text only data.") 
+    parser.add_argument('--metrics', default="", type=str, help="File to save the time spent in each phase (browser startup, parsing, downloads...) to, as json.") 
+    parser.add_argument('--prom-file', default="", type=str, help="File to save the metrics to in the Prometheus text format, for node_exporter's textfile collector.") 
+    parser.add_argument('--profile', default="", type=str, help="Phase to profile, like process, parse or download (see --metrics for all of them).") 
+    parser.add_argument('--profiler', default="cprofile", type=str, choices=PROFILERS, help="Profiler of --profile, sample saves collapsed stacks for flamegraphs.") 
+    parser.add_argument('--profile-out', default="", type=str, help="File to save the profile to, defaults to <phase>.prof or <phase>.stacks.") 
+    parser.add_argument('--rate', default=[], action='append', type=parse_rate, help="Requests per second allowed to a domain (and its subdomains), like x.com=0.5 or twimg.com=10/20 with a burst of 20, 0 is unlimited. Can be repeated.") 
+    parser.add_argument('-b', '--batch', default="", type=str, help="File with one 'site user data_type [time]' job per line, to scrape many users at once.") 
+    parser.add_argument('-w', '--workers', default=2, type=int, help="Number of browsers running batch jobs concurrently.") 
+    parser.add_argument('--processes', default=False, action='store_true', help="Run each batch job in its own process, so it can be killed when it times out.") 
+    parser.add_argument('-W', '--watch', default="", type=str, help="File with one 'site user data_type [interval [timeout]]' target per line, to keep polling them for new items.") 
+    parser.add_argument('--interval', default=3600., type=parse_interval, help="Default time between polls of a watched target, like 900, 15m or 2h.") 
+    parser.add_argument('--status-file', default="", type=str, help="File to write the watch queue and per target latency to, defaults to watch_status.json in out_path.") 
+    parser.add_argument('--status-port', default=0, type=int, help="Local port serving the watch status (/status) and metrics (/metrics), 0 to disable.") 
     args = parser.parse_args()
 
     # Set logger
     fmt = "[%(levelname)s] %(message)s"
     logging.basicConfig(level=LOG_LEVEL, format=fmt)
 
+    profile_file = ""
+    if args.profile != "":
+        get_metrics().profile(args.profile, args.profiler)
+        profile_file = args.profile_out
+        if profile_file == "":
+            profile_file = args.profile + (".prof" if args.profiler == "cprofile" else ".stacks")
+
+    for domain, rate, burst in args.rate:
+        get_limiter().set_rate(domain, rate, burst)
+
     # Call the function
     user = "" if args.user == None else args.user
-    main_api(user, args.site, args.force, args.time, args.media, args.get)
+    if args.batch != "":
+        labels = {"batch" : os.path.basename(args.batch)}
+    elif args.watch != "":
+        labels = {"watch" : os.path.basename(args.watch)}
+    else:
+        labels = {"site" : args.site, "user" : user, "data_type" : args.get}
+    options = scrape_options(args)
+    status = 0
+    try:
+        if args.batch != "":
+            status = main_batch(args.batch, args.workers, args.processes, args.time, options)
+        elif args.watch != "":
+            status = main_watch(args.watch, args.workers, args.time, args.interval,
+                    args.status_file, args.status_port, options)
+        else:
+            status = main_api(user, args.site, args.force, args.time, args.media, args.get, **options)
+    finally:
+        save_metrics(args.metrics, args.prom_file, profile_file, labels)
+    exit(status)